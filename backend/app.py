@@ -6,19 +6,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 def create_app():
+    # No database work happens here: schema creation and migrations are
+    # an explicit step (python migrations.py) run once per deploy, so
+    # workers and scripts start without introspecting the schema
     app = Flask(__name__)
     
     # Database configuration
     # Use PostgreSQL in production, SQLite in development
-    database_url = os.getenv('DATABASE_URL')
-    if database_url:
-        # Fix for Railway/Render PostgreSQL URL
-        if database_url.startswith('postgres://'):
-            database_url = database_url.replace('postgres://', 'postgresql://', 1)
-        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-    else:
-        # Development: SQLite
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///charging_station.db'
+    from database import database_url, engine_options
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -36,19 +33,24 @@ def create_app():
     # Import db from models
     from models import db
     db.init_app(app)
-    
-    with app.app_context():
-        from models import VehicleMaster, ChargeSession, User
-        db.create_all()
+
+    import metrics
+    metrics.init_app(app)
+
+    import compression
+    compression.init_app(app)
     
     from routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
     return app
 
-app = create_app()
-
 if __name__ == '__main__':
+    app = create_app()
+    # The development server migrates on start for convenience
+    with app.app_context():
+        from migrations import upgrade
+        upgrade()
     port = int(os.getenv('PORT', 5001))
     debug = os.getenv('FLASK_DEBUG', 'True') == 'True'
     app.run(host='0.0.0.0', port=port, debug=debug)
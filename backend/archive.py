@@ -0,0 +1,125 @@
+# Hot/archive split of charge sessions.
+#
+# charge_sessions holds in-progress and recently completed sessions, which
+# is all that starting, ending and polling sessions and the day's stats
+# touch. Completed sessions whose end_time is older than ARCHIVE_AFTER_DAYS
+# are moved to charge_sessions_archive by this script, in batches, keeping
+# their session_id, so the hot table and its indexes stay small.
+#
+# Readers call session_source() with the oldest end_time they need. It
+# returns ChargeSession itself when the archive cannot hold matching rows,
+# otherwise an alias of ChargeSession over charge_sessions UNION ALL
+# charge_sessions_archive, so the same filters, ordering and to_dict()
+# work on both.
+#
+# Usage (daily scheduled task):
+#   python archive.py
+#   python archive.py --days 30 --batch-size 10000
+#   python archive.py --dry-run
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlalchemy.orm import aliased
+from models import db, ChargeSession, ChargeSessionArchive
+import response_cache
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+BATCH_SIZE = 5000
+
+_COLUMNS = [column.name for column in ChargeSession.__table__.columns]
+
+
+def archived_until():
+    """Latest end_time in the archive, or None if it is empty."""
+    return db.session.query(func.max(ChargeSessionArchive.end_time)).scalar()
+
+
+def needs_archive(since=None, status=None):
+    """Whether sessions with end_time >= since (any if None) and the given
+    status (any if None) may be in the archive, which only holds completed
+    sessions."""
+    if status is not None and status != 'COMPLETED':
+        return False
+    until = archived_until()
+    if until is None:
+        return False
+    return since is None or since <= until
+
+
+def archived_session(session_id):
+    """The archived copy of a session, or None if it was never archived."""
+    return db.session.get(ChargeSessionArchive, session_id)
+
+
+def session_source(since=None, status=None):
+    """ChargeSession, or an alias of it covering the archive as well when
+    needs_archive(since, status). Query it with db.session.query()."""
+    if not needs_archive(since, status):
+        return ChargeSession
+    hot = ChargeSession.__table__
+    cold = ChargeSessionArchive.__table__
+    sessions = union_all(
+        select(*[hot.c[name] for name in _COLUMNS]),
+        select(*[cold.c[name] for name in _COLUMNS]),
+    ).subquery('all_sessions')
+    return aliased(ChargeSession, sessions)
+
+
+def archive_sessions(conn, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, dry_run=False):
+    """Move completed sessions that ended more than days ago from
+    charge_sessions to charge_sessions_archive on conn, committing every
+    batch_size rows. Returns the number of sessions moved (or that would
+    be, with dry_run)."""
+    hot = ChargeSession.__table__
+    cold = ChargeSessionArchive.__table__
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    # The newest row always stays: SQLite hands out max(session_id) + 1 as
+    # the next id, and an id must never be reused once it is archived
+    newest = select(func.max(hot.c.session_id)).scalar_subquery()
+    due = (
+        select(hot.c.session_id, hot.c.station_name)
+        .where(hot.c.status == 'COMPLETED', hot.c.end_time < cutoff, hot.c.session_id < newest)
+        .order_by(hot.c.session_id)
+    )
+    if dry_run:
+        return conn.execute(select(func.count()).select_from(due.subquery())).scalar()
+
+    moved = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(due.where(hot.c.session_id > last_id).limit(batch_size)).all()
+        if not rows:
+            break
+        ids = [row.session_id for row in rows]
+        conn.execute(insert(cold).from_select(
+            _COLUMNS, select(*[hot.c[name] for name in _COLUMNS]).where(hot.c.session_id.in_(ids))
+        ))
+        conn.execute(delete(hot).where(hot.c.session_id.in_(ids)))
+        conn.commit()
+        response_cache.bump({row.station_name for row in rows})
+        moved += len(ids)
+        last_id = ids[-1]
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old completed sessions to charge_sessions_archive.')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='archive sessions that ended more than this many days ago')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='count what would be moved')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        with db.engine.connect() as conn:
+            moved = archive_sessions(conn, args.days, args.batch_size, args.dry_run)
+        elapsed = time.perf_counter() - started
+    if args.dry_run:
+        print(f"Dry run: {moved} sessions would be archived")
+    else:
+        print(f"Archived {moved} sessions in {elapsed:.1f}s")
@@ -0,0 +1,107 @@
+# Bounded TTL cache of authenticated principals, keyed by JWT.
+#
+# token_required looks a token up here before decoding it and querying the
+# users table, so steady-state polling does no user lookups. Entries expire
+# after AUTH_CACHE_TTL seconds (or at the token's exp, whichever is first)
+# and are dropped as soon as the user row is updated or deleted through the
+# ORM in this process; the TTL bounds staleness for changes made elsewhere.
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import User
+
+
+class Principal:
+    # Detached, read-only snapshot of a User, safe to share across requests
+    __slots__ = ('id', 'username', 'role')
+
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'role': self.role
+        }
+
+
+class PrincipalCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token -> (principal, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, user, token_exp=None):
+        principal = Principal(user.id, user.username, user.role)
+        expires_at = time.time() + self.ttl
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._entries[token] = (principal, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [t for t, (p, _) in self._entries.items() if p.id == user_id]
+            for token in stale:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+principal_cache = PrincipalCache(
+    maxsize=int(os.getenv('AUTH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('AUTH_CACHE_TTL', 60))
+)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _users_bulk_changed(orm_execute_state):
+    # Query.update()/delete() bypass the per-row events above
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is User:
+            principal_cache.clear()
@@ -0,0 +1,11 @@
+# Benchmark suite for the backend API.
+#
+#   python -m benchmarks.generate --vehicles 50000 --sessions 2000000
+#   python -m benchmarks.load --concurrency 8 --requests 200
+#   python -m benchmarks.compare results/old.json results/new.json
+#   python -m benchmarks.concurrency --operators 4 --managers 4
+#   python -m benchmarks.startup --runs 10
+#   python -m benchmarks.serialization --rows 1000 --runs 20
+#
+# Run from the backend directory. Point DATABASE_URL at a scratch database,
+# the generator writes millions of rows.
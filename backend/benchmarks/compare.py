@@ -0,0 +1,80 @@
+# Compare two load results and flag per-endpoint regressions.
+#
+# Usage: python -m benchmarks.compare OLD.json NEW.json [--threshold 10]
+# Exits with status 1 if any endpoint got slower (p50/p95/p99), lost
+# throughput or used more memory by more than the threshold percentage.
+import argparse
+import json
+import sys
+
+# (metric, True if higher is better)
+METRICS = [
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('throughput_rps', True),
+    ('peak_rss_mb', False),
+]
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(old, new, threshold):
+    """Return (rows, regressions) for endpoints present in both results."""
+    rows = []
+    regressions = []
+    for name, new_result in new['endpoints'].items():
+        old_result = old['endpoints'].get(name)
+        if old_result is None:
+            rows.append((name, 'new endpoint', []))
+            continue
+        cells = []
+        for metric, higher_is_better in METRICS:
+            pct = change(old_result.get(metric), new_result.get(metric))
+            regressed = pct is not None and (-pct if higher_is_better else pct) > threshold
+            cells.append((metric, old_result.get(metric), new_result.get(metric), pct, regressed))
+            if regressed:
+                regressions.append((name, metric, pct))
+        rows.append((name, None, cells))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='regression threshold in percent')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old['meta']['revision']} -> {new['meta']['revision']} "
+          f"(concurrency {old['meta']['concurrency']} -> {new['meta']['concurrency']})")
+    rows, regressions = compare(old, new, args.threshold)
+    for name, note, cells in rows:
+        print(f"\n{name}" + (f"  ({note})" if note else ''))
+        for metric, old_value, new_value, pct, regressed in cells:
+            delta = f"{pct:+7.1f}%" if pct is not None else '      -'
+            flag = '  REGRESSION' if regressed else ''
+            print(f"  {metric:15s} {old_value!s:>10} -> {new_value!s:>10}  {delta}{flag}")
+    for name in old['endpoints']:
+        if name not in new['endpoints']:
+            print(f"\n{name}  (not in new results)")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold}%:")
+        for name, metric, pct in regressions:
+            print(f"  {name} {metric} {pct:+.1f}%")
+        sys.exit(1)
+    print(f"\nNo regressions over {args.threshold}%.")
+
+
+if __name__ == '__main__':
+    main()
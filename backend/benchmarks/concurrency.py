@@ -0,0 +1,170 @@
+# Concurrency check: operators start and end sessions while managers run
+# report queries against the same database, and every "database is locked"
+# error or other failure is counted. Exits with status 1 if there were any.
+#
+#   python -m benchmarks.concurrency --operators 4 --managers 4 --seconds 15
+#
+# Without DATABASE_URL a scratch SQLite database is created and seeded.
+# --journal-mode DELETE reproduces the old rollback-journal behaviour for
+# comparison, --write-queue sends session writes through the group-commit
+# writer.
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+
+def seed(db, sessions, vehicles):
+    from sqlalchemy import insert
+    from models import ChargeSession, User, VehicleMaster
+    from benchmarks.generate import generate_vehicles, seed_users, session_rows, STATIONS
+    import rollups
+
+    seed_users(db, User)
+    rng = random.Random(7)
+    pool = generate_vehicles(rng, vehicles)
+    with db.engine.begin() as conn:
+        conn.execute(insert(VehicleMaster.__table__), pool)
+        for batch in session_rows(rng, pool, sessions, 365, STATIONS, 0):
+            conn.execute(insert(ChargeSession.__table__), batch)
+        rollups.rebuild(conn)
+        rollups.rebuild_vehicle_totals(conn)
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ok = {'write': 0, 'read': 0}
+        self.locked = 0
+        self.errors = []
+        self.write_latencies = []
+
+    def failure(self, message):
+        with self.lock:
+            if 'database is locked' in message:
+                self.locked += 1
+            else:
+                self.errors.append(message)
+
+
+def call(client, counters, kind, method, path, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = client.open(path, method=method, **kwargs)
+    except Exception as e:
+        counters.failure(f'{type(e).__name__}: {e}')
+        return None
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 500:
+        counters.failure(f'{method} {path} -> {response.status_code} {response.get_data(as_text=True)[:200]}')
+        return None
+    with counters.lock:
+        counters.ok[kind] += 1
+        if kind == 'write':
+            counters.write_latencies.append(elapsed)
+    return response
+
+
+def operator(app, counters, token, station, deadline):
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token}
+    while time.time() < deadline:
+        response = call(client, counters, 'write', 'POST', '/api/sessions/start', headers=headers, json={
+            'vehicle_no': f'CC {uuid.uuid4().hex[:8]}', 'station_name': station, 'soc_start': 25
+        })
+        if response is None or response.status_code != 201:
+            continue
+        call(client, counters, 'write', 'POST', '/api/sessions/end', headers=headers, json={
+            'session_id': response.get_json()['session_id'], 'soc_end': 80,
+            'unit_kwh': 25, 'price_paid': 375, 'payment_method': 'QR'
+        })
+
+
+def manager(app, counters, token, deadline):
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token}
+    reports = [
+        ('/api/reports/aggregates', None),
+        ('/api/sessions/filtered', {'period': 'all', 'limit': 500}),
+        ('/api/stats/overview', {'periods': 'all_periods'}),
+        ('/api/sessions', {'limit': 500}),
+    ]
+    i = 0
+    while time.time() < deadline:
+        path, params = reports[i % len(reports)]
+        call(client, counters, 'read', 'GET', path, headers=headers, query_string=params)
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent writers and report readers.')
+    parser.add_argument('--operators', type=int, default=4)
+    parser.add_argument('--managers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--sessions', type=int, default=50000, help='sessions to seed a scratch database with')
+    parser.add_argument('--journal-mode', help='override SQLITE_JOURNAL_MODE, e.g. DELETE')
+    parser.add_argument('--write-queue', action='store_true', help='send session writes through write_queue')
+    args = parser.parse_args()
+
+    if args.journal_mode:
+        os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    if args.write_queue:
+        os.environ['WRITE_QUEUE'] = 'True'
+    # Reports must reach the database, not the response cache
+    os.environ['RESPONSE_CACHE'] = 'False'
+    scratch = not os.getenv('DATABASE_URL')
+    if scratch:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'concurrency.db')
+
+    from app import create_app
+    from models import db
+    import migrations
+    app = create_app()
+    # Raise errors into the test client so lock errors can be told apart
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    with app.app_context():
+        migrations.upgrade()
+        if scratch:
+            seed(db, args.sessions, 2000)
+        journal = None
+        if db.engine.dialect.name == 'sqlite':
+            journal = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    client = app.test_client()
+    tokens = {
+        username: client.post('/api/login', json={'username': username, 'password': password}).get_json()['token']
+        for username, password in [('manager', 'admin123'), ('op_nagdhunga', 'pass123'), ('op_jamune', 'pass123')]
+    }
+    stations = [('op_nagdhunga', 'Nagdhunga'), ('op_jamune', 'Jamune')]
+
+    counters = Counters()
+    deadline = time.time() + args.seconds
+    threads = [
+        threading.Thread(target=operator, args=(app, counters, tokens[stations[i % 2][0]], stations[i % 2][1], deadline))
+        for i in range(args.operators)
+    ] + [
+        threading.Thread(target=manager, args=(app, counters, tokens['manager'], deadline))
+        for _ in range(args.managers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(counters.write_latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else 0
+    print(f"Journal mode: {journal or 'n/a'}  Write queue: {'on' if args.write_queue else 'off'}")
+    print(f"{args.operators} operators, {args.managers} managers, {args.seconds:.0f}s")
+    print(f"Writes: {counters.ok['write']} (p95 {p95:.1f}ms)  Reports: {counters.ok['read']}")
+    print(f"'database is locked' errors: {counters.locked}  Other errors: {len(counters.errors)}")
+    for message in counters.errors[:10]:
+        print(f"  {message}")
+    if counters.locked or counters.errors:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+# Bulk generator of realistic vehicles and charge sessions.
+#
+# Rows are built in memory in batches and written with executemany inserts,
+# bypassing the ORM, so millions of sessions take seconds to minutes rather
+# than hours. Seeded, so the same arguments always produce the same data.
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+BATCH_SIZE = 50000
+STATIONS = ['Nagdhunga', 'Jamune']
+
+# (model, battery kWh, weight) - common fleet and private EVs
+VEHICLE_MODELS = [
+    ('BYD - Atto 3 (Superior)', 60.48, 8),
+    ('BYD - Dolphin', 44.9, 6),
+    ('BYD - Seal (Premium)', 82.6, 2),
+    ('Tata - Nexon EV', 40.5, 8),
+    ('Tata - Tiago EV', 24.0, 6),
+    ('MG - ZS EV', 50.3, 5),
+    ('Hyundai - Kona Electric', 39.2, 4),
+    ('Kia - EV6', 77.4, 1),
+    ('Neta - V', 38.54, 5),
+    ('Higer - H5C-EV (Standard)', 53.58, 4),
+    ('King Long - King Long EV (16-Seater)', 53.58, 4),
+    ('Chery Wanda - City Bus EV', 144.97, 2),
+    ('DFSK - EC35 (Cargo)', 38.6, 3),
+]
+PAYMENT_METHODS = [('Cash', 55), ('QR', 45)]
+# Relative charging demand per hour of day (UTC+5:45 peaks shifted to UTC)
+HOURLY_WEIGHTS = [2, 1, 1, 1, 2, 4, 6, 7, 7, 6, 5, 5, 6, 6, 5, 4, 3, 3, 3, 3, 3, 3, 2, 2]
+
+BENCH_USERS = [
+    ('manager', 'admin123', 'Manager'),
+    ('op_nagdhunga', 'pass123', 'Operator-Nagdhunga'),
+    ('op_jamune', 'pass123', 'Operator-Jamune'),
+]
+
+
+def plate(rng):
+    zone = rng.choice(['BA', 'BA', 'BA', 'GA', 'LU', 'NA', 'KO', 'JA'])
+    return f"{zone} {rng.randint(1, 99)} {rng.choice(['PA', 'CHA', 'JA', 'KHA'])} {rng.randint(1, 9999):04d}"
+
+
+def generate_vehicles(rng, count):
+    weights = [w for _, _, w in VEHICLE_MODELS]
+    seen = set()
+    vehicles = []
+    now = datetime.utcnow()
+    while len(vehicles) < count:
+        vehicle_no = plate(rng)
+        if vehicle_no in seen:
+            continue
+        seen.add(vehicle_no)
+        name, capacity, _ = rng.choices(VEHICLE_MODELS, weights)[0]
+        vehicles.append({
+            'vehicle_no': vehicle_no,
+            'vehicle_name': name,
+            'phone_no': f"98{rng.randint(0, 99999999):08d}",
+            'battery_capacity': capacity,
+            'last_updated': now,
+        })
+    return vehicles
+
+
+def session_rows(rng, vehicles, count, days, stations, in_progress):
+    """Yield batches of charge_sessions rows spread over the last `days` days."""
+    now = datetime.utcnow()
+    first_day = now - timedelta(days=days)
+    hours = list(range(24))
+    methods = [m for m, _ in PAYMENT_METHODS]
+    method_weights = [w for _, w in PAYMENT_METHODS]
+    completed = count - in_progress
+    batch = []
+    for i in range(count):
+        vehicle = vehicles[rng.randrange(len(vehicles))]
+        capacity = vehicle['battery_capacity']
+        soc_start = round(rng.uniform(5, 60), 1)
+        if i >= completed:
+            start = now - timedelta(minutes=rng.randint(1, 90))
+            row = {
+                'vehicle_no': vehicle['vehicle_no'], 'station_name': rng.choice(stations),
+                'start_time': start, 'end_time': None, 'soc_start': soc_start, 'soc_end': None,
+                'unit_kwh': None, 'calculated_cost_rs': None, 'price_paid': None,
+                'payment_method': None, 'status': 'IN PROGRESS',
+            }
+        else:
+            # Sessions are evenly spread over the days, clustered by hour of day
+            day = first_day + timedelta(days=days * i / completed)
+            start = day.replace(hour=rng.choices(hours, HOURLY_WEIGHTS)[0], minute=rng.randint(0, 59))
+            soc_end = round(min(100.0, soc_start + rng.uniform(20, 80)), 1)
+            unit_kwh = round((soc_end - soc_start) / 100 * capacity * rng.uniform(1.02, 1.12), 2)
+            duration = timedelta(minutes=unit_kwh / rng.choice([7.4, 22, 30, 60]) * 60 + rng.uniform(3, 15))
+            # Hour slots later today have not happened yet
+            start = min(start, now - duration)
+            cost = round(unit_kwh * 15.0, 2)
+            paid = round(cost) if rng.random() > 0.03 else round(cost * rng.uniform(0.5, 1.2))
+            row = {
+                'vehicle_no': vehicle['vehicle_no'], 'station_name': rng.choice(stations),
+                'start_time': start, 'end_time': start + duration,
+                'soc_start': soc_start, 'soc_end': soc_end, 'unit_kwh': unit_kwh,
+                'calculated_cost_rs': cost, 'price_paid': float(paid),
+                'payment_method': rng.choices(methods, method_weights)[0], 'status': 'COMPLETED',
+            }
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_users(db, User):
+    for username, password, role in BENCH_USERS:
+        if not User.query.filter_by(username=username).first():
+            db.session.add(User(username=username, password_hash=generate_password_hash(password), role=role))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate benchmark data.')
+    parser.add_argument('--vehicles', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=730, help='history length')
+    parser.add_argument('--stations', default=','.join(STATIONS))
+    parser.add_argument('--in-progress', type=int, default=6, help='open sessions to leave')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db, ChargeSession, User, VehicleMaster
+    import rollups
+    import migrations
+
+    rng = random.Random(args.seed)
+    stations = args.stations.split(',')
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade()
+        seed_users(db, User)
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'sqlite':
+                conn.execute(text('PRAGMA synchronous=OFF'))
+            existing = {
+                row[0]: row[1] or 50.0
+                for row in conn.execute(text('SELECT vehicle_no, battery_capacity FROM vehicle_master'))
+            }
+            vehicles = [v for v in generate_vehicles(rng, args.vehicles) if v['vehicle_no'] not in existing]
+            for start in range(0, len(vehicles), BATCH_SIZE):
+                conn.execute(insert(VehicleMaster.__table__), vehicles[start:start + BATCH_SIZE])
+        print(f"Inserted {len(vehicles)} vehicles in {time.perf_counter() - started:.1f}s")
+        # Sessions are spread over every vehicle, new and existing
+        pool = [{'vehicle_no': v['vehicle_no'], 'battery_capacity': v['battery_capacity']} for v in vehicles]
+        pool += [{'vehicle_no': no, 'battery_capacity': capacity} for no, capacity in existing.items()]
+
+        started = time.perf_counter()
+        written = 0
+        with db.engine.connect() as conn:
+            if conn.dialect.name == 'sqlite':
+                conn.execute(text('PRAGMA synchronous=OFF'))
+            for batch in session_rows(rng, pool, args.sessions, args.days, stations, args.in_progress):
+                conn.execute(insert(ChargeSession.__table__), batch)
+                conn.commit()
+                written += len(batch)
+                print(f"  {written}/{args.sessions} sessions", end='\r')
+        print()
+        elapsed = time.perf_counter() - started
+        print(f"Inserted {written} sessions in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            count = rollups.rebuild(conn)
+            vehicles = rollups.rebuild_vehicle_totals(conn)
+        print(f"Rebuilt {count} rollup rows and {vehicles} vehicle totals in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+# Load harness: drives every API endpoint under configurable concurrency
+# and reports p50/p95/p99 latency, throughput and peak RSS per endpoint.
+#
+# By default requests go through Flask test clients in this process (one per
+# thread) against DATABASE_URL. With --url they go over HTTP to a running
+# server, e.g. `gunicorn app:app --worker-class gthread --threads 8`, and
+# --server-pid makes RSS be sampled from that server and its workers.
+#
+# Results are written as JSON to benchmarks/results/ for
+# `python -m benchmarks.compare`.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+RSS_SAMPLE_SECONDS = 0.01
+JOB_WAIT_SECONDS = 120
+
+
+class InProcessTarget:
+    def __init__(self):
+        from app import create_app
+        self.app = create_app()
+        self._local = threading.local()
+        self.pid = os.getpid()
+
+    def request(self, method, path, headers=None, params=None, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open('/api' + path, method=method, headers=headers,
+                               query_string=params, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HttpTarget:
+    def __init__(self, base_url, pid=None):
+        self.base_url = base_url.rstrip('/')
+        self.pid = pid
+
+    def request(self, method, path, headers=None, params=None, body=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method, headers=dict(headers or {}))
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def rss_bytes(pid):
+    """Resident set size of pid plus its child processes, from /proc."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, rss_bytes(self.pid))
+            self._done.wait(RSS_SAMPLE_SECONDS)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, rss_bytes(self.pid))
+        return self.peak
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def login(target, username, password):
+    status, body = target.request('POST', '/login', body={'username': username, 'password': password})
+    if status != 200:
+        raise SystemExit(f"Login failed for {username}: {status} {body[:200]!r}")
+    return {'Authorization': 'Bearer ' + json.loads(body)['token']}
+
+
+def build_scenarios(target, manager, operator, station):
+    """Return [(name, make_request)] where make_request(i) -> (method, path, headers, params, body)."""
+    status, body = target.request('GET', '/vehicles/search', manager, {'query': 'BA'})
+    vehicles = [v['vehicle_no'] for v in json.loads(body)] if status == 200 else []
+    vehicles = vehicles or ['BA 1 PA 0001']
+    pick = lambda i: vehicles[i % len(vehicles)]
+    open_sessions = []
+    lock = threading.Lock()
+
+    # A poll from cursor 0 answers at once as long as there is an event, so
+    # /sessions/events measures the catch-up path instead of the idle hold
+    status, body = target.request('POST', '/sessions/start', operator, None, {
+        'vehicle_no': f'BENCH {uuid.uuid4().hex[:8]}', 'station_name': station, 'soc_start': 20
+    })
+    if status == 201:
+        open_sessions.append(json.loads(body)['session_id'])
+
+    # One finished report job for the /jobs endpoints to read
+    status, body = target.request('GET', '/reports/aggregates', manager, {'async': 'true'})
+    job = json.loads(body) if status in (200, 202) else {'id': 'missing'}
+    deadline = time.monotonic() + JOB_WAIT_SECONDS
+    while job.get('status') in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.2)
+        job = json.loads(target.request('GET', f"/jobs/{job['id']}", manager)[1])
+
+    def start(i):
+        return ('POST', '/sessions/start', operator, None, {
+            'vehicle_no': f'BENCH {uuid.uuid4().hex[:8]}', 'station_name': station,
+            'soc_start': 20, 'vehicle_name': 'Bench EV', 'battery_capacity': 50
+        })
+
+    def end(i):
+        with lock:
+            session_id = open_sessions.pop() if open_sessions else None
+        return ('POST', '/sessions/end', operator, None, {
+            'session_id': session_id or 1, 'soc_end': 80, 'unit_kwh': 30,
+            'price_paid': 450, 'payment_method': 'QR'
+        })
+
+    def batch(i):
+        key = uuid.uuid4().hex
+        operations = []
+        for n in range(25):
+            operations.append({'op': 'start', 'idempotency_key': f'{key}-s{n}', 'vehicle_no': f'BENCH {key[:6]}{n}',
+                               'station_name': station, 'soc_start': 20})
+            operations.append({'op': 'end', 'idempotency_key': f'{key}-e{n}', 'start_key': f'{key}-s{n}',
+                               'soc_end': 80, 'unit_kwh': 30, 'price_paid': 450, 'payment_method': 'Cash'})
+        return ('POST', '/sessions/batch', operator, None, {'operations': operations})
+
+    scenarios = [
+        ('POST /login', lambda i: ('POST', '/login', None, None, {'username': 'manager', 'password': 'admin123'})),
+        ('POST /sessions/start', start),
+        ('POST /sessions/end', end),
+        ('POST /sessions/batch', batch),
+        ('GET /sessions?status=IN PROGRESS', lambda i: ('GET', '/sessions', operator, {'status': 'IN PROGRESS'}, None)),
+        ('GET /sessions?limit=100', lambda i: ('GET', '/sessions', manager, {'limit': 100}, None)),
+        ('GET /sessions/filtered?period=month', lambda i: ('GET', '/sessions/filtered', manager, {'period': 'month', 'limit': 100}, None)),
+        ('GET /sessions/filtered?period=all', lambda i: ('GET', '/sessions/filtered', manager, {'period': 'all', 'limit': 100}, None)),
+        ('GET /stats/station?period=all', lambda i: ('GET', f'/stats/station/{station}', manager, {'period': 'all'}, None)),
+        ('GET /stats/station?period=week', lambda i: ('GET', f'/stats/station/{station}', manager, {'period': 'week'}, None)),
+        ('GET /stats/timeseries?bucket=hour', lambda i: ('GET', '/stats/timeseries', manager, {'bucket': 'hour'}, None)),
+        ('GET /stats/timeseries?bucket=heatmap', lambda i: ('GET', '/stats/timeseries', manager, {'bucket': 'heatmap', 'station_name': station}, None)),
+        ('GET /stats/overview', lambda i: ('GET', '/stats/overview', manager, {'periods': 'all_periods'}, None)),
+        ('GET /reports/aggregates', lambda i: ('GET', '/reports/aggregates', manager, None, None)),
+        ('GET /reports/reconciliation', lambda i: ('GET', '/reports/reconciliation', manager, {'limit': 100}, None)),
+        ('POST /reports/reconciliation/run', lambda i: ('POST', '/reports/reconciliation/run', manager, None, {})),
+        ('GET /reports/aggregates?async=true', lambda i: ('GET', '/reports/aggregates', manager, {'async': 'true'}, None)),
+        ('GET /jobs/<id>', lambda i: ('GET', f"/jobs/{job['id']}", manager, None, None)),
+        ('GET /jobs/<id>/result', lambda i: ('GET', f"/jobs/{job['id']}/result", manager, None, None)),
+        ('GET /reports/export?period=week', lambda i: ('GET', '/reports/export', manager, {'period': 'week'}, None)),
+        ('GET /sessions/events?cursor=0', lambda i: ('GET', '/sessions/events', operator, {'cursor': 0, 'seen': 0}, None)),
+        ('GET /vehicles/search', lambda i: ('GET', '/vehicles/search', operator, {'query': pick(i)[:4 + i % 4]}, None)),
+        ('GET /vehicles/<no>', lambda i: ('GET', '/vehicles/' + urllib.parse.quote(pick(i)), operator, None, None)),
+        ('GET /vehicles/<no>/history', lambda i: ('GET', '/vehicles/' + urllib.parse.quote(pick(i)) + '/history', manager, None, None)),
+        ('GET /tariffs', lambda i: ('GET', '/tariffs', manager, None, None)),
+        ('POST /tariffs', lambda i: ('POST', '/tariffs', manager, None, {
+            # Far enough ahead that no benchmark session is billed with it
+            'station_name': station, 'effective_from': '2100-01-01T00:00:00',
+            'schedule': {'default_rate': 15, 'periods': [{'start': '17:00', 'end': '21:00', 'rate': 20}]}
+        })),
+        ('GET /metrics', lambda i: ('GET', '/metrics', manager, None, None)),
+    ]
+    return scenarios, open_sessions
+
+
+def run_scenario(target, make_request, count, concurrency, on_result=None):
+    latencies = []
+    errors = 0
+    response_bytes = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors, response_bytes
+        method, path, headers, params, body = make_request(i)
+        started = time.perf_counter()
+        status, data = target.request(method, path, headers, params, body)
+        elapsed = time.perf_counter() - started
+        if on_result:
+            on_result(status, data)
+        with lock:
+            latencies.append(elapsed)
+            response_bytes += len(data)
+            if status >= 400:
+                errors += 1
+
+    sampler = RssSampler(target.pid) if target.pid else None
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(count)))
+    wall = time.perf_counter() - started
+    peak = sampler.stop() if sampler else None
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1]) if latencies else None,
+        'throughput_rps': round(count / wall, 2) if wall else None,
+        'avg_response_bytes': round(response_bytes / count) if count else 0,
+        'peak_rss_mb': round(peak / 1024 / 1024, 1) if peak else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every API endpoint.')
+    parser.add_argument('--url', help='base API URL, e.g. http://localhost:5001/api (default: in-process)')
+    parser.add_argument('--server-pid', type=int, help='sample RSS of this server process tree (with --url)')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--station', default='Nagdhunga')
+    parser.add_argument('--only', help='comma-separated substrings of endpoint names to run')
+    parser.add_argument('--no-response-cache', action='store_true', help='disable the response cache (in-process only)')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<time>-<rev>.json)')
+    args = parser.parse_args()
+
+    if args.no_response_cache:
+        os.environ['RESPONSE_CACHE'] = 'False'
+    target = HttpTarget(args.url, args.server_pid) if args.url else InProcessTarget()
+    manager = login(target, 'manager', 'admin123')
+    operator = login(target, f'op_{args.station.lower()}', 'pass123')
+    scenarios, open_sessions = build_scenarios(target, manager, operator, args.station)
+
+    def remember_session(status, data):
+        if status == 201:
+            open_sessions.append(json.loads(data)['session_id'])
+
+    results = {}
+    for name, make_request in scenarios:
+        if args.only and not any(part in name for part in args.only.split(',')):
+            continue
+        on_result = remember_session if name == 'POST /sessions/start' else None
+        results[name] = run_scenario(target, make_request, args.requests, args.concurrency, on_result)
+        r = results[name]
+        print(f"{name:42s} p50 {r['p50_ms']:9.2f}ms  p95 {r['p95_ms']:9.2f}ms  p99 {r['p99_ms']:9.2f}ms  "
+              f"{r['throughput_rps']:9.1f} req/s  rss {r['peak_rss_mb']} MB  errors {r['errors']}")
+
+    revision = git_revision()
+    report = {
+        'meta': {
+            'revision': revision,
+            'timestamp': datetime.utcnow().isoformat(),
+            'target': args.url or 'in-process',
+            'database': os.getenv('DATABASE_URL', 'sqlite:///charging_station.db').split('@')[-1],
+            'concurrency': args.concurrency,
+            'requests_per_endpoint': args.requests,
+            'response_cache': not args.no_response_cache,
+            'python': platform.python_version(),
+        },
+        'endpoints': results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Serialization benchmark: the ORM path (load ChargeSession objects,
+# to_dict() and jsonify) against serialization.py (column tuples and
+# orjson) for the --rows most recently completed sessions, the shape of a
+# /api/sessions/filtered page. Both bodies must be byte-identical; exits
+# with status 1 if not.
+#
+#   python -m benchmarks.serialization --rows 1000 --runs 20
+#
+# Run against a generated database (benchmarks.generate). Timings include
+# the indexed query, which both paths share.
+import argparse
+import gzip
+import statistics
+import sys
+import time
+
+
+def newest_completed(db, ChargeSession):
+    return (
+        db.session.query(ChargeSession).filter(ChargeSession.status == 'COMPLETED')
+        .order_by(ChargeSession.end_time.desc(), ChargeSession.session_id.desc())
+    )
+
+
+def orm_body(db, ChargeSession, rows):
+    from flask import jsonify
+    query = newest_completed(db, ChargeSession)
+    return jsonify([s.to_dict() for s in query.limit(rows).all()]).get_data()
+
+
+def tuple_body(db, ChargeSession, rows, fields):
+    import serialization
+    query = newest_completed(db, ChargeSession)
+    query = serialization.select_fields(query, ChargeSession, fields)
+    return serialization.json_response(serialization.to_dicts(query.limit(rows).all(), fields)).get_data()
+
+
+def measure(f, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        body = f()
+        timings.append((time.perf_counter() - started) * 1000)
+    return body, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ORM and column-tuple JSON serialization.')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db, ChargeSession
+    import serialization
+    app = create_app()
+    with app.app_context():
+        # Warm the page cache and SQLAlchemy's statement caches
+        orm_body(db, ChargeSession, args.rows)
+        tuple_body(db, ChargeSession, args.rows, serialization.SESSION_FIELDS)
+        db.session.remove()
+
+        orm, orm_ms = measure(lambda: orm_body(db, ChargeSession, args.rows), args.runs)
+        fast, fast_ms = measure(lambda: tuple_body(db, ChargeSession, args.rows, serialization.SESSION_FIELDS), args.runs)
+        projected, projected_ms = measure(
+            lambda: tuple_body(db, ChargeSession, args.rows, ('session_id', 'status', 'unit_kwh')), args.runs
+        )
+
+    encoder = 'orjson' if serialization.orjson is not None else 'json'
+    print(f"{'orm + jsonify':24s} median {orm_ms:8.1f}ms  {len(orm):9d} bytes")
+    print(f"{'tuples + ' + encoder:24s} median {fast_ms:8.1f}ms  {len(fast):9d} bytes  ({orm_ms / fast_ms:.1f}x)")
+    print(f"{'3 fields':24s} median {projected_ms:8.1f}ms  {len(projected):9d} bytes")
+    print(f"{'gzip level 5':24s} {'':16s} {len(gzip.compress(fast, 5)):9d} bytes")
+
+    if orm != fast:
+        print('Bodies differ.')
+        sys.exit(1)
+    print('Bodies are byte-identical.')
+
+
+if __name__ == '__main__':
+    main()
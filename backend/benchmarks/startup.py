@@ -0,0 +1,67 @@
+# Cold-start benchmark: how long a fresh worker takes to import the app,
+# build it with create_app() and answer its first database-backed request.
+#
+#   python -m benchmarks.startup --runs 10 --budget-ms 1000
+#
+# Each run is a new interpreter, like a gunicorn worker boot or a
+# serverless restart. Exits with status 1 if the median total is over the
+# budget. The schema must already be migrated (python migrations.py).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', 1000))
+
+PROBE = r'''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+response = application.test_client().post('/api/login', json={'username': '-', 'password': '-'})
+assert response.status_code == 401, response.status_code
+answered = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+    'total_ms': (answered - started) * 1000,
+}))
+'''
+
+PHASES = ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+
+
+def run_once():
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=backend, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure application cold start.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='budget for the median total')
+    args = parser.parse_args()
+
+    # The first run warms the OS file cache and writes .pyc files
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+    medians = {}
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        medians[phase] = statistics.median(values)
+        print(f"{phase:18s} median {medians[phase]:8.1f}ms  max {max(values):8.1f}ms")
+
+    if medians['total_ms'] > args.budget_ms:
+        print(f"Over budget: median {medians['total_ms']:.0f}ms > {args.budget_ms:.0f}ms")
+        sys.exit(1)
+    print(f"Within budget ({args.budget_ms:.0f}ms).")
+
+
+if __name__ == '__main__':
+    main()
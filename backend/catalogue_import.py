@@ -0,0 +1,257 @@
+# Bulk import of vehicle catalogues and fleet/registration dumps into
+# vehicle_master.
+#
+# Input rows are streamed from CSV, JSON Lines or a JSON array. The keys
+# already in vehicle_master are loaded once, each row is classified as new,
+# changed or unchanged in memory, and only new and changed rows are written,
+# BATCH_SIZE at a time, with INSERT ... ON CONFLICT DO UPDATE on SQLite and
+# Postgres (plain inserts and updates elsewhere). Empty fields never
+# overwrite stored values.
+#
+# Rows without a plate are catalogue entries (one per model). They get a
+# stable REF- key derived from the model name, and an existing reference
+# row with the same name is reused, so re-running an import never
+# duplicates models.
+#
+# Usage:
+#   python catalogue_import.py fleet.csv
+#   python catalogue_import.py models.jsonl --batch-size 10000
+#   python catalogue_import.py registrations.json --insert-only --dry-run
+#   python catalogue_import.py national_registry.csv --bulk
+import argparse
+import csv
+import hashlib
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, insert, select, update
+from models import db, VehicleMaster
+import response_cache
+import vehicle_search
+
+BATCH_SIZE = 5000
+FIELDS = ('vehicle_name', 'phone_no', 'battery_capacity')
+PLATE_LENGTH = VehicleMaster.__table__.c.vehicle_no.type.length
+
+# Accepted spellings of each column, lower-cased
+ALIASES = {
+    'vehicle_no': ('vehicle_no', 'plate', 'registration_no', 'vehicle number'),
+    'vehicle_name': ('vehicle_name', 'brand/model', 'model', 'name'),
+    'phone_no': ('phone_no', 'phone', 'owner_phone'),
+    'battery_capacity': ('battery_capacity', 'battery capacity (kwh)', 'battery_kwh'),
+}
+
+
+def reference_plate(vehicle_name):
+    """Stable key for a catalogue row without a plate."""
+    return 'REF-' + hashlib.sha1(vehicle_name.strip().lower().encode()).hexdigest()[:12].upper()
+
+
+def is_reference(vehicle_no):
+    # REF-<hash> keys, and the <BRA>-REF-<n> keys older seed scripts made
+    return vehicle_no.startswith('REF-') or '-REF-' in vehicle_no
+
+
+def read_rows(stream, fmt):
+    """Yield dicts from a CSV, JSON Lines or JSON array stream."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from json.load(stream)
+
+
+def column_map(keys):
+    """{vehicle_master column: [input keys]} for a row's keys, in alias order."""
+    lowered = {str(k).strip().lower(): k for k in keys}
+    return {
+        field: [lowered[name] for name in names if name in lowered]
+        for field, names in ALIASES.items()
+    }
+
+
+def normalize(raw, columns):
+    """Map a raw row to vehicle_master columns. Returns None if unusable."""
+    row = {}
+    for field, keys in columns.items():
+        value = None
+        for key in keys:
+            value = raw.get(key)
+            if value not in (None, ''):
+                break
+        row[field] = str(value).strip() or None if value is not None else None
+
+    capacity = row['battery_capacity']
+    try:
+        row['battery_capacity'] = float(capacity) if capacity else None
+    except ValueError:
+        # e.g. "TBA"
+        row['battery_capacity'] = None
+    if not row['vehicle_no'] and not row['vehicle_name']:
+        return None
+    if row['vehicle_no'] and len(row['vehicle_no']) > PLATE_LENGTH:
+        return None
+    return row
+
+
+def load_existing(conn):
+    """{vehicle_no: (vehicle_name, phone_no, battery_capacity)} and
+    {lower(model name): vehicle_no} for reference rows."""
+    existing = {}
+    references = {}
+    result = conn.execution_options(yield_per=BATCH_SIZE).execute(select(
+        VehicleMaster.vehicle_no, VehicleMaster.vehicle_name,
+        VehicleMaster.phone_no, VehicleMaster.battery_capacity
+    ))
+    for vehicle_no, *values in result:
+        existing[vehicle_no] = tuple(values)
+        if values[0] and is_reference(vehicle_no):
+            references.setdefault(values[0].strip().lower(), vehicle_no)
+    return existing, references
+
+
+def _write(conn, new_rows, changed_rows):
+    table = VehicleMaster.__table__
+    dialect = conn.dialect.name
+    rows = new_rows + changed_rows
+    if not rows:
+        return
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['vehicle_no'],
+            set_={c: stmt.excluded[c] for c in FIELDS + ('last_updated',)}
+        )
+        conn.execute(stmt, rows)
+        return
+
+    if new_rows:
+        conn.execute(insert(table), new_rows)
+    if changed_rows:
+        conn.execute(
+            update(table).where(table.c.vehicle_no == bindparam('key'))
+            .values({c: bindparam(c) for c in FIELDS + ('last_updated',)}),
+            [dict(row, key=row['vehicle_no']) for row in changed_rows]
+        )
+
+
+def import_rows(conn, rows, batch_size=BATCH_SIZE, insert_only=False, dry_run=False, bulk=False):
+    """Upsert an iterable of raw row dicts into vehicle_master on conn,
+    committing every batch_size written rows. Returns counts.
+
+    With bulk=True the vehicle search indexes are dropped for the load and
+    rebuilt once at the end, which is much faster than maintaining them row
+    by row when the import is large compared to the table."""
+    if bulk and not dry_run:
+        vehicle_search.drop(conn)
+        conn.commit()
+        try:
+            return import_rows(conn, rows, batch_size, insert_only)
+        finally:
+            conn.rollback()
+            vehicle_search.install(conn)
+            conn.commit()
+
+    counts = dict.fromkeys(('read', 'inserted', 'updated', 'unchanged', 'invalid', 'duplicate'), 0)
+    existing, references = load_existing(conn)
+    seen = set()
+    new_rows, changed_rows = [], []
+    now = datetime.utcnow()
+
+    def flush():
+        if not dry_run and (new_rows or changed_rows):
+            _write(conn, new_rows, changed_rows)
+            conn.commit()
+            # Vehicle details show up in all-station views only
+            response_cache.bump()
+        new_rows.clear()
+        changed_rows.clear()
+
+    # CSV rows all share the header's keys, JSON rows usually do too
+    columns_for = {}
+    for raw in rows:
+        counts['read'] += 1
+        keys = tuple(raw)
+        columns = columns_for.get(keys)
+        if columns is None:
+            columns = columns_for[keys] = column_map(keys)
+        row = normalize(raw, columns)
+        if row is None:
+            counts['invalid'] += 1
+            continue
+        if not row['vehicle_no']:
+            name_key = row['vehicle_name'].lower()
+            row['vehicle_no'] = references.get(name_key) or reference_plate(row['vehicle_name'])
+            references.setdefault(name_key, row['vehicle_no'])
+        vehicle_no = row['vehicle_no']
+        if vehicle_no in seen:
+            counts['duplicate'] += 1
+            continue
+        seen.add(vehicle_no)
+
+        stored = existing.get(vehicle_no)
+        if stored is None:
+            new_rows.append(dict(row, last_updated=now))
+            counts['inserted'] += 1
+        else:
+            merged = tuple(
+                new if new is not None else old
+                for new, old in zip((row[f] for f in FIELDS), stored)
+            )
+            if insert_only or merged == stored:
+                counts['unchanged'] += 1
+                continue
+            changed_rows.append(dict(zip(FIELDS, merged), vehicle_no=vehicle_no, last_updated=now))
+            counts['updated'] += 1
+
+        if len(new_rows) + len(changed_rows) >= batch_size:
+            flush()
+    flush()
+    return counts
+
+
+def detect_format(path):
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        return 'jsonl'
+    if path.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a vehicle catalogue or fleet dump into vehicle_master.')
+    parser.add_argument('path', help="CSV, JSON Lines or JSON file, or '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'json'], help='default: from the file extension')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--insert-only', action='store_true', help='never update existing vehicles')
+    parser.add_argument('--dry-run', action='store_true', help='count what would change without writing')
+    parser.add_argument('--bulk', action='store_true',
+                        help='drop the search indexes during the import and rebuild them after (large imports)')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if args.path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        stream = open(args.path, encoding='utf-8-sig', newline='')
+
+    from app import create_app
+    app = create_app()
+    with app.app_context(), stream:
+        started = time.perf_counter()
+        with db.engine.connect() as conn:
+            counts = import_rows(conn, read_rows(stream, fmt), args.batch_size,
+                                  args.insert_only, args.dry_run, args.bulk)
+        elapsed = time.perf_counter() - started
+    print(f"{'Dry run: ' if args.dry_run else ''}read {counts['read']} rows in {elapsed:.1f}s")
+    print(f"  inserted {counts['inserted']}, updated {counts['updated']}, unchanged {counts['unchanged']}")
+    print(f"  skipped {counts['invalid']} invalid and {counts['duplicate']} duplicate rows")
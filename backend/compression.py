@@ -0,0 +1,60 @@
+# Response compression for large JSON bodies.
+#
+# Responses of at least COMPRESS_MIN_BYTES are compressed with brotli when
+# the client accepts it and the brotli package is installed, otherwise with
+# gzip. Streamed responses (NDJSON, exports) are left alone, as are
+# bodies that already carry a Content-Encoding. A compressed response's
+# ETag becomes weak, as its bytes are no longer the ones the tag was
+# computed from; response_cache compares If-None-Match weakly for this.
+import gzip
+import os
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+LEVEL = int(os.getenv('COMPRESS_LEVEL', 5))
+_MIMETYPES = {'application/json', 'text/csv', 'text/plain'}
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(response):
+    """Compress response in place if it is worth it and the client allows."""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in _MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < MIN_BYTES:
+        return response
+    encoding = _encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if encoding == 'br':
+        body = brotli.compress(body, quality=LEVEL)
+    else:
+        body = gzip.compress(body, compresslevel=LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    # Registered after metrics.init_app so the response size it records is
+    # the compressed one (after_request hooks run in reverse order)
+    app.after_request(compress)
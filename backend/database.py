@@ -0,0 +1,55 @@
+# Engine configuration for SQLite and Postgres, driven by environment variables.
+#
+# SQLite connections are switched to WAL on connect, so report queries keep
+# reading while an operator's commit is being written instead of hitting
+# "database is locked", and wait busy_timeout for the write lock rather than
+# failing at once. Postgres (and other server databases) get a sized pool
+# with pre-ping and recycling so connections dropped by the server or a
+# proxy are replaced transparently.
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        # Development: SQLite
+        return 'sqlite:///charging_station.db'
+    # Fix for Railway/Render PostgreSQL URL
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for url."""
+    if url.startswith('sqlite'):
+        # The sqlite3 module's own lock timeout, in seconds, kept in line
+        # with busy_timeout
+        return {'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000}}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True') == 'True',
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma}={value}')
+    cursor.close()
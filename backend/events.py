@@ -0,0 +1,260 @@
+# Session change feed served by long polling on /sessions/events.
+#
+# start_session/end_session append a row to session_events in the same
+# transaction as the change, so every worker sees the same ordered feed and
+# a client can resume from the cursor of its last poll.
+#
+# Each worker keeps the recent feed of every station in memory (Feed) and
+# polls are answered from it. The feed is read from the database only when
+# events.change_token() changes, i.e. after a commit in this process or
+# another worker on the host, and otherwise every SESSION_EVENTS_POLL_SECONDS
+# for writers on other hosts: one query per change per worker, however many
+# polls are waiting. A waiting poll costs no queries at all.
+import bisect
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from models import db, SessionEvent
+
+# A poll with nothing new waits up to HOLD_SECONDS for an event before
+# answering empty. At most MAX_WAITERS polls per process wait at a time,
+# the rest answer at once and the client retries after RETRY_MS, no sooner
+# than the dashboards used to poll, so idle tabs cannot take every thread.
+HOLD_SECONDS = float(os.getenv('SESSION_EVENTS_HOLD_SECONDS', 25))
+MAX_WAITERS = int(os.getenv('SESSION_EVENTS_MAX_WAITERS', 4))
+RETRY_MS = 10000
+POLL_SECONDS = float(os.getenv('SESSION_EVENTS_POLL_SECONDS', 5))
+STAMP_CHECK_SECONDS = 1.0
+# On Postgres a lower id can commit after a higher one is visible, so
+# cursors only move past events older than this; younger ones are read
+# again and the client skips the ids it has seen
+SETTLE_SECONDS = 5
+# Events kept in memory per worker; older cursors are served from the
+# database. A feed left unsynced for RESET_SECONDS starts over.
+BUFFER_SIZE = 2000
+RESET_SECONDS = 300
+RETENTION = timedelta(hours=24)
+PRUNE_EVERY = 500
+BATCH_SIZE = 100
+
+_new_events = threading.Condition()
+_waiters = threading.BoundedSemaphore(MAX_WAITERS)
+_recorded = 0
+_commits = 0
+
+
+def _stamp_path():
+    url = str(db.engine.url)
+    digest = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'evcs-session-events-{digest}')
+
+
+def _stamp_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def record(event_type, session):
+    """Append an event for a flushed ChargeSession. Runs in the caller's
+    transaction; listeners are woken once it commits."""
+    global _recorded
+    db.session.add(SessionEvent(
+        station_name=session.station_name,
+        event=event_type,
+        session_id=session.session_id,
+        payload=json.dumps(session.to_dict())
+    ))
+    db.session.info['session_events_pending'] = _stamp_path()
+
+    _recorded += 1
+    if _recorded % PRUNE_EVERY == 0:
+        SessionEvent.query.filter(
+            SessionEvent.created_at < datetime.utcnow() - RETENTION
+        ).delete(synchronize_session=False)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_listeners(session):
+    global _commits
+    stamp = session.info.pop('session_events_pending', None)
+    if stamp is None:
+        return
+    _commits += 1
+    try:
+        with open(stamp, 'a'):
+            os.utime(stamp)
+    except OSError:
+        pass
+    with _new_events:
+        _new_events.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('session_events_pending', None)
+
+
+def change_token():
+    """A value that changes whenever events may have been committed, by
+    this process or (through the stamp file) another worker on the host.
+    Costs a stat(), no query."""
+    return _commits, _stamp_mtime(_stamp_path())
+
+
+def latest_id():
+    return db.session.query(db.func.coalesce(db.func.max(SessionEvent.id), 0)).scalar()
+
+
+def _columns():
+    return (SessionEvent.id, SessionEvent.station_name, SessionEvent.event,
+            SessionEvent.payload, SessionEvent.created_at)
+
+
+def settled_cursor(rows, cursor):
+    """cursor moved past rows, in id order, that are old enough that no
+    lower id can still commit."""
+    horizon = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+    for row in rows:
+        if row.id <= cursor:
+            continue
+        if row.created_at is None or row.created_at > horizon:
+            break
+        cursor = row.id
+    return cursor
+
+
+class Feed:
+    def __init__(self):
+        # (floor, rows): every event after floor, by id. Replaced as a
+        # whole, never mutated, so polls read it without the lock.
+        self.buffer = (0, [])
+        self.settled = None   # events up to here can no longer change
+        self.token = None
+        self.synced_at = 0.0
+        self.version = 0      # bumped whenever rows change
+        self._lock = threading.Lock()
+
+    def _start(self, conn):
+        horizon = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+        self.settled = conn.execute(
+            select(func.coalesce(func.max(SessionEvent.id), 0)).where(SessionEvent.created_at < horizon)
+        ).scalar()
+        return self.settled, []
+
+    def sync(self):
+        """Read new events if anything may have changed. Needs an app
+        context."""
+        token = change_token()
+        now = time.monotonic()
+        if self.settled is not None and token == self.token and now - self.synced_at < POLL_SECONDS:
+            return
+        with self._lock:
+            if self.settled is not None and token == self.token and now - self.synced_at < POLL_SECONDS:
+                return
+            floor, rows = self.buffer
+            with db.engine.connect() as conn:
+                if self.settled is None or now - self.synced_at > RESET_SECONDS:
+                    floor, rows = self._start(conn)
+                # Unsettled events are read again, so late commits fill in
+                fresh = conn.execute(
+                    select(*_columns()).where(SessionEvent.id > self.settled).order_by(SessionEvent.id)
+                ).all()
+            kept = [row for row in rows if row.id <= self.settled]
+            changed = [row.id for row in fresh] != [row.id for row in rows[len(kept):]]
+            rows = kept + fresh
+            self.settled = settled_cursor(fresh, self.settled)
+            if len(rows) > BUFFER_SIZE:
+                drop = 0
+                while len(rows) - drop > BUFFER_SIZE and rows[drop].id <= self.settled:
+                    drop += 1
+                if drop:
+                    floor = rows[drop - 1].id
+                    rows = rows[drop:]
+            self.buffer = (floor, rows)
+            if changed:
+                self.version += 1
+            # The token read before the query, so a commit made while it
+            # ran is picked up next time
+            self.token = token
+            self.synced_at = now
+
+    def after(self, station_name, cursor):
+        """Up to BATCH_SIZE events for station_name (all if None) after
+        cursor, and the cursor they may be settled from."""
+        floor, rows = self.buffer
+        result = []
+        if cursor < floor:
+            # Older than the buffer: final, read from the database
+            query = db.session.query(*_columns()).filter(SessionEvent.id > cursor, SessionEvent.id <= floor)
+            if station_name:
+                query = query.filter(SessionEvent.station_name == station_name)
+            result = query.order_by(SessionEvent.id).limit(BATCH_SIZE).all()
+            db.session.remove()
+            if len(result) == BATCH_SIZE:
+                return result, cursor
+            cursor = floor
+        start = bisect.bisect_right([row.id for row in rows], cursor)
+        for row in rows[start:]:
+            if len(result) == BATCH_SIZE:
+                break
+            if station_name is None or row.station_name == station_name:
+                result.append(row)
+        return result, cursor
+
+
+feed = Feed()
+
+
+def poll(station_name, cursor, seen):
+    """Events for station_name (all stations if None) after cursor, waiting
+    up to HOLD_SECONDS for one that was not there yet. seen is the highest
+    id the client has. Returns the response body."""
+    feed.sync()
+    rows, base = feed.after(station_name, cursor)
+    retry_ms = 0
+    if not any(row.id > seen for row in rows):
+        if _waiters.acquire(blocking=False):
+            try:
+                rows, base = _wait(station_name, cursor, rows, base)
+            finally:
+                _waiters.release()
+        else:
+            retry_ms = RETRY_MS
+    return {
+        'events': [
+            {'id': row.id, 'event': row.event, 'session': json.loads(row.payload)}
+            for row in rows
+        ],
+        'cursor': settled_cursor(rows, base),
+        'seen': max([seen] + [row.id for row in rows]),
+        'retry_ms': retry_ms
+    }
+
+
+def _wait(station_name, cursor, rows, base):
+    # Ends when an id turns up that the client was not sent, which
+    # includes one below seen that committed late
+    known = {row.id for row in rows}
+    version = feed.version
+    deadline = time.monotonic() + HOLD_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return rows, base
+        with _new_events:
+            _new_events.wait(min(STAMP_CHECK_SECONDS, remaining))
+        feed.sync()
+        if feed.version == version:
+            continue
+        version = feed.version
+        rows, base = feed.after(station_name, cursor)
+        if any(row.id not in known for row in rows):
+            return rows, base
@@ -0,0 +1,134 @@
+# Streaming export of charge_sessions as CSV or Parquet.
+#
+# Rows are read as plain column tuples from a server-side cursor in batches
+# and written out batch by batch, so memory stays bounded however many rows
+# are exported. Parquet needs the optional pyarrow package.
+#
+# Usage (nightly dump of every session, archived ones included):
+#   python exports.py --format csv --output sessions.csv
+#   python exports.py --format parquet --output sessions.parquet
+import argparse
+import csv
+import io
+import sys
+from datetime import datetime
+from models import db, ChargeSession
+import archive
+
+BATCH_SIZE = 5000
+
+# Same keys, in the same order, as ChargeSession.to_dict()
+EXPORT_COLUMNS = [
+    ChargeSession.session_id,
+    ChargeSession.vehicle_no,
+    ChargeSession.station_name,
+    ChargeSession.start_time,
+    ChargeSession.end_time,
+    ChargeSession.soc_start,
+    ChargeSession.soc_end,
+    ChargeSession.unit_kwh,
+    ChargeSession.calculated_cost_rs,
+    ChargeSession.price_paid,
+    ChargeSession.payment_method,
+    ChargeSession.status,
+]
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+
+def export_rows(query=None, sessions=ChargeSession):
+    """Yield lists of up to BATCH_SIZE row tuples for query (a query of
+    sessions, ChargeSession or an alias of it; default every session,
+    archived ones included), ordered by session_id."""
+    if query is None:
+        sessions = archive.session_source()
+        query = db.session.query(sessions)
+    columns = [getattr(sessions, field) for field in EXPORT_FIELDS]
+    query = query.with_entities(*columns).order_by(None).order_by(sessions.session_id)
+    batch = []
+    for row in query.yield_per(BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(batches):
+    """Yield CSV text, header first, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in batches:
+        writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(batches, sink):
+    """Write batches to sink (a path or binary file) as Parquet, one record
+    batch per input batch. Requires pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('session_id', pa.int64()),
+        ('vehicle_no', pa.string()),
+        ('station_name', pa.string()),
+        ('start_time', pa.timestamp('us')),
+        ('end_time', pa.timestamp('us')),
+        ('soc_start', pa.float64()),
+        ('soc_end', pa.float64()),
+        ('unit_kwh', pa.float64()),
+        ('calculated_cost_rs', pa.float64()),
+        ('price_paid', pa.float64()),
+        ('payment_method', pa.string()),
+        ('status', pa.string()),
+    ])
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dump charge_sessions to CSV or Parquet.')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--output', required=True, help="file path, or '-' for stdout (CSV only)")
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and not parquet_available():
+        print("Parquet export requires pyarrow: pip install pyarrow")
+        sys.exit(1)
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        if args.format == 'parquet':
+            write_parquet(export_rows(), args.output)
+        elif args.output == '-':
+            for chunk in csv_chunks(export_rows()):
+                sys.stdout.write(chunk)
+        else:
+            with open(args.output, 'w', newline='') as f:
+                for chunk in csv_chunks(export_rows()):
+                    f.write(chunk)
+        if args.output != '-':
+            print(f"Exported charge_sessions to {args.output}")
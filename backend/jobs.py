@@ -0,0 +1,375 @@
+# Background jobs for heavy manager reports and maintenance runs.
+#
+# A report endpoint decorated with background(lane) still answers inline by
+# default. With ?async=true (or a "Prefer: respond-async" header) it instead
+# queues a job and returns 202 with the job's id at once; the client polls
+# GET /api/jobs/<id> and downloads GET /api/jobs/<id>/result when it is
+# done. Endpoints that change data, like starting a reconciliation run, are
+# decorated with inline=False and always answer that way. Jobs run the same
+# view function on a runner thread, in a request context rebuilt from the
+# original method, path, arguments, JSON body and user.
+#
+# Jobs and their status live in a SQLite file shared by every worker on the
+# host, results in files next to it. A request identical to a queued or
+# running job (same endpoint, arguments and role) joins that job. One
+# matching a finished job is answered from its stored result, inline
+# requests included, but only while the data is unchanged: the key carries
+# response_cache's global version, which every session write bumps, and
+# results are reused for at most RESPONSE_CACHE_TTL seconds, like cached
+# responses. With the response cache disabled nothing bumps the versions,
+# so finished results are only served to the job's own pollers, which can
+# download them for JOBS_RESULT_TTL seconds.
+#
+# Each lane has its own runner threads and a host-wide limit on running
+# jobs, so a queue of exports never holds up reports and neither takes a
+# request thread: start/end and the operator polls keep every worker
+# thread. Web workers start their runners on first use; set
+# JOBS_RUN_IN_WORKERS=False and run `python jobs.py work` to move all
+# report work into a separate process.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import wraps
+from flask import current_app, jsonify, request, send_file
+from auth_cache import Principal
+from models import db
+import response_cache
+
+# Running jobs allowed per lane, host-wide
+LANES = {
+    'reports': int(os.getenv('JOBS_REPORT_WORKERS', 2)),
+    'exports': int(os.getenv('JOBS_EXPORT_WORKERS', 1)),
+    'maintenance': int(os.getenv('JOBS_MAINTENANCE_WORKERS', 1)),
+}
+RUN_IN_WORKERS = os.getenv('JOBS_RUN_IN_WORKERS', 'True') == 'True'
+RESULT_TTL_SECONDS = float(os.getenv('JOBS_RESULT_TTL', 300))
+MAX_QUEUED = int(os.getenv('JOBS_MAX_QUEUED', 50))
+# A job running longer than this is presumed lost with its process
+TIMEOUT_SECONDS = float(os.getenv('JOBS_TIMEOUT', 1800))
+POLL_SECONDS = 1.0
+PRUNE_EVERY = 100
+# Headers regenerated when a result is served rather than replayed
+_OWN_HEADERS = {'content-type', 'content-length', 'etag', 'cache-control', 'x-cache'}
+
+log = logging.getLogger('jobs')
+
+_views = {}
+_local = threading.local()
+_runners = {}
+_runners_lock = threading.Lock()
+_wake = threading.Condition()
+_enqueued = 0
+
+
+def _store_path():
+    path = os.getenv('JOBS_PATH')
+    if path:
+        return path
+    digest = hashlib.sha1(str(db.engine.url).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'evcs-jobs-{digest}.db')
+
+
+def _results_dir():
+    path = _store_path() + '-results'
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _connection():
+    path = _store_path()
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, key TEXT NOT NULL, lane TEXT NOT NULL, view TEXT NOT NULL, '
+            'method TEXT NOT NULL, path TEXT NOT NULL, args TEXT NOT NULL, view_args TEXT NOT NULL, body TEXT, '
+            'user_id INTEGER, username TEXT NOT NULL, role TEXT NOT NULL, '
+            'status TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, finished_at REAL, '
+            'status_code INTEGER, mimetype TEXT, headers TEXT, error TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_key ON jobs (key, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_lane ON jobs (lane, status, created_at)')
+        connections[path] = conn
+    return conn
+
+
+def _result_path(job_id):
+    return os.path.join(_results_dir(), job_id)
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+def job_dict(job):
+    return {
+        'id': job['id'],
+        'lane': job['lane'],
+        'status': job['status'],
+        'created_at': _isoformat(job['created_at']),
+        'started_at': _isoformat(job['started_at']),
+        'finished_at': _isoformat(job['finished_at']),
+        'error': job['error'],
+        'result_url': f"/api/jobs/{job['id']}/result" if job['status'] == 'done' else None
+    }
+
+
+def _wants_async():
+    if request.args.get('async') in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def _request_key(view, args, role, view_args, body):
+    version = response_cache.versions([response_cache.ALL_STATIONS])[0] if response_cache.ENABLED else None
+    source = '|'.join([
+        view, repr(sorted(args)), repr(sorted(view_args.items())), role, body or '', repr(version)
+    ])
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def get(job_id):
+    return _connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def _fresh_result(key):
+    if not response_cache.ENABLED:
+        return None
+    return _connection().execute(
+        "SELECT * FROM jobs WHERE key = ? AND status = 'done' AND finished_at > ? "
+        'ORDER BY finished_at DESC LIMIT 1',
+        (key, time.time() - min(RESULT_TTL_SECONDS, response_cache.TTL_SECONDS))
+    ).fetchone()
+
+
+def _enqueue(lane, view, key, current_user, args, view_args, body):
+    """The queued or running job for key, or a new one. None if the lane's
+    queue is full."""
+    global _enqueued
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,)
+        ).fetchone()
+        if job is None:
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued'", (lane,)
+            ).fetchone()[0]
+            if queued >= MAX_QUEUED:
+                conn.execute('ROLLBACK')
+                return None
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO jobs (id, key, lane, view, method, path, args, view_args, body, user_id, username, '
+                "role, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, key, lane, view, request.method, request.path, json.dumps(args), json.dumps(view_args),
+                 body, current_user.id, current_user.username, current_user.role, time.time())
+            )
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    _enqueued += 1
+    if _enqueued % PRUNE_EVERY == 0:
+        prune()
+    if RUN_IN_WORKERS:
+        start_runners(current_app._get_current_object())
+    with _wake:
+        _wake.notify_all()
+    return job
+
+
+def serve_result(job):
+    """The stored response of a finished job."""
+    response = send_file(_result_path(job['id']), mimetype=job['mimetype'], conditional=False)
+    response.status_code = job['status_code']
+    for name, value in json.loads(job['headers']):
+        response.headers[name] = value
+    response.headers['X-Job-Id'] = job['id']
+    return response
+
+
+def background(lane, inline=True):
+    """Let an endpoint wrapped by token_required run as a job in lane.
+    Stack it between token_required and cached_response. With inline=False
+    every request is queued, and a finished job's result is never reused
+    for a new request, as for endpoints that change data."""
+    def decorator(f):
+        _views[f.__name__] = f
+
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            query_args = [(k, v) for k, v in request.args.items(multi=True) if k != 'async']
+            body = request.get_json(silent=True)
+            body = json.dumps(body, sort_keys=True) if body is not None else None
+            key = _request_key(f.__name__, query_args, current_user.role, kwargs, body)
+            done = _fresh_result(key) if inline else None
+            if inline and not _wants_async():
+                if done is not None and os.path.exists(_result_path(done['id'])):
+                    return serve_result(done)
+                return f(current_user, *args, **kwargs)
+
+            job = done or _enqueue(lane, f.__name__, key, current_user, query_args, kwargs, body)
+            if job is None:
+                return jsonify({'error': f'Too many queued {lane} jobs, try again later'}), 503
+            response = jsonify(job_dict(job))
+            response.status_code = 200 if job['status'] == 'done' else 202
+            response.headers['Location'] = f"/api/jobs/{job['id']}"
+            return response
+        return decorated
+    return decorator
+
+
+def _claim(lane):
+    """Mark the oldest queued job in lane running and return it, unless the
+    lane is already running its limit of jobs host-wide."""
+    conn = _connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Timed out' "
+            "WHERE lane = ? AND status = 'running' AND started_at < ?",
+            (now, lane, now - TIMEOUT_SECONDS)
+        )
+        running = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'running'", (lane,)
+        ).fetchone()[0]
+        job = None
+        if running < LANES[lane]:
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE lane = ? AND status = 'queued' ORDER BY created_at LIMIT 1", (lane,)
+            ).fetchone()
+            if job is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (now, job['id']))
+        conn.execute('COMMIT')
+        return job
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _finish(job_id, status, **values):
+    values.update(status=status, finished_at=time.time())
+    _connection().execute(
+        f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in values)} WHERE id = ?",
+        (*values.values(), job_id)
+    )
+
+
+def run(app, job):
+    """Run a claimed job's view and store its response."""
+    view = _views.get(job['view'])
+    if view is None:
+        _finish(job['id'], 'failed', error='Unknown report')
+        return
+    principal = Principal(job['user_id'], job['username'], job['role'])
+    try:
+        body = json.loads(job['body']) if job['body'] is not None else None
+        with app.test_request_context(job['path'], method=job['method'],
+                                      query_string=json.loads(job['args']), json=body):
+            response = app.make_response(view(principal, **json.loads(job['view_args'])))
+            try:
+                # Streamed exports are generated here, inside the context
+                with open(_result_path(job['id']), 'wb') as result:
+                    for chunk in response.iter_encoded():
+                        result.write(chunk)
+            finally:
+                response.close()
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _OWN_HEADERS]
+            _finish(job['id'], 'done', status_code=response.status_code,
+                    mimetype=response.mimetype, headers=json.dumps(headers))
+    except Exception as e:
+        log.exception('Job %s (%s) failed', job['id'], job['view'])
+        _finish(job['id'], 'failed', error=str(e) or type(e).__name__)
+    finally:
+        db.session.remove()
+
+
+class Runner(threading.Thread):
+    def __init__(self, app, lane, number):
+        super().__init__(name=f'jobs-{lane}-{number}', daemon=True)
+        self.app = app
+        self.lane = lane
+
+    def run(self):
+        while True:
+            with self.app.app_context():
+                job = _claim(self.lane)
+                if job is not None:
+                    run(self.app, job)
+                    continue
+            with _wake:
+                _wake.wait(POLL_SECONDS)
+
+
+def start_runners(app):
+    # Started on first use, so gunicorn workers each get their own threads
+    # after the fork
+    if app in _runners:
+        return
+    with _runners_lock:
+        if app not in _runners:
+            _runners[app] = [
+                Runner(app, lane, number)
+                for lane, count in LANES.items()
+                for number in range(count)
+            ]
+            for runner in _runners[app]:
+                runner.start()
+
+
+def prune():
+    """Delete finished jobs older than the result TTL, and their results."""
+    conn = _connection()
+    expired = conn.execute(
+        "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+        (time.time() - RESULT_TTL_SECONDS,)
+    ).fetchall()
+    for (job_id,) in expired:
+        try:
+            os.remove(_result_path(job_id))
+        except OSError:
+            pass
+        conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+    return len(expired)
+
+
+def stats():
+    rows = _connection().execute('SELECT lane, status, COUNT(*) FROM jobs GROUP BY lane, status').fetchall()
+    result = {lane: {} for lane in LANES}
+    for lane, status, count in rows:
+        result.setdefault(lane, {})[status] = count
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] != 'work':
+        print("Usage: python jobs.py work")
+        sys.exit(1)
+    from app import create_app
+    app = create_app()
+    print(f"Running report jobs ({', '.join(f'{lane}: {count}' for lane, count in LANES.items())})")
+    start_runners(app)
+    while True:
+        time.sleep(60)
+        with app.app_context():
+            prune()
@@ -0,0 +1,182 @@
+# In-memory registry of in-progress charging sessions.
+#
+# There are only a handful of open sessions per station, so each worker
+# keeps all of them in memory, as to_dict() snapshots, with an index by
+# vehicle. The registry is loaded from charge_sessions on first use and
+# then kept current by replaying the session_events feed (see events.py),
+# which start_session and end_session append to in the same transaction as
+# the change. Replaying is cheap and idempotent: session_started adds the
+# session, session_ended drops it. Event ids can commit out of order, so
+# like the feed the cursor only moves past events older than
+# events.SETTLE_SECONDS, and newer ones are replayed again on each catch-up.
+#
+# Before answering, the registry compares events.change_token(), a commit
+# counter plus the feed's stamp file, so it only reads the feed after a
+# commit in this process or another worker on the host, and otherwise at
+# most every LIVE_SESSIONS_POLL_SECONDS for writers on other hosts. It
+# reloads from scratch if it has not been synced for RELOAD_SECONDS, as
+# the feed only keeps 24 hours of events.
+#
+# Reads go through their own connection, so events the caller's transaction
+# has written but not committed are never applied. apply_start/apply_end
+# note their uncommitted starts and ends in the session's info instead, so
+# duplicate-start checks within one batch see them.
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from models import db, ChargeSession, SessionEvent
+from serialization import SESSION_FIELDS
+import events
+
+POLL_SECONDS = float(os.getenv('LIVE_SESSIONS_POLL_SECONDS', 5))
+RELOAD_SECONDS = 3600
+BATCH_SIZE = 500
+
+
+class LiveSessions:
+    def __init__(self):
+        self.sessions = {}    # session_id -> to_dict() snapshot
+        self.by_vehicle = {}  # vehicle_no -> set of session_ids
+        self.cursor = None    # last applied session_events id
+        self.token = None
+        self.synced_at = 0.0
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def _add(self, session):
+        self.sessions[session['session_id']] = session
+        self.by_vehicle.setdefault(session['vehicle_no'], set()).add(session['session_id'])
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            ids = self.by_vehicle.get(session['vehicle_no'])
+            ids.discard(session_id)
+            if not ids:
+                del self.by_vehicle[session['vehicle_no']]
+
+    def _reload(self, conn):
+        # Cursor first, at the last settled event: events after it are
+        # replayed on top, which changes nothing as replaying is idempotent
+        events_table = SessionEvent.__table__
+        horizon = datetime.utcnow() - timedelta(seconds=events.SETTLE_SECONDS)
+        cursor = conn.execute(
+            select(func.coalesce(func.max(events_table.c.id), 0)).where(events_table.c.created_at < horizon)
+        ).scalar()
+        table = ChargeSession.__table__
+        rows = conn.execute(
+            select(*[table.c[name] for name in SESSION_FIELDS]).where(table.c.status == 'IN PROGRESS')
+        ).all()
+        self.sessions = {}
+        self.by_vehicle = {}
+        for row in rows:
+            self._add({
+                name: value.isoformat() if isinstance(value, datetime) else value
+                for name, value in zip(SESSION_FIELDS, row)
+            })
+        self.cursor = cursor
+        self.reloads += 1
+
+    def _catch_up(self, conn):
+        # Applies everything after the cursor, but only moves it past the
+        # settled events, so one that commits late under a lower id is
+        # still read next time
+        table = SessionEvent.__table__
+        stmt = select(table.c.id, table.c.event, table.c.payload, table.c.created_at).order_by(table.c.id).limit(BATCH_SIZE)
+        position = settled = self.cursor
+        while True:
+            rows = conn.execute(stmt.where(table.c.id > position)).all()
+            for row in rows:
+                session = json.loads(row.payload)
+                if row.event == 'session_started' and session['status'] == 'IN PROGRESS':
+                    self._add(session)
+                else:
+                    self._drop(session['session_id'])
+            if settled == position:
+                settled = events.settled_cursor(rows, settled)
+            if len(rows) < BATCH_SIZE:
+                self.cursor = settled
+                return
+            position = rows[-1].id
+
+    def sync(self):
+        """Bring the registry up to date if anything may have changed.
+        Needs an app context."""
+        token = events.change_token()
+        now = time.monotonic()
+        if self.cursor is not None and token == self.token and now - self.synced_at < POLL_SECONDS:
+            return
+        with self._lock:
+            if self.cursor is not None and token == self.token and now - self.synced_at < POLL_SECONDS:
+                return
+            with db.engine.connect() as conn:
+                if self.cursor is None or now - self.synced_at > RELOAD_SECONDS:
+                    self._reload(conn)
+                else:
+                    self._catch_up(conn)
+            # The token read before the queries, so a commit made while
+            # they ran is picked up next time
+            self.token = token
+            self.synced_at = now
+
+    def in_progress(self, station_name=None):
+        """Open sessions, at one station or all, newest first like
+        /sessions orders them."""
+        self.sync()
+        with self._lock:
+            sessions = [
+                s for s in self.sessions.values()
+                if station_name is None or s['station_name'] == station_name
+            ]
+        sessions.sort(key=lambda s: (s['start_time'] or '', s['session_id']), reverse=True)
+        return sessions
+
+    def open_session(self, vehicle_no):
+        """The committed open session of vehicle_no, or None."""
+        self.sync()
+        with self._lock:
+            ids = self.by_vehicle.get(vehicle_no)
+            return self.sessions[max(ids)] if ids else None
+
+
+registry = LiveSessions()
+
+
+def open_session_for(vehicle_no):
+    """session_id and station of vehicle_no's open session, counting starts
+    and ends made earlier in the current transaction, or None."""
+    pending = db.session.info.get('live_sessions_pending')
+    if pending and vehicle_no in pending['started']:
+        return pending['started'][vehicle_no]
+    session = registry.open_session(vehicle_no)
+    if session is None or (pending and session['session_id'] in pending['ended']):
+        return None
+    return session['session_id'], session['station_name']
+
+
+def _pending():
+    return db.session.info.setdefault('live_sessions_pending', {'started': {}, 'ended': set()})
+
+
+def started(session):
+    """Note a started, flushed ChargeSession in the current transaction."""
+    _pending()['started'][session.vehicle_no] = (session.session_id, session.station_name)
+
+
+def ended(session):
+    """Note an ended ChargeSession in the current transaction."""
+    pending = _pending()
+    pending['ended'].add(session.session_id)
+    if pending['started'].get(session.vehicle_no, (None,))[0] == session.session_id:
+        del pending['started'][session.vehicle_no]
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    # Once committed the changes come back through the event feed
+    session.info.pop('live_sessions_pending', None)
@@ -0,0 +1,259 @@
+# Per-request and per-query instrumentation, exposed in Prometheus text
+# format at /api/metrics.
+#
+# For every request we record, labelled by route: a latency histogram, the
+# number of SQL statements and the time spent in them, ORM rows loaded and
+# response bytes. Time is also split into phases - JWT decode and user lookup
+# in token_required, to_dict and JSON serialization - so slow endpoints can
+# be attributed. Phases are inclusive: SQL run by a lazy load inside to_dict
+# counts towards both sql and to_dict.
+#
+# Set SLOW_REQUEST_MS to log requests slower than that, with the SQL they
+# ran, to the 'slow_requests' logger (stderr under gunicorn).
+#
+# Metrics are kept per process; with several gunicorn workers each scrape
+# sees the worker that answered it.
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+SLOW_LOG_MAX_STATEMENTS = 20
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('auth_decode', 'auth_lookup', 'to_dict', 'serialize')
+
+slow_log = logging.getLogger('slow_requests')
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (endpoint, method) -> Histogram
+        self.counters = {}    # (name, labels) -> value
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def record(self, state, status, response_bytes):
+        elapsed = time.perf_counter() - state.started
+        labels = (('endpoint', state.endpoint), ('method', state.method))
+        with self._lock:
+            histogram = self.histograms.get(labels)
+            if histogram is None:
+                histogram = self.histograms[labels] = Histogram()
+            histogram.observe(elapsed)
+            self.inc('http_requests_total', labels + (('status', str(status)),))
+            self.inc('http_sql_statements_total', labels, state.sql_count)
+            self.inc('http_sql_seconds_total', labels, state.sql_seconds)
+            self.inc('http_rows_loaded_total', labels, state.rows_loaded)
+            self.inc('http_response_bytes_total', labels, response_bytes)
+            for phase, seconds in state.phases.items():
+                self.inc('http_phase_seconds_total', labels + (('phase', phase),), seconds)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            _log_slow(state, status, elapsed)
+
+    def render(self, extra=()):
+        lines = []
+        with self._lock:
+            lines.append('# HELP http_request_duration_seconds Request latency by route.')
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for labels, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(_sample('http_request_duration_seconds_bucket', labels + (('le', repr(bound)),), cumulative))
+                lines.append(_sample('http_request_duration_seconds_bucket', labels + (('le', '+Inf'),), histogram.count))
+                lines.append(_sample('http_request_duration_seconds_sum', labels, histogram.sum))
+                lines.append(_sample('http_request_duration_seconds_count', labels, histogram.count))
+            by_name = {}
+            for (name, labels), value in self.counters.items():
+                by_name.setdefault(name, []).append((labels, value))
+        for name, help_text in COUNTERS:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in sorted(by_name.get(name, [])):
+                lines.append(_sample(name, labels, value))
+        for name, kind, help_text, value in extra:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(_sample(name, (), value))
+        return '\n'.join(lines) + '\n'
+
+
+COUNTERS = [
+    ('http_requests_total', 'Requests by route and status.'),
+    ('http_sql_statements_total', 'SQL statements executed while serving requests.'),
+    ('http_sql_seconds_total', 'Time spent executing SQL while serving requests.'),
+    ('http_rows_loaded_total', 'ORM rows loaded while serving requests.'),
+    ('http_response_bytes_total', 'Response body bytes sent.'),
+    ('http_phase_seconds_total', 'Time spent in auth_decode, auth_lookup, to_dict and serialize.'),
+]
+
+registry = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f'{name}{{{label_text}}} {value}'
+    return f'{name} {value}'
+
+
+class RequestState:
+    __slots__ = ('endpoint', 'method', 'started', 'sql_count', 'sql_seconds',
+                 'rows_loaded', 'phases', 'statements')
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.rows_loaded = 0
+        self.phases = {}
+        # (seconds, statement) kept only when the slow log is on
+        self.statements = [] if SLOW_REQUEST_MS else None
+
+
+def _state():
+    if has_app_context():
+        return g.get('_request_metrics')
+    return None
+
+
+def _log_slow(state, status, elapsed):
+    statements = sorted(state.statements, key=lambda s: s[0], reverse=True)[:SLOW_LOG_MAX_STATEMENTS]
+    detail = '\n'.join(f'  {seconds * 1000:8.2f}ms  {statement}' for seconds, statement in statements)
+    slow_log.warning(
+        'Slow request %s %s -> %s in %.1fms (%d SQL statements, %.1fms SQL)\n%s',
+        state.method, state.endpoint, status, elapsed * 1000,
+        state.sql_count, state.sql_seconds * 1000, detail
+    )
+
+
+class phase:
+    """Context manager adding elapsed time to a named phase of the current request."""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        state = _state()
+        if state is not None:
+            state.phases[self.name] = state.phases.get(self.name, 0.0) + time.perf_counter() - self.started
+
+
+def timed(name):
+    """Decorator form of phase()."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    # jsonify and the NDJSON streams serialize through app.json
+    def dumps(self, obj, **kwargs):
+        with phase('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which a failed statement simply drops
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    state = _state()
+    if state is not None:
+        state.sql_count += 1
+        state.sql_seconds += elapsed
+        if state.statements is not None:
+            state.statements.append((elapsed, ' '.join(statement.split())))
+
+
+@event.listens_for(Mapper, 'load')
+def _row_loaded(target, context):
+    state = _state()
+    if state is not None:
+        state.rows_loaded += 1
+
+
+def init_app(app):
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_request():
+        # Label by route pattern, not path, to keep label cardinality bounded
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        g._request_metrics = RequestState(endpoint, request.method)
+
+    @app.after_request
+    def _finish_request(response):
+        state = g.pop('_request_metrics', None)
+        if state is None:
+            return response
+        if response.is_streamed:
+            # Streamed bodies are generated after this hook; record once
+            # the server has sent the last chunk
+            sent = [0]
+            chunks = response.response
+
+            def count_bytes():
+                try:
+                    for chunk in chunks:
+                        sent[0] += len(chunk)
+                        yield chunk
+                finally:
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
+
+            response.response = count_bytes()
+            g._request_metrics = state
+            response.call_on_close(lambda: registry.record(state, response.status_code, sent[0]))
+        else:
+            registry.record(state, response.status_code, response.content_length or 0)
+        return response
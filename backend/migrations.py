@@ -0,0 +1,145 @@
+# Versioned schema migrations.
+#
+# Every schema change, including creating a table, goes in here as a
+# numbered step; the applied version is recorded in the schema_version table
+# so each step runs exactly once per database. Steps must work on SQLite and
+# Postgres. A fresh database is built by the same steps, in the same order,
+# as one that has been upgraded along the way, so a later step never
+# depends on how the database was first created.
+#
+# Usage: python migrations.py
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Float, MetaData, String, Table, inspect, text
+from models import (
+    db, BatchOperation, ChargeSession, ChargeSessionArchive, ReconciliationRun,
+    SessionEvent, SessionFlag, StationDailyStats, Tariff, User, VehicleMaster
+)
+
+# The tables that predate versioned migrations, as they were then.
+# vehicle_master is spelled out because step 4 has changed it since; the
+# model's current definition must not leak into step 1.
+_base = MetaData()
+Table(
+    'vehicle_master', _base,
+    Column('vehicle_no', String(20), primary_key=True),
+    Column('vehicle_name', String(100)),
+    Column('phone_no', String(20)),
+    Column('battery_capacity', Float),
+    Column('last_updated', DateTime),
+)
+ChargeSession.__table__.to_metadata(_base)
+User.__table__.to_metadata(_base)
+
+
+def _create_tables(conn, *models):
+    # Steps that read a table introduced after them create it first, so
+    # they also work on databases upgraded from before that table existed
+    for model in models:
+        model.__table__.create(bind=conn, checkfirst=True)
+
+
+def _create_indexes(conn, table, names):
+    for index in table.indexes:
+        if index.name in names:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _charge_session_indexes(conn):
+    _base.create_all(bind=conn, checkfirst=True)
+    _create_indexes(conn, ChargeSession.__table__, {
+        'ix_sessions_station_status_end',
+        'ix_sessions_station_status_start',
+        'ix_sessions_status_end',
+        'ix_sessions_vehicle_start',
+    })
+
+
+def _backfill_station_daily_stats(conn):
+    _create_tables(conn, StationDailyStats, ChargeSessionArchive)
+    from rollups import rebuild
+    rebuild(conn)
+
+
+def _vehicle_search_indexes(conn):
+    from vehicle_search import install
+    install(conn)
+
+
+def _vehicle_lifetime_totals(conn):
+    # Databases that were set up with db.create_all() after the columns
+    # were added to the model already have them
+    table = VehicleMaster.__table__
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    for name in ('session_count', 'total_kwh', 'total_paid', 'last_station', 'last_session_at'):
+        if name in existing:
+            continue
+        column = table.c[name]
+        ddl = f'ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}'
+        if column.server_default is not None:
+            ddl += f' NOT NULL DEFAULT {column.server_default.arg}'
+        conn.execute(text(ddl))
+    _create_tables(conn, ChargeSessionArchive)
+    from rollups import rebuild_vehicle_totals
+    rebuild_vehicle_totals(conn)
+
+
+def _remaining_tables(conn):
+    # Tables that used to be left to db.create_all(). Databases set up that
+    # way already have them, so this only does anything on new ones.
+    _create_tables(
+        conn, StationDailyStats, SessionEvent, BatchOperation, ChargeSessionArchive,
+        Tariff, ReconciliationRun, SessionFlag
+    )
+
+
+# (version, description, step) - append only, never renumber
+MIGRATIONS = [
+    (1, 'base tables and charge_sessions access-path indexes', _charge_session_indexes),
+    (2, 'backfill station_daily_stats rollup', _backfill_station_daily_stats),
+    (3, 'vehicle search indexes', _vehicle_search_indexes),
+    (4, 'vehicle lifetime totals', _vehicle_lifetime_totals),
+    (5, 'event feed, batch, archive, tariff and reconciliation tables', _remaining_tables),
+]
+
+
+def current_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        conn.execute(text(
+            'CREATE TABLE schema_version ('
+            'version INTEGER PRIMARY KEY, '
+            'description VARCHAR(200), '
+            'applied_at TIMESTAMP)'
+        ))
+        return 0
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+
+def upgrade():
+    """Apply pending migrations. Must be called inside an app context.
+    Returns the list of versions applied."""
+    applied = []
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        # One transaction per step so a failure leaves a consistent version
+        with db.engine.begin() as conn:
+            step(conn)
+            conn.execute(
+                text('INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)'),
+                {'v': number, 'd': description, 't': datetime.utcnow()}
+            )
+        applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        applied = upgrade()
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Schema is up to date.")
@@ -1,5 +1,7 @@
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from metrics import timed
 
 db = SQLAlchemy()
 
@@ -10,7 +12,14 @@ class VehicleMaster(db.Model):
     phone_no = db.Column(db.String(20))
     battery_capacity = db.Column(db.Float)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+    # Lifetime totals of completed sessions, kept by rollups.py
+    session_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_kwh = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    total_paid = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    last_station = db.Column(db.String(50))
+    last_session_at = db.Column(db.DateTime)
 
+    @timed('to_dict')
     def to_dict(self):
         return {
             'vehicle_no': self.vehicle_no,
@@ -20,8 +29,17 @@ class VehicleMaster(db.Model):
             'last_updated': self.last_updated.isoformat() if self.last_updated else None
         }
 
-class ChargeSession(db.Model):
-    __tablename__ = 'charge_sessions'
+    def lifetime_dict(self):
+        return {
+            'session_count': self.session_count or 0,
+            'total_kwh': round(self.total_kwh or 0, 2),
+            'total_paid': round(self.total_paid or 0, 2),
+            'last_station': self.last_station,
+            'last_session_at': self.last_session_at.isoformat() if self.last_session_at else None
+        }
+
+class SessionColumns:
+    # Columns and serialization shared by charge_sessions and its archive
     session_id = db.Column(db.Integer, primary_key=True)
     vehicle_no = db.Column(db.String(20), db.ForeignKey('vehicle_master.vehicle_no'), nullable=False)
     station_name = db.Column(db.String(50), nullable=False)
@@ -35,8 +53,7 @@ class ChargeSession(db.Model):
     payment_method = db.Column(db.String(20)) # Cash/QR
     status = db.Column(db.String(20), default='IN PROGRESS') # IN PROGRESS, COMPLETED
 
-    vehicle = db.relationship('VehicleMaster', backref=db.backref('sessions', lazy=True))
-
+    @timed('to_dict')
     def to_dict(self):
         return {
             'session_id': self.session_id,
@@ -53,6 +70,30 @@ class ChargeSession(db.Model):
             'status': self.status
         }
 
+class ChargeSession(SessionColumns, db.Model):
+    __tablename__ = 'charge_sessions'
+    # Composite indexes matching the hot query shapes in routes.py.
+    # Existing databases get these through migrations.py.
+    __table_args__ = (
+        db.Index('ix_sessions_station_status_end', 'station_name', 'status', 'end_time'),
+        db.Index('ix_sessions_station_status_start', 'station_name', 'status', 'start_time'),
+        db.Index('ix_sessions_status_end', 'status', 'end_time'),
+        db.Index('ix_sessions_vehicle_start', 'vehicle_no', 'start_time'),
+    )
+
+    vehicle = db.relationship('VehicleMaster', backref=db.backref('sessions', lazy=True))
+
+class ChargeSessionArchive(SessionColumns, db.Model):
+    # Completed sessions older than ARCHIVE_AFTER_DAYS, moved out of
+    # charge_sessions by archive.py with their session_id unchanged.
+    # Read through archive.session_source(), never written by requests.
+    __tablename__ = 'charge_sessions_archive'
+    __table_args__ = (
+        db.Index('ix_archive_station_end', 'station_name', 'end_time'),
+        db.Index('ix_archive_end', 'end_time'),
+        db.Index('ix_archive_vehicle_start', 'vehicle_no', 'start_time'),
+    )
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -66,3 +107,131 @@ class User(db.Model):
             'username': self.username,
             'role': self.role
         }
+
+class StationDailyStats(db.Model):
+    # Per-station, per-day rollup of completed sessions, keyed on the UTC
+    # date of end_time. Maintained by rollups.record_completed_session().
+    __tablename__ = 'station_daily_stats'
+    station_name = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    energy_kwh = db.Column(db.Float, nullable=False, default=0)
+    earnings = db.Column(db.Float, nullable=False, default=0)
+    earnings_cash = db.Column(db.Float, nullable=False, default=0)
+    earnings_qr = db.Column(db.Float, nullable=False, default=0)
+    duration_seconds = db.Column(db.Float, nullable=False, default=0)
+    duration_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'station_name': self.station_name,
+            'day': self.day.isoformat() if self.day else None,
+            'session_count': self.session_count,
+            'energy_kwh': self.energy_kwh,
+            'earnings': self.earnings,
+            'earnings_cash': self.earnings_cash,
+            'earnings_qr': self.earnings_qr,
+            'duration_seconds': self.duration_seconds,
+            'duration_count': self.duration_count
+        }
+
+class SessionEvent(db.Model):
+    # Append-only feed of session changes backing /sessions/events.
+    # Written by events.record() in the same transaction as the change.
+    __tablename__ = 'session_events'
+    __table_args__ = (
+        db.Index('ix_session_events_station_id', 'station_name', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    station_name = db.Column(db.String(50), nullable=False)
+    event = db.Column(db.String(30), nullable=False) # session_started, session_ended
+    session_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON of ChargeSession.to_dict()
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class BatchOperation(db.Model):
+    # Result of each successfully applied /sessions/batch operation, keyed by
+    # the client's idempotency key so replays return the original result.
+    __tablename__ = 'batch_operations'
+    idempotency_key = db.Column(db.String(100), primary_key=True)
+    username = db.Column(db.String(50), nullable=False)
+    op = db.Column(db.String(10), nullable=False) # start, end
+    session_id = db.Column(db.Integer)
+    status_code = db.Column(db.Integer, nullable=False)
+    response = db.Column(db.Text, nullable=False) # JSON body returned for the operation
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Tariff(db.Model):
+    # One version of a station's time-of-use tariff; station_name NULL is
+    # the default for stations without their own. Versions are never
+    # edited: a new row takes over from its effective_from. See tariffs.py.
+    __tablename__ = 'tariffs'
+    __table_args__ = (
+        db.Index('ix_tariffs_station_effective', 'station_name', 'effective_from'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    station_name = db.Column(db.String(50))
+    effective_from = db.Column(db.DateTime, nullable=False)
+    schedule = db.Column(db.Text, nullable=False) # JSON: default_rate and periods
+    created_by = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'station_name': self.station_name,
+            'effective_from': self.effective_from.isoformat() if self.effective_from else None,
+            'schedule': json.loads(self.schedule),
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ReconciliationRun(db.Model):
+    # One pass of reconciliation.py over sessions that ended in [since, until)
+    __tablename__ = 'reconciliation_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False) # full, incremental
+    since = db.Column(db.DateTime) # None for a full run
+    until = db.Column(db.DateTime, nullable=False)
+    examined = db.Column(db.Integer, nullable=False, default=0)
+    flagged = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'since': self.since.isoformat() if self.since else None,
+            'until': self.until.isoformat() if self.until else None,
+            'examined': self.examined,
+            'flagged': self.flagged,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class SessionFlag(db.Model):
+    # A completed session that failed a reconciliation check, one row per
+    # reason. Replaced whenever reconciliation.py examines the session again.
+    __tablename__ = 'session_flags'
+    __table_args__ = (
+        db.Index('ix_session_flags_station', 'station_name', 'session_id'),
+    )
+    session_id = db.Column(db.Integer, primary_key=True)
+    reason = db.Column(db.String(30), primary_key=True)
+    station_name = db.Column(db.String(50), nullable=False)
+    expected = db.Column(db.Float)
+    actual = db.Column(db.Float)
+    run_id = db.Column(db.Integer)
+    flagged_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'reason': self.reason,
+            'station_name': self.station_name,
+            'expected': self.expected,
+            'actual': self.actual,
+            'run_id': self.run_id,
+            'flagged_at': self.flagged_at.isoformat() if self.flagged_at else None
+        }
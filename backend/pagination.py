@@ -0,0 +1,94 @@
+# Keyset pagination and NDJSON streaming helpers for the session list endpoints.
+#
+# Pages are ordered by (sort_column DESC, session_id DESC) and the cursor is
+# the last row's pair of values (the sort value may be NULL), so fetching page N costs the same as page 1
+# and never uses OFFSET. Cursors are opaque to clients.
+import base64
+import json
+from datetime import datetime
+from flask import Response, stream_with_context
+from models import db, ChargeSession
+from serialization import SESSION_FIELDS, dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(sort_value, session_id):
+    payload = json.dumps([sort_value.isoformat() if sort_value else None, session_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (sort_value, session_id) or raise ValueError."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, session_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(sort_value) if sort_value else None), int(session_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_limit(value):
+    """Page size from a query arg; None means unpaginated. Raises ValueError."""
+    if value is None or value == '':
+        return None
+    try:
+        limit = int(value)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid limit')
+    if limit < 1:
+        raise ValueError('Invalid limit')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def keyset_order(query, sort_column, cursor=None, sessions=ChargeSession):
+    """Apply descending keyset ordering, starting after cursor if given.
+    sessions is the entity sort_column belongs to, when it is an alias of
+    ChargeSession (see archive.session_source).
+
+    Rows with a NULL sort value come first, stated in ORDER BY rather than
+    left to the dialect (SQLite and Postgres disagree), so the cursor
+    predicates match on both. Both serve this order from the index."""
+    if cursor:
+        sort_value, session_id = decode_cursor(cursor)
+        if sort_value is None:
+            query = query.filter(db.or_(
+                db.and_(sort_column.is_(None), sessions.session_id < session_id),
+                sort_column.isnot(None)
+            ))
+        else:
+            query = query.filter(db.or_(
+                sort_column < sort_value,
+                db.and_(sort_column == sort_value, sessions.session_id < session_id)
+            ))
+    return query.order_by(sort_column.desc().nulls_first(), sessions.session_id.desc())
+
+
+def fetch_page(query, sort_column, limit):
+    """Fetch one page from an already keyset-ordered query.
+    Returns (rows, next_cursor); next_cursor is None on the last page."""
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), last.session_id)
+
+
+def ndjson_response(query, head=None, limit=None, fields=SESSION_FIELDS):
+    """Stream a query of column tuples (see serialization.select_fields) as
+    newline-delimited JSON, one session per line with the given fields.
+    Rows are pulled from the cursor in batches so worker memory stays flat.
+    If head is given it is written as the first line."""
+    if limit:
+        query = query.limit(limit)
+
+    def generate():
+        if head is not None:
+            yield dumps(head) + b'\n'
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield dumps(dict(zip(fields, row))) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,227 @@
+# Payment reconciliation and anomaly detection for completed sessions.
+#
+# Sessions are read in session_id chunks as plain columns, joined to the
+# vehicle's battery_capacity, and every check runs over a whole chunk's
+# column arrays at once. Each flagged (session, reason) is written to
+# session_flags with the expected and actual values; a session's old flags
+# are replaced whenever it is examined again, so fixing the data (or
+# rebilling) and re-running clears them.
+#
+# Reasons:
+#   PAYMENT_MISMATCH   price_paid differs from calculated_cost_rs by more
+#                      than RECONCILE_PAYMENT_TOLERANCE_RS (or _PCT of it)
+#   ENERGY_MISMATCH    unit_kwh is outside RECONCILE_ENERGY_RATIO_MIN..MAX
+#                      times the charge added, (soc_end - soc_start) / 100
+#                      * battery_capacity, give or take ENERGY_SLACK_KWH
+#   DURATION_INVALID   no start_time, or end_time before start_time
+#   DURATION_TOO_SHORT under MIN_DURATION_MINUTES
+#   DURATION_TOO_LONG  over RECONCILE_MAX_DURATION_HOURS
+#   POWER_TOO_HIGH     unit_kwh over the duration needs more than
+#                      RECONCILE_MAX_POWER_KW
+#
+# A full run examines every completed session, archived ones included. An
+# incremental run examines sessions that ended since the previous run's
+# cutoff, reaching back RECONCILE_LOOKBACK_DAYS further so ends uploaded
+# late by offline devices are still checked.
+#
+# Usage (daily scheduled task):
+#   python reconciliation.py
+#   python reconciliation.py --full
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from models import db, ChargeSession, ChargeSessionArchive, ReconciliationRun, SessionFlag, VehicleMaster
+import archive
+
+PAYMENT_TOLERANCE_RS = float(os.getenv('RECONCILE_PAYMENT_TOLERANCE_RS', 1.0))
+PAYMENT_TOLERANCE_PCT = float(os.getenv('RECONCILE_PAYMENT_TOLERANCE_PCT', 2.0))
+ENERGY_RATIO_MIN = float(os.getenv('RECONCILE_ENERGY_RATIO_MIN', 0.8))
+ENERGY_RATIO_MAX = float(os.getenv('RECONCILE_ENERGY_RATIO_MAX', 1.35))
+ENERGY_SLACK_KWH = 1.0
+MIN_DURATION_MINUTES = 1.0
+MAX_DURATION_HOURS = float(os.getenv('RECONCILE_MAX_DURATION_HOURS', 24))
+MAX_POWER_KW = float(os.getenv('RECONCILE_MAX_POWER_KW', 150))
+LOOKBACK_DAYS = float(os.getenv('RECONCILE_LOOKBACK_DAYS', 7))
+BATCH_SIZE = 20000
+# Session ids per DELETE of a chunk's old flags, to keep IN lists short
+DELETE_BATCH_SIZE = 500
+
+REASONS = (
+    'PAYMENT_MISMATCH', 'ENERGY_MISMATCH', 'DURATION_INVALID',
+    'DURATION_TOO_SHORT', 'DURATION_TOO_LONG', 'POWER_TOO_HIGH'
+)
+
+
+def check_payment(paid, cost):
+    """(expected, actual) per session where price_paid is off, else None."""
+    tolerance_rs = PAYMENT_TOLERANCE_RS
+    tolerance = PAYMENT_TOLERANCE_PCT / 100
+    return [
+        (c, p) if c is not None and abs((p or 0) - c) > max(tolerance_rs, c * tolerance) else None
+        for p, c in zip(paid, cost)
+    ]
+
+
+def check_energy(kwh, soc_start, soc_end, capacity):
+    """(expected kWh added to the battery, unit_kwh) where they disagree."""
+    low, high, slack = ENERGY_RATIO_MIN, ENERGY_RATIO_MAX, ENERGY_SLACK_KWH
+    result = []
+    for k, s0, s1, cap in zip(kwh, soc_start, soc_end, capacity):
+        if k is None or s0 is None or s1 is None or not cap:
+            result.append(None)
+            continue
+        added = (s1 - s0) / 100 * cap
+        result.append((round(added, 3), k) if not added * low - slack <= k <= added * high + slack else None)
+    return result
+
+
+def check_duration(start, end, kwh):
+    """(reason, expected, actual) for implausible durations, else None.
+    Durations are in minutes, power in kW."""
+    short, long_ = MIN_DURATION_MINUTES, MAX_DURATION_HOURS * 60
+    max_power = MAX_POWER_KW
+    result = []
+    for s, e, k in zip(start, end, kwh):
+        if s is None or e is None or e < s:
+            result.append(('DURATION_INVALID', None, None))
+            continue
+        minutes = (e - s).total_seconds() / 60
+        if minutes < short:
+            result.append(('DURATION_TOO_SHORT', short, round(minutes, 2)))
+        elif minutes > long_:
+            result.append(('DURATION_TOO_LONG', long_, round(minutes, 2)))
+        elif k and k / (minutes / 60) > max_power:
+            result.append(('POWER_TOO_HIGH', max_power, round(k / (minutes / 60), 1)))
+        else:
+            result.append(None)
+    return result
+
+
+def examine(columns, run_id, now):
+    """Flag rows for one chunk given as column tuples. Returns the
+    session_flags rows to insert."""
+    ids, stations, start, end, soc_start, soc_end, kwh, cost, paid, capacity = columns
+    flags = []
+    checks = (
+        ('PAYMENT_MISMATCH', check_payment(paid, cost)),
+        ('ENERGY_MISMATCH', check_energy(kwh, soc_start, soc_end, capacity)),
+    )
+    for reason, results in checks:
+        for session_id, station_name, found in zip(ids, stations, results):
+            if found:
+                flags.append({
+                    'session_id': session_id, 'reason': reason, 'station_name': station_name,
+                    'expected': found[0], 'actual': found[1], 'run_id': run_id, 'flagged_at': now
+                })
+    for session_id, station_name, found in zip(ids, stations, check_duration(start, end, kwh)):
+        if found:
+            flags.append({
+                'session_id': session_id, 'reason': found[0], 'station_name': station_name,
+                'expected': found[1], 'actual': found[2], 'run_id': run_id, 'flagged_at': now
+            })
+    return flags
+
+
+def _chunks(conn, table, stmt, full, batch_size):
+    # A full run walks fixed session_id windows: ORDER BY session_id LIMIT
+    # over every completed session sorts all of them again for each chunk.
+    # An incremental run's few sessions are paged through in id order.
+    if full:
+        highest = conn.execute(select(func.max(table.c.session_id))).scalar() or 0
+        for low in range(0, highest, batch_size):
+            rows = conn.execute(stmt.where(
+                table.c.session_id > low, table.c.session_id <= low + batch_size
+            )).all()
+            if rows:
+                yield rows
+        return
+
+    stmt = stmt.order_by(table.c.session_id).limit(batch_size)
+    last_id = 0
+    while True:
+        rows = conn.execute(stmt.where(table.c.session_id > last_id)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def run(conn, full=False, batch_size=BATCH_SIZE):
+    """Reconcile completed sessions on conn, committing per chunk. Returns
+    the finished run as a dict."""
+    until = datetime.utcnow()
+    since = None
+    if not full:
+        runs = ReconciliationRun.__table__
+        previous = conn.execute(
+            select(runs.c.until).where(runs.c.finished_at.isnot(None))
+            .order_by(runs.c.until.desc()).limit(1)
+        ).scalar()
+        if previous:
+            since = previous - timedelta(days=LOOKBACK_DAYS)
+
+    reconciliation_run = {'mode': 'full' if full else 'incremental', 'since': since, 'until': until,
+                          'examined': 0, 'flagged': 0, 'started_at': until}
+    run_id = conn.execute(insert(ReconciliationRun.__table__).values(**reconciliation_run)).inserted_primary_key[0]
+    conn.commit()
+
+    flags_table = SessionFlag.__table__
+    vehicles = VehicleMaster.__table__
+    tables = [ChargeSession.__table__]
+    if archive.needs_archive(since):
+        tables.append(ChargeSessionArchive.__table__)
+    for table in tables:
+        stmt = (
+            select(
+                table.c.session_id, table.c.station_name, table.c.start_time, table.c.end_time,
+                table.c.soc_start, table.c.soc_end, table.c.unit_kwh,
+                table.c.calculated_cost_rs, table.c.price_paid, vehicles.c.battery_capacity
+            )
+            .select_from(table.outerjoin(vehicles, vehicles.c.vehicle_no == table.c.vehicle_no))
+            .where(table.c.status == 'COMPLETED', table.c.end_time < until)
+        )
+        if since:
+            stmt = stmt.where(table.c.end_time >= since)
+
+        for rows in _chunks(conn, table, stmt, since is None, batch_size):
+            columns = list(zip(*rows))
+            flags = examine(columns, run_id, datetime.utcnow())
+            ids = columns[0]
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                conn.execute(delete(flags_table).where(
+                    flags_table.c.session_id.in_(ids[start:start + DELETE_BATCH_SIZE])
+                ))
+            if flags:
+                conn.execute(insert(flags_table), flags)
+            conn.commit()
+            reconciliation_run['examined'] += len(rows)
+            reconciliation_run['flagged'] += len(flags)
+
+    reconciliation_run['finished_at'] = datetime.utcnow()
+    runs = ReconciliationRun.__table__
+    conn.execute(runs.update().where(runs.c.id == run_id).values(
+        examined=reconciliation_run['examined'],
+        flagged=reconciliation_run['flagged'],
+        finished_at=reconciliation_run['finished_at']
+    ))
+    conn.commit()
+    return dict(reconciliation_run, id=run_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag sessions whose payment, energy or duration looks wrong.')
+    parser.add_argument('--full', action='store_true', help='examine every completed session, not just new ones')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        with db.engine.connect() as conn:
+            result = run(conn, args.full, args.batch_size)
+        elapsed = time.perf_counter() - started
+    print(f"{result['mode'].capitalize()} run: examined {result['examined']} sessions, "
+          f"{result['flagged']} flags in {elapsed:.1f}s")
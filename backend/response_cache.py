@@ -0,0 +1,177 @@
+# Shared response cache with ETag / If-None-Match support for read endpoints.
+#
+# Cached bodies are keyed by endpoint, arguments, the caller's role (which
+# is also their station scope) and the version counters of the stations the
+# response depends on. Any commit that writes a ChargeSession bumps the
+# counter of its station and the global '*' counter, so later lookups use
+# new keys and never see the stale body. Responses are also dropped after
+# RESPONSE_CACHE_TTL seconds, since rolling windows like period=day change
+# with the clock alone.
+#
+# The store is a SQLite file shared by every worker on the host.
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import wraps
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, ChargeSession
+
+ENABLED = os.getenv('RESPONSE_CACHE', 'True') == 'True'
+TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL', 30))
+PRUNE_EVERY = 1000
+ALL_STATIONS = '*'
+# Headers regenerated on every response rather than replayed from the store
+_OWN_HEADERS = {'content-type', 'content-length', 'etag', 'cache-control'}
+
+_local = threading.local()
+_stores = 0
+
+
+def _store_path():
+    path = os.getenv('RESPONSE_CACHE_PATH')
+    if path:
+        return path
+    digest = hashlib.sha1(str(db.engine.url).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'evcs-response-cache-{digest}.db')
+
+
+def _connection():
+    path = _store_path()
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, etag TEXT NOT NULL, body BLOB NOT NULL, '
+            'mimetype TEXT NOT NULL, headers TEXT NOT NULL, stored_at REAL NOT NULL)'
+        )
+        connections[path] = conn
+    return conn
+
+
+def versions(scopes):
+    rows = dict(_connection().execute(
+        f"SELECT scope, version FROM versions WHERE scope IN ({','.join('?' * len(scopes))})",
+        scopes
+    ).fetchall())
+    return [rows.get(scope, 0) for scope in scopes]
+
+
+def bump(station_names=()):
+    """Invalidate cached responses for these stations (and all-station
+    views). Bulk writers that bypass the ORM session call this after each
+    commit; with no stations only all-station views are invalidated."""
+    if not ENABLED:
+        return
+    scopes = set(station_names) | {ALL_STATIONS}
+    conn = _connection()
+    conn.executemany(
+        'INSERT INTO versions (scope, version) VALUES (?, 1) '
+        'ON CONFLICT(scope) DO UPDATE SET version = version + 1',
+        [(scope,) for scope in scopes]
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_station_writes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ChargeSession) and obj.station_name:
+            session.info.setdefault('cache_dirty_stations', set()).add(obj.station_name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    stations = session.info.pop('cache_dirty_stations', None)
+    if stations:
+        bump(stations)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('cache_dirty_stations', None)
+
+
+def _etag_matches(etag):
+    # Weak comparison: compression.py turns the ETag of compressed
+    # responses into a weak one
+    return request.if_none_match.contains_weak(etag)
+
+
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def cached_response(stations):
+    """Cache a GET endpoint wrapped by token_required.
+
+    stations(current_user, **view_args) returns the station names the
+    response depends on, or None if it may depend on any station.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            global _stores
+            if not ENABLED:
+                return f(current_user, *args, **kwargs)
+
+            scopes = stations(current_user, **kwargs) or [ALL_STATIONS]
+            key_source = '|'.join([
+                request.endpoint,
+                repr(sorted(request.args.items(multi=True))),
+                repr(sorted(kwargs.items())),
+                current_user.role,
+                repr(versions(scopes)),
+            ])
+            key = hashlib.sha1(key_source.encode()).hexdigest()
+            conn = _connection()
+
+            row = conn.execute(
+                'SELECT etag, body, mimetype, headers FROM responses WHERE key = ? AND stored_at > ?',
+                (key, time.time() - TTL_SECONDS)
+            ).fetchone()
+            if row:
+                etag, body, mimetype, headers = row
+                if _etag_matches(etag):
+                    return _not_modified(etag)
+                response = current_app.response_class(body, mimetype=mimetype, headers=json.loads(headers))
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = current_app.make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _OWN_HEADERS]
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, etag, body, mimetype, headers, stored_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, etag, body, response.mimetype, json.dumps(headers), time.time())
+            )
+            _stores += 1
+            if _stores % PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - TTL_SECONDS,))
+
+            if _etag_matches(etag):
+                return _not_modified(etag)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated
+    return decorator
@@ -0,0 +1,263 @@
+# Per-station daily rollup of completed sessions (station_daily_stats).
+#
+# end_session adds each completed session to its (station, day) row in the
+# same transaction that completes it, so station stats for any period are
+# answered from a few rollup rows plus at most one partial edge day read
+# from charge_sessions (or its archive, for old edge days).
+#
+# The same transaction adds the session to its vehicle's lifetime totals on
+# vehicle_master (session count, kWh, amount paid, last station and time),
+# so a vehicle's history summary is one row read.
+#
+# Usage: python rollups.py rebuild [batch_size]
+import sys
+from datetime import datetime, time, timedelta
+from sqlalchemy import bindparam, case, insert, select, update
+from models import db, ChargeSession, ChargeSessionArchive, StationDailyStats, VehicleMaster
+import archive
+
+REBUILD_BATCH_SIZE = 5000
+
+ROLLUP_FIELDS = (
+    'session_count', 'energy_kwh', 'earnings', 'earnings_cash',
+    'earnings_qr', 'duration_seconds', 'duration_count'
+)
+
+
+def _session_columns(sessions):
+    # Columns needed to roll up a session, in the order _accumulate expects
+    return (
+        sessions.end_time, sessions.start_time, sessions.unit_kwh,
+        sessions.price_paid, sessions.payment_method
+    )
+
+
+def empty_totals():
+    return dict.fromkeys(ROLLUP_FIELDS, 0)
+
+
+def _accumulate(totals, end_time, start_time, unit_kwh, price_paid, payment_method):
+    paid = price_paid or 0
+    totals['session_count'] += 1
+    totals['energy_kwh'] += unit_kwh or 0
+    totals['earnings'] += paid
+    method = (payment_method or '').lower()
+    if method == 'cash':
+        totals['earnings_cash'] += paid
+    elif method == 'qr':
+        totals['earnings_qr'] += paid
+    if start_time and end_time:
+        totals['duration_seconds'] += (end_time - start_time).total_seconds()
+        totals['duration_count'] += 1
+
+
+def _add_to_rollup(station_name, day, deltas):
+    table = StationDailyStats.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        # Atomic upsert so concurrent workers never race on creating the row.
+        # Imported here so a worker only loads its own dialect at startup
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(station_name=station_name, day=day, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['station_name', 'day'],
+            set_={f: table.c[f] + stmt.excluded[f] for f in ROLLUP_FIELDS}
+        )
+        db.session.execute(stmt)
+        return
+
+    row = db.session.get(StationDailyStats, (station_name, day))
+    if row is None:
+        row = StationDailyStats(station_name=station_name, day=day, **empty_totals())
+        db.session.add(row)
+    for field, value in deltas.items():
+        setattr(row, field, getattr(row, field) + value)
+
+
+def record_completed_session(session):
+    """Add a just-completed session to the rollup. Runs in the caller's
+    transaction; the caller commits."""
+    totals = empty_totals()
+    _accumulate(totals, session.end_time, session.start_time, session.unit_kwh,
+                session.price_paid, session.payment_method)
+    _add_to_rollup(session.station_name, session.end_time.date(), totals)
+    _add_to_vehicle(session)
+
+
+def _add_to_vehicle(session):
+    # One UPDATE of column increments, so concurrent ends for the same
+    # vehicle both count. Sessions uploaded late by offline devices leave
+    # last_station alone when a later one is already recorded.
+    table = VehicleMaster.__table__
+    is_latest = db.or_(table.c.last_session_at.is_(None), table.c.last_session_at <= session.end_time)
+    db.session.execute(
+        update(table).where(table.c.vehicle_no == session.vehicle_no).values(
+            session_count=table.c.session_count + 1,
+            total_kwh=table.c.total_kwh + (session.unit_kwh or 0),
+            total_paid=table.c.total_paid + (session.price_paid or 0),
+            last_station=case((is_latest, session.station_name), else_=table.c.last_station),
+            last_session_at=case((is_latest, session.end_time), else_=table.c.last_session_at),
+        )
+    )
+
+
+def station_totals(station_name, start_date=None):
+    """Totals for completed sessions at a station with end_time >= start_date
+    (all time if start_date is None)."""
+    totals = overview_totals({'window': start_date}, [station_name])
+    return totals.get(station_name, {}).get('window', empty_totals())
+
+
+def overview_totals(windows, station_names=None):
+    """Totals per station for several windows at once.
+
+    windows maps a label to a start datetime (None for all time). Whole
+    days come from one grouped pass over the rollup with a conditional sum
+    per window; the partially covered first day of each window is read from
+    charge_sessions in one more query. Returns {station: {label: totals}}.
+    """
+    edges = {}
+    columns = []
+    for label, start_date in windows.items():
+        first_full_day = None
+        if start_date:
+            # Whole days after the window start come from the rollup, the
+            # partially covered first day is read from charge_sessions
+            first_full_day = start_date.date() + timedelta(days=1)
+            edges[label] = (start_date, datetime.combine(first_full_day, time.min))
+        for field in ROLLUP_FIELDS:
+            column = getattr(StationDailyStats, field)
+            if first_full_day:
+                column = db.case((StationDailyStats.day >= first_full_day, column), else_=0)
+            columns.append(db.func.coalesce(db.func.sum(column), 0))
+
+    query = db.session.query(StationDailyStats.station_name, *columns).group_by(StationDailyStats.station_name)
+    if station_names is not None:
+        query = query.filter(StationDailyStats.station_name.in_(station_names))
+
+    result = {}
+    labels = list(windows)
+    width = len(ROLLUP_FIELDS)
+    for station_name, *values in query:
+        result[station_name] = {
+            label: dict(zip(ROLLUP_FIELDS, values[i * width:(i + 1) * width]))
+            for i, label in enumerate(labels)
+        }
+
+    if edges:
+        # Edge days of long windows (period=year) may be archived already
+        sessions = archive.session_source(since=min(start for start, _ in edges.values()), status='COMPLETED')
+        edge_query = db.session.query(sessions.station_name, *_session_columns(sessions)).filter(
+            sessions.status == 'COMPLETED',
+            db.or_(*[
+                db.and_(sessions.end_time >= start, sessions.end_time < end)
+                for start, end in edges.values()
+            ])
+        )
+        if station_names is not None:
+            edge_query = edge_query.filter(sessions.station_name.in_(station_names))
+        for station_name, *row in edge_query:
+            per_window = result.setdefault(station_name, {label: empty_totals() for label in labels})
+            for label, (start, end) in edges.items():
+                if start <= row[0] < end:
+                    _accumulate(per_window[label], *row)
+    return result
+
+
+def rebuild(conn, batch_size=REBUILD_BATCH_SIZE):
+    """Recompute station_daily_stats from charge_sessions and its archive
+    on conn.
+
+    Completed sessions are read in session_id batches, selecting only the
+    rolled-up columns, and the rollup is rewritten in the caller's
+    transaction. Returns the number of rollup rows written."""
+    days = {}
+    for sessions in (ChargeSession, ChargeSessionArchive):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(sessions.session_id, sessions.station_name, *_session_columns(sessions))
+                .where(sessions.status == 'COMPLETED', sessions.session_id > last_id)
+                .order_by(sessions.session_id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for session_id, station_name, end_time, *rest in rows:
+                if end_time is None:
+                    continue
+                key = (station_name, end_time.date())
+                if key not in days:
+                    days[key] = empty_totals()
+                _accumulate(days[key], end_time, *rest)
+            last_id = rows[-1][0]
+
+    conn.execute(StationDailyStats.__table__.delete())
+    if days:
+        conn.execute(insert(StationDailyStats.__table__), [
+            dict(station_name=station_name, day=day, **totals)
+            for (station_name, day), totals in days.items()
+        ])
+    return len(days)
+
+
+def rebuild_vehicle_totals(conn, batch_size=REBUILD_BATCH_SIZE):
+    """Recompute the lifetime totals on vehicle_master from charge_sessions
+    and its archive on conn, in the caller's transaction. Returns the
+    number of vehicles with completed sessions."""
+    vehicles = {}
+    for sessions in (ChargeSession, ChargeSessionArchive):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(sessions.session_id, sessions.vehicle_no, sessions.station_name,
+                       sessions.end_time, sessions.unit_kwh, sessions.price_paid)
+                .where(sessions.status == 'COMPLETED', sessions.session_id > last_id)
+                .order_by(sessions.session_id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for session_id, vehicle_no, station_name, end_time, unit_kwh, price_paid in rows:
+                totals = vehicles.get(vehicle_no)
+                if totals is None:
+                    totals = vehicles[vehicle_no] = {
+                        'key': vehicle_no, 'count': 0, 'kwh': 0.0, 'paid': 0.0, 'station': None, 'at': None
+                    }
+                totals['count'] += 1
+                totals['kwh'] += unit_kwh or 0
+                totals['paid'] += price_paid or 0
+                if end_time and (totals['at'] is None or end_time >= totals['at']):
+                    totals['station'], totals['at'] = station_name, end_time
+            last_id = rows[-1][0]
+
+    table = VehicleMaster.__table__
+    conn.execute(update(table).values(
+        session_count=0, total_kwh=0, total_paid=0, last_station=None, last_session_at=None
+    ))
+    if vehicles:
+        conn.execute(
+            update(table).where(table.c.vehicle_no == bindparam('key')).values(
+                session_count=bindparam('count'), total_kwh=bindparam('kwh'), total_paid=bindparam('paid'),
+                last_station=bindparam('station'), last_session_at=bindparam('at')
+            ),
+            list(vehicles.values())
+        )
+    return len(vehicles)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python rollups.py rebuild [batch_size]")
+        sys.exit(1)
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else REBUILD_BATCH_SIZE
+        with db.engine.begin() as conn:
+            count = rebuild(conn, batch_size)
+            vehicle_count = rebuild_vehicle_totals(conn, batch_size)
+        print(f"Rebuilt {count} station/day rollup rows and lifetime totals of {vehicle_count} vehicles.")
@@ -1,15 +1,49 @@
-from flask import Blueprint, request, jsonify
-from models import db, VehicleMaster, ChargeSession, User
-from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, Response, send_file, stream_with_context
+from models import db, VehicleMaster, ChargeSession, User, BatchOperation, Tariff, ReconciliationRun, SessionFlag
+from datetime import datetime, timedelta, timezone
 import jwt
+import json
 from functools import wraps
 from werkzeug.security import check_password_hash
+from sqlalchemy.exc import SQLAlchemyError
+from auth_cache import principal_cache
+import vehicle_search
+import events
+import jobs
+import live_sessions
+from response_cache import cached_response
+import archive
+import exports
+import reconciliation
+import serialization
+import tariffs
+import timeseries
+import metrics
+import write_queue
+import os
+import tempfile
+from rollups import record_completed_session, station_totals, overview_totals, empty_totals
+from pagination import keyset_order, fetch_page, ndjson_response, parse_limit, DEFAULT_PAGE_SIZE
 
 api_bp = Blueprint('api', __name__)
 
-FIXED_TARIFF_RS_PER_KWH = 15.0
+BATCH_MAX_OPERATIONS = 1000
+BATCH_CHUNK_SIZE = 200
 SECRET_KEY = 'your_secret_key_here' # In production, use env var
 
+def period_start(period):
+    # Start of the reporting window for day/week/month/year, None for all
+    now = datetime.utcnow()
+    if period == 'day':
+        return now - timedelta(days=1)
+    elif period == 'week':
+        return now - timedelta(weeks=1)
+    elif period == 'month':
+        return now - timedelta(days=30)
+    elif period == 'year':
+        return now - timedelta(days=365)
+    return None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -20,11 +54,19 @@ def token_required(f):
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            current_user = User.query.filter_by(username=data['username']).first()
-        except:
-            return jsonify({'message': 'Token is invalid!'}), 401
+        # Cached principals skip both the JWT decode and the user lookup
+        current_user = principal_cache.get(token)
+        if current_user is None:
+            try:
+                with metrics.phase('auth_decode'):
+                    data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                with metrics.phase('auth_lookup'):
+                    user = User.query.filter_by(username=data['username']).first()
+            except:
+                return jsonify({'message': 'Token is invalid!'}), 401
+            if not user:
+                return jsonify({'message': 'Token is invalid!'}), 401
+            current_user = principal_cache.put(token, user, data.get('exp'))
             
         return f(current_user, *args, **kwargs)
     return decorated
@@ -48,10 +90,26 @@ def login():
         
     return jsonify({'message': 'Could not verify'}), 401
 
-@api_bp.route('/sessions/start', methods=['POST'])
-@token_required
-def start_session(current_user):
-    data = request.json
+# Helper to convert empty string to None for float fields
+def to_float_or_none(value):
+    if value == '' or value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def station_scope(current_user, **kwargs):
+    # Stations a request's response depends on, for cached_response
+    if 'Operator' in current_user.role:
+        return [current_user.role.split('-')[1]]
+    station_name = kwargs.get('station_name') or request.args.get('station_name')
+    return [station_name] if station_name else None
+
+def apply_start(current_user, data, vehicles=None, sessions=None, started_at=None):
+    """Start a session from request data, flushed but not committed.
+    Returns (payload, status_code). Bulk callers pass vehicles/sessions dicts
+    as lookup caches, which are updated in place."""
     vehicle_no = data.get('vehicle_no')
     station_name = data.get('station_name')
     soc_start = data.get('soc_start')
@@ -60,21 +118,27 @@ def start_session(current_user):
     if 'Operator' in current_user.role:
         assigned_station = current_user.role.split('-')[1]
         if station_name != assigned_station:
-            return jsonify({'error': f'Unauthorized: You can only operate {assigned_station} station'}), 403
+            return {'error': f'Unauthorized: You can only operate {assigned_station} station'}, 403
 
     if not all([vehicle_no, station_name, soc_start]):
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    # Helper to convert empty string to None for float fields
-    def to_float_or_none(value):
-        if value == '' or value is None:
-            return None
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return None
+        return {'error': 'Missing required fields'}, 400
+    
+    soc_start = to_float_or_none(soc_start)
+    if soc_start is None:
+        return {'error': 'Invalid soc_start'}, 400
+    
+    # A vehicle charges at one place at a time
+    open_session = live_sessions.open_session_for(vehicle_no)
+    if open_session:
+        return {
+            'error': f'Vehicle already has a session in progress at {open_session[1]}',
+            'session_id': open_session[0]
+        }, 409
 
-    vehicle = VehicleMaster.query.get(vehicle_no)
+    if vehicles is not None:
+        vehicle = vehicles.get(vehicle_no)
+    else:
+        vehicle = VehicleMaster.query.get(vehicle_no)
     if vehicle:
         vehicle.vehicle_name = data.get('vehicle_name', vehicle.vehicle_name)
         vehicle.phone_no = data.get('phone_no', vehicle.phone_no)
@@ -91,27 +155,34 @@ def start_session(current_user):
         )
         db.session.add(vehicle)
         vehicle.last_updated = datetime.utcnow()
+        if vehicles is not None:
+            vehicles[vehicle_no] = vehicle
     
     new_session = ChargeSession(
         vehicle_no=vehicle_no,
         station_name=station_name,
-        soc_start=float(soc_start),
+        soc_start=soc_start,
         status='IN PROGRESS'
     )
+    if started_at:
+        new_session.start_time = started_at
     
     db.session.add(new_session)
-    db.session.commit()
+    db.session.flush()
+    events.record('session_started', new_session)
+    live_sessions.started(new_session)
+    if sessions is not None:
+        sessions[new_session.session_id] = new_session
     
-    return jsonify({
+    return {
         'message': 'Session started',
         'session_id': new_session.session_id,
         'vehicle': vehicle.to_dict()
-    }), 201
+    }, 201
 
-@api_bp.route('/sessions/end', methods=['POST'])
-@token_required
-def end_session(current_user):
-    data = request.json
+def apply_end(current_user, data, vehicles=None, sessions=None, ended_at=None):
+    """End a session from request data, flushed but not committed.
+    Returns (payload, status_code). See apply_start for the caches."""
     session_id = data.get('session_id')
     soc_end = data.get('soc_end')
     unit_kwh = data.get('unit_kwh')
@@ -119,40 +190,319 @@ def end_session(current_user):
     payment_method = data.get('payment_method')
     
     if not all([session_id, soc_end, unit_kwh, price_paid, payment_method]):
-        return jsonify({'error': 'Missing required fields'}), 400
-        
-    session = ChargeSession.query.get(session_id)
+        return {'error': 'Missing required fields'}, 400
+    
+    if sessions is not None:
+        session = sessions.get(session_id)
+    else:
+        session = ChargeSession.query.get(session_id)
     if not session:
-        return jsonify({'error': 'Session not found'}), 404
+        # Completed sessions move to the archive after ARCHIVE_AFTER_DAYS
+        session = archive.archived_session(session_id)
+    if not session:
+        return {'error': 'Session not found'}, 404
         
     # RBAC: Check if operator is assigned to this station
     if 'Operator' in current_user.role:
         assigned_station = current_user.role.split('-')[1]
         if session.station_name != assigned_station:
-            return jsonify({'error': f'Unauthorized: You can only operate {assigned_station} station'}), 403
+            return {'error': f'Unauthorized: You can only operate {assigned_station} station'}, 403
 
     if session.status == 'COMPLETED':
-        return jsonify({'error': 'Session already completed'}), 400
+        return {'error': 'Session already completed'}, 409
+    
+    numbers = [to_float_or_none(v) for v in (soc_end, unit_kwh, price_paid)]
+    if None in numbers:
+        return {'error': 'Invalid numeric field'}, 400
+    if ended_at and session.start_time and ended_at < session.start_time:
+        return {'error': 'end_time is before start_time'}, 400
 
-    session.soc_end = float(soc_end)
-    session.unit_kwh = float(unit_kwh)
-    session.price_paid = float(price_paid)
+    session.soc_end, session.unit_kwh, session.price_paid = numbers
     session.payment_method = payment_method
-    session.end_time = datetime.utcnow()
-    session.calculated_cost_rs = session.unit_kwh * FIXED_TARIFF_RS_PER_KWH
+    session.end_time = ended_at or datetime.utcnow()
+    session.calculated_cost_rs = tariffs.price(session)
     session.status = 'COMPLETED'
     
-    vehicle = VehicleMaster.query.get(session.vehicle_no)
+    if vehicles is not None:
+        vehicle = vehicles.get(session.vehicle_no)
+    else:
+        vehicle = VehicleMaster.query.get(session.vehicle_no)
     if vehicle:
         vehicle.last_updated = datetime.utcnow()
     
-    db.session.commit()
+    # Rollup row is updated in the same transaction as the session
+    record_completed_session(session)
+    events.record('session_ended', session)
+    live_sessions.ended(session)
     
-    return jsonify({
+    return {
         'message': 'Session ended',
         'session': session.to_dict()
+    }, 200
+
+@api_bp.route('/sessions/start', methods=['POST'])
+@token_required
+def start_session(current_user):
+    payload, status = write_queue.apply(apply_start, current_user, request.json)
+    return jsonify(payload), status
+
+@api_bp.route('/sessions/end', methods=['POST'])
+@token_required
+def end_session(current_user):
+    payload, status = write_queue.apply(apply_end, current_user, request.json)
+    return jsonify(payload), status
+
+def parse_client_time(value):
+    # Offline devices send when the event actually happened (ISO 8601, UTC)
+    if not value:
+        return None
+    when = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if when.tzinfo:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    if when > datetime.utcnow() + timedelta(minutes=5):
+        raise ValueError('Timestamp is in the future')
+    return when
+
+def apply_batch_operation(current_user, op, vehicles, sessions, started_keys):
+    kind = op.get('op')
+    try:
+        if kind == 'start':
+            return apply_start(current_user, op, vehicles, sessions, parse_client_time(op.get('start_time')))
+        if kind == 'end':
+            data = dict(op)
+            # An end queued offline refers to its start by idempotency key
+            if not data.get('session_id') and data.get('start_key'):
+                data['session_id'] = started_keys.get(data['start_key'])
+            if data.get('session_id'):
+                data['session_id'] = int(data['session_id'])
+            return apply_end(current_user, data, vehicles, sessions, parse_client_time(op.get('end_time')))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return {'error': "op must be 'start' or 'end'"}, 400
+
+def apply_batch_chunk(current_user, operations, indexes, started_keys, results):
+    """Apply operations[indexes] in one transaction. Raises SQLAlchemyError
+    (after rolling back) if the commit fails."""
+    ops = [operations[i] for i in indexes]
+    chunk_keys = dict(started_keys)
+    
+    # Bulk-load every session and vehicle the chunk touches
+    session_ids = set()
+    for op in ops:
+        session_id = op.get('session_id') or chunk_keys.get(op.get('start_key'))
+        if op.get('op') == 'end' and str(session_id or '').isdigit():
+            session_ids.add(int(session_id))
+    sessions = {}
+    if session_ids:
+        sessions = {s.session_id: s for s in ChargeSession.query.filter(ChargeSession.session_id.in_(session_ids))}
+    vehicle_nos = {op.get('vehicle_no') for op in ops if op.get('op') == 'start' and op.get('vehicle_no')}
+    vehicle_nos.update(s.vehicle_no for s in sessions.values())
+    vehicles = {}
+    if vehicle_nos:
+        vehicles = {v.vehicle_no: v for v in VehicleMaster.query.filter(VehicleMaster.vehicle_no.in_(vehicle_nos))}
+    
+    outcomes = {}
+    try:
+        for i, op in zip(indexes, ops):
+            payload, status = apply_batch_operation(current_user, op, vehicles, sessions, chunk_keys)
+            outcomes[i] = (payload, status)
+            if status >= 300:
+                continue
+            session_id = payload.get('session_id') or payload['session']['session_id']
+            if op['op'] == 'start':
+                chunk_keys[op['idempotency_key']] = session_id
+            db.session.add(BatchOperation(
+                idempotency_key=op['idempotency_key'],
+                username=current_user.username,
+                op=op['op'],
+                session_id=session_id,
+                status_code=status,
+                response=json.dumps(payload)
+            ))
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    
+    started_keys.update(chunk_keys)
+    for i, (payload, status) in outcomes.items():
+        results[i] = dict(payload, idempotency_key=operations[i]['idempotency_key'], status=status)
+
+@api_bp.route('/sessions/batch', methods=['POST'])
+@token_required
+def batch_sessions(current_user):
+    """Apply queued start/end operations from an offline device in bulk.
+    
+    Body: {"operations": [{"op": "start"|"end", "idempotency_key": ..., ...}]}
+    Start and end operations take the same fields as /sessions/start and
+    /sessions/end, plus optional start_time/end_time for when they actually
+    happened. An end may name its session by start_key, the idempotency key
+    of the start. Operations already applied are replayed from the stored
+    result. Returns one result per operation, in order.
+    """
+    data = request.json or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    
+    results = [None] * len(operations)
+    keys = set()
+    pending = []
+    for i, op in enumerate(operations):
+        key = op.get('idempotency_key') if isinstance(op, dict) else None
+        if not key or not isinstance(key, str) or len(key) > 100:
+            results[i] = {'idempotency_key': key, 'status': 400, 'error': 'Missing or invalid idempotency_key'}
+        elif key in keys:
+            results[i] = {'idempotency_key': key, 'status': 400, 'error': 'Duplicate idempotency_key in batch'}
+        else:
+            keys.add(key)
+            pending.append(i)
+    
+    # Replay operations applied by an earlier sync, and resolve start_key references
+    referenced = keys | {operations[i].get('start_key') for i in pending if operations[i].get('start_key')}
+    stored = {}
+    if referenced:
+        stored = {b.idempotency_key: b for b in BatchOperation.query.filter(BatchOperation.idempotency_key.in_(referenced))}
+    started_keys = {key: b.session_id for key, b in stored.items() if b.op == 'start'}
+    
+    to_apply = []
+    for i in pending:
+        key = operations[i]['idempotency_key']
+        previous = stored.get(key)
+        if previous is None:
+            to_apply.append(i)
+        elif previous.username != current_user.username:
+            results[i] = {'idempotency_key': key, 'status': 409, 'error': 'idempotency_key already used'}
+        else:
+            results[i] = dict(json.loads(previous.response), idempotency_key=key, status=previous.status_code, replayed=True)
+    
+    for start in range(0, len(to_apply), BATCH_CHUNK_SIZE):
+        chunk = to_apply[start:start + BATCH_CHUNK_SIZE]
+        try:
+            apply_batch_chunk(current_user, operations, chunk, started_keys, results)
+        except SQLAlchemyError:
+            # Isolate the failing operation(s) by retrying one at a time
+            for i in chunk:
+                try:
+                    apply_batch_chunk(current_user, operations, [i], started_keys, results)
+                except SQLAlchemyError:
+                    results[i] = {'idempotency_key': operations[i]['idempotency_key'], 'status': 500, 'error': 'Database error'}
+    
+    return jsonify({
+        'results': results,
+        'summary': {
+            'applied': sum(1 for r in results if r.get('status', 500) < 300 and not r.get('replayed')),
+            'replayed': sum(1 for r in results if r.get('replayed')),
+            'failed': sum(1 for r in results if r.get('status', 500) >= 300)
+        }
     }), 200
 
+@api_bp.route('/reports/export', methods=['GET'])
+@token_required
+@jobs.background('exports')
+def export_sessions(current_user):
+    # Same filters as /sessions/filtered; ?format=csv (default) or parquet
+    query, sessions, error = filtered_sessions_query(current_user, request.args)
+    if error:
+        return error
+    
+    export_format = request.args.get('format', 'csv')
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    
+    if export_format == 'csv':
+        response = Response(
+            stream_with_context(exports.csv_chunks(exports.export_rows(query, sessions))),
+            mimetype='text/csv'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=sessions-{stamp}.csv'
+        return response
+    
+    if export_format == 'parquet':
+        if not exports.parquet_available():
+            return jsonify({'error': 'Parquet export requires pyarrow on the server'}), 501
+        # Parquet writes its footer last, so spool to disk instead of holding it in memory
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        exports.write_parquet(exports.export_rows(query, sessions), spool)
+        spool.seek(0)
+        return send_file(
+            spool,
+            mimetype='application/vnd.apache.parquet',
+            as_attachment=True,
+            download_name=f'sessions-{stamp}.parquet'
+        )
+    
+    return jsonify({'error': "format must be 'csv' or 'parquet'"}), 400
+
+@api_bp.route('/reports/reconciliation', methods=['GET'])
+@token_required
+def get_reconciliation(current_user):
+    # Flagged sessions, newest first: ?reason=&station_name=&limit=&cursor=
+    if current_user.role != 'Manager':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    reason = request.args.get('reason')
+    if reason and reason not in reconciliation.REASONS:
+        return jsonify({'error': f'reason must be one of {", ".join(reconciliation.REASONS)}'}), 400
+    station_name = request.args.get('station_name')
+    
+    query = SessionFlag.query
+    if reason:
+        query = query.filter(SessionFlag.reason == reason)
+    if station_name:
+        query = query.filter(SessionFlag.station_name == station_name)
+    
+    # Counts per reason cover every matching flag, not just the page
+    counts = dict(
+        query.with_entities(SessionFlag.reason, db.func.count()).group_by(SessionFlag.reason).all()
+    )
+    
+    # Keyset pages over (session_id DESC, reason); the cursor is "<session_id>:<reason>"
+    try:
+        limit = parse_limit(request.args.get('limit')) or DEFAULT_PAGE_SIZE
+        cursor = request.args.get('cursor')
+        if cursor:
+            session_id, _, after_reason = cursor.partition(':')
+            session_id = int(session_id)
+            query = query.filter(db.or_(
+                SessionFlag.session_id < session_id,
+                db.and_(SessionFlag.session_id == session_id, SessionFlag.reason > after_reason)
+            ))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    flags = query.order_by(SessionFlag.session_id.desc(), SessionFlag.reason).limit(limit + 1).all()
+    next_cursor = None
+    if len(flags) > limit:
+        flags = flags[:limit]
+        next_cursor = f'{flags[-1].session_id}:{flags[-1].reason}'
+    
+    last_run = ReconciliationRun.query.order_by(ReconciliationRun.id.desc()).first()
+    return jsonify({
+        'last_run': last_run.to_dict() if last_run else None,
+        'counts': counts,
+        'flags': [f.to_dict() for f in flags],
+        'next_cursor': next_cursor
+    })
+
+@api_bp.route('/reports/reconciliation/run', methods=['POST'])
+@token_required
+def run_reconciliation(current_user):
+    # Incremental by default; {"full": true} re-examines every session.
+    # Runs as a maintenance job: answers 202 with the job to poll.
+    if current_user.role != 'Manager':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return reconcile(current_user)
+
+@jobs.background('maintenance', inline=False)
+def reconcile(current_user):
+    full = bool((request.get_json(silent=True) or {}).get('full'))
+    with db.engine.connect() as conn:
+        result = reconciliation.run(conn, full)
+    return jsonify({key: value.isoformat() if isinstance(value, datetime) else value
+                    for key, value in result.items()})
+
 @api_bp.route('/vehicles/<vehicle_no>', methods=['GET'])
 @token_required
 def get_vehicle(current_user, vehicle_no):
@@ -163,39 +513,82 @@ def get_vehicle(current_user, vehicle_no):
 
 @api_bp.route('/vehicles/<vehicle_no>/history', methods=['GET'])
 @token_required
+@cached_response(lambda current_user, **kwargs: None)
 def get_vehicle_history(current_user, vehicle_no):
     if current_user.role != 'Manager':
         return jsonify({'error': 'Unauthorized'}), 403
         
-    sessions = ChargeSession.query.filter_by(vehicle_no=vehicle_no).order_by(ChargeSession.start_time.desc()).all()
-    return jsonify([s.to_dict() for s in sessions])
+    try:
+        fields = serialization.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sessions = archive.session_source()
+    query = db.session.query(sessions).filter(sessions.vehicle_no == vehicle_no)
+    if limit is None and request.args.get('format') != 'ndjson':
+        # Unpaginated: every session, newest first, as a bare list
+        query = serialization.select_fields(query.order_by(sessions.start_time.desc()), sessions, fields)
+        return serialization.json_response(serialization.to_dicts(query.all(), fields))
+    
+    # Paginated (?limit=&cursor=) or NDJSON: the summary is the vehicle's
+    # lifetime totals, read from its row rather than summed over sessions
+    vehicle = db.session.get(VehicleMaster, vehicle_no)
+    if not vehicle:
+        return jsonify({'error': 'Vehicle not found'}), 404
+    summary = vehicle.lifetime_dict()
+    try:
+        query = keyset_order(query, sessions.start_time, request.args.get('cursor'), sessions)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = serialization.select_fields(query, sessions, fields, extra=('start_time', 'session_id'))
+    
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(query, head={'summary': summary}, limit=limit, fields=fields)
+    
+    page, next_cursor = fetch_page(query, sessions.start_time, limit)
+    return serialization.json_response({
+        'sessions': serialization.to_dicts(page, fields),
+        'summary': summary,
+        'next_cursor': next_cursor
+    })
 
 @api_bp.route('/reports/aggregates', methods=['GET'])
 @token_required
+@jobs.background('reports')
+@cached_response(lambda current_user, **kwargs: None)
 def get_aggregates(current_user):
     if current_user.role != 'Manager':
         return jsonify({'error': 'Unauthorized'}), 403
 
-    sessions = ChargeSession.query.filter_by(status='COMPLETED').all()
+    # One grouped pass in SQL: a row per (station, payment method) pair
+    sessions = archive.session_source(status='COMPLETED')
+    method = db.func.lower(sessions.payment_method)
+    rows = db.session.query(
+        sessions.station_name,
+        method,
+        db.func.coalesce(db.func.sum(sessions.unit_kwh), 0),
+        db.func.coalesce(db.func.sum(sessions.price_paid), 0)
+    ).filter(sessions.status == 'COMPLETED').group_by(sessions.station_name, method).all()
     
     total_kwh = 0
     total_revenue = 0
     by_station = {}
     
-    for s in sessions:
-        total_kwh += s.unit_kwh
-        total_revenue += s.price_paid
+    for station, pay_method, kwh, revenue in rows:
+        total_kwh += kwh
+        total_revenue += revenue
         
-        if s.station_name not in by_station:
-            by_station[s.station_name] = {'kwh': 0, 'revenue': 0, 'cash': 0, 'qr': 0}
+        if station not in by_station:
+            by_station[station] = {'kwh': 0, 'revenue': 0, 'cash': 0, 'qr': 0}
             
-        by_station[s.station_name]['kwh'] += s.unit_kwh
-        by_station[s.station_name]['revenue'] += s.price_paid
+        by_station[station]['kwh'] += kwh
+        by_station[station]['revenue'] += revenue
         
-        if s.payment_method.lower() == 'cash':
-            by_station[s.station_name]['cash'] += s.price_paid
-        elif s.payment_method.lower() == 'qr':
-            by_station[s.station_name]['qr'] += s.price_paid
+        if pay_method == 'cash':
+            by_station[station]['cash'] += revenue
+        elif pay_method == 'qr':
+            by_station[station]['qr'] += revenue
             
     return jsonify({
         'total_kwh': total_kwh,
@@ -205,6 +598,7 @@ def get_aggregates(current_user):
 
 @api_bp.route('/sessions', methods=['GET'])
 @token_required
+@cached_response(station_scope)
 def get_sessions(current_user):
     station_name = request.args.get('station_name')
     status = request.args.get('status')
@@ -216,34 +610,102 @@ def get_sessions(current_user):
             return jsonify({'error': 'Unauthorized'}), 403
         station_name = assigned_station
     
-    query = ChargeSession.query
+    # The in-progress poll is answered from the live-session registry
+    if status == 'IN PROGRESS' and not any(request.args.get(arg) for arg in ('limit', 'cursor', 'format')):
+        try:
+            fields = serialization.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        ongoing = live_sessions.registry.in_progress(station_name)
+        return serialization.json_response(serialization.project(ongoing, fields))
+    
+    # The in-progress poll never needs the archive
+    sessions = archive.session_source(status=status)
+    query = db.session.query(sessions)
     
     if station_name:
         query = query.filter_by(station_name=station_name)
     if status:
         query = query.filter_by(status=status)
-        
-    sessions = query.order_by(ChargeSession.start_time.desc()).all()
-    return jsonify([s.to_dict() for s in sessions])
+    
+    # Optional keyset pagination (?limit=&cursor=), NDJSON streaming
+    # (?format=ndjson) and projection (?fields=session_id,status)
+    try:
+        fields = serialization.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        query = keyset_order(query, sessions.start_time, request.args.get('cursor'), sessions)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Plain column tuples, plus the keyset columns for the next cursor
+    query = serialization.select_fields(query, sessions, fields, extra=('start_time', 'session_id'))
+    
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(query, limit=limit, fields=fields)
+    
+    if limit is None:
+        return serialization.json_response(serialization.to_dicts(query.all(), fields))
+    
+    page, next_cursor = fetch_page(query, sessions.start_time, limit)
+    response = serialization.json_response(serialization.to_dicts(page, fields))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@api_bp.route('/sessions/events', methods=['GET'])
+@token_required
+def session_events(current_user):
+    # Long poll for session_started / session_ended, each carrying the session
+    station_name = request.args.get('station_name')
+    
+    # RBAC: If operator, force station_name to assigned station
+    if 'Operator' in current_user.role:
+        assigned_station = current_user.role.split('-')[1]
+        if station_name and station_name != assigned_station:
+            return jsonify({'error': 'Unauthorized'}), 403
+        station_name = assigned_station
+    
+    # Resume from the client's last poll, otherwise only new events
+    try:
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else events.latest_id()
+        seen = max(int(request.args.get('seen') or 0), cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify(events.poll(station_name, cursor, seen))
 
 @api_bp.route('/vehicles/search', methods=['GET'])
 @token_required
 def search_vehicles(current_user):
     query = request.args.get('query', '')
+    try:
+        fields = serialization.parse_fields(request.args.get('fields'), serialization.VEHICLE_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     if not query or len(query) < 2:
         return jsonify([])
     
-    # Search by both vehicle_no and vehicle_name
-    vehicles = VehicleMaster.query.filter(
-        db.or_(
-            VehicleMaster.vehicle_no.ilike(f'%{query}%'),
-            VehicleMaster.vehicle_name.ilike(f'%{query}%')
-        )
-    ).limit(10).all()
-    return jsonify([v.to_dict() for v in vehicles])
+    # Indexed search on vehicle_no and vehicle_name, best matches first
+    vehicles = vehicle_search.search(query, limit=10)
+    return serialization.json_response(serialization.project([v.to_dict() for v in vehicles], fields))
+
+def station_stats_payload(station_name, period, totals):
+    # Response body of /stats/station/<name> built from rollup totals
+    avg_duration = 0
+    if totals['duration_count']:
+        avg_duration = totals['duration_seconds'] / totals['duration_count'] / 60  # minutes
+    return {
+        'station_name': station_name,
+        'period': period,
+        'total_sessions': totals['session_count'],
+        'total_earnings': round(totals['earnings'], 2),
+        'total_energy_kwh': round(totals['energy_kwh'], 2),
+        'avg_session_duration_minutes': round(avg_duration, 2)
+    }
 
 @api_bp.route('/stats/station/<station_name>', methods=['GET'])
 @token_required
+@jobs.background('reports')
+@cached_response(station_scope)
 def get_station_stats(current_user, station_name):
     # RBAC: Operators can only access their station
     if current_user.role.startswith('Operator-'):
@@ -254,55 +716,56 @@ def get_station_stats(current_user, station_name):
     period = request.args.get('period', 'all')  # day, week, month, year, all
     
     # Calculate date filter
-    from datetime import datetime, timedelta
-    now = datetime.utcnow()
-    if period == 'day':
-        start_date = now - timedelta(days=1)
-    elif period == 'week':
-        start_date = now - timedelta(weeks=1)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    elif period == 'year':
-        start_date = now - timedelta(days=365)
-    else:
-        start_date = None
+    start_date = period_start(period)
     
-    # Build query
-    query = ChargeSession.query.filter(ChargeSession.station_name == station_name, ChargeSession.status == 'COMPLETED')
-    if start_date:
-        query = query.filter(ChargeSession.end_time >= start_date)
-    
-    sessions = query.all()
+    # Answered from the daily rollup plus at most one partial edge day
+    totals = station_totals(station_name, start_date)
+    return jsonify(station_stats_payload(station_name, period, totals))
+
+STATS_PERIODS = ['day', 'week', 'month', 'year', 'all']
+
+@api_bp.route('/stats/overview', methods=['GET'])
+@token_required
+@jobs.background('reports')
+@cached_response(station_scope)
+def get_stats_overview(current_user):
+    # Stats for every station (operators: their own) in one grouped pass.
+    # ?period=week for one period, ?periods=day,week,... or ?periods=all_periods for several.
+    periods = request.args.get('periods')
+    if periods == 'all_periods':
+        periods = STATS_PERIODS
+    elif periods:
+        periods = periods.split(',')
+    else:
+        periods = [request.args.get('period', 'all')]
+    if any(p not in STATS_PERIODS for p in periods):
+        return jsonify({'error': f'period must be one of {", ".join(STATS_PERIODS)}'}), 400
     
-    # Calculate statistics
-    total_sessions = len(sessions)
-    total_earnings = sum(s.price_paid or 0 for s in sessions)
-    total_energy = sum(s.unit_kwh or 0 for s in sessions)
+    station_names = None
+    if current_user.role.startswith('Operator-'):
+        station_names = [current_user.role.split('-')[1]]
     
-    # Calculate average session duration
-    durations = []
-    for s in sessions:
-        if s.start_time and s.end_time:
-            duration = (s.end_time - s.start_time).total_seconds() / 60  # minutes
-            durations.append(duration)
-    avg_duration = sum(durations) / len(durations) if durations else 0
+    totals = overview_totals({p: period_start(p) for p in periods}, station_names)
+    for station_name in station_names or []:
+        totals.setdefault(station_name, {p: empty_totals() for p in periods})
     
     return jsonify({
-        'station_name': station_name,
-        'period': period,
-        'total_sessions': total_sessions,
-        'total_earnings': round(total_earnings, 2),
-        'total_energy_kwh': round(total_energy, 2),
-        'avg_session_duration_minutes': round(avg_duration, 2)
+        'periods': periods,
+        'stations': {
+            station_name: {p: station_stats_payload(station_name, p, by_period[p]) for p in periods}
+            for station_name, by_period in totals.items()
+        }
     })
 
-@api_bp.route('/sessions/filtered', methods=['GET'])
+@api_bp.route('/stats/timeseries', methods=['GET'])
 @token_required
-def get_filtered_sessions(current_user):
+@jobs.background('reports')
+@cached_response(station_scope)
+def get_stats_timeseries(current_user):
+    # ?bucket=hour|day|hour_of_day|day_of_week|heatmap&start=&end= (local ISO
+    # datetimes, default the last 7 days, 30 for day-based buckets)
+    # &tz_offset=<minutes east of UTC>&station_name=
     station_name = request.args.get('station_name')
-    vehicle_no = request.args.get('vehicle_no')
-    payment_method = request.args.get('payment_method')
-    period = request.args.get('period', 'all')
     
     # RBAC: Operators restricted to their station
     if current_user.role.startswith('Operator-'):
@@ -311,43 +774,207 @@ def get_filtered_sessions(current_user):
             return jsonify({'error': 'Access denied'}), 403
         station_name = assigned_station
     
+    bucket = request.args.get('bucket', 'hour')
+    try:
+        tz_offset = int(request.args.get('tz_offset', timeseries.DEFAULT_TZ_OFFSET_MINUTES))
+        now = datetime.utcnow() + timedelta(minutes=tz_offset)
+        end = parse_local_time(request.args.get('end'), tz_offset) or now
+        start = parse_local_time(request.args.get('start'), tz_offset)
+        if start is None:
+            start = end - timedelta(days=7 if bucket == 'hour' else 30)
+        points = timeseries.series(bucket, start, end, [station_name] if station_name else None, tz_offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'bucket': bucket,
+        'station_name': station_name,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'tz_offset': tz_offset,
+        'points': points
+    })
+
+def parse_local_time(value, tz_offset):
+    # Naive ISO datetimes are local already; ones with a zone are converted
+    if not value:
+        return None
+    when = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if when.tzinfo:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None) + timedelta(minutes=tz_offset)
+    return when
+
+def filtered_sessions_query(current_user, args):
+    """Completed-session query for the /sessions/filtered filters.
+    Returns (query, sessions, None), where sessions is the ChargeSession
+    entity queried (see archive.session_source), or (None, None,
+    error_response) if RBAC denies it."""
+    station_name = args.get('station_name')
+    vehicle_no = args.get('vehicle_no')
+    payment_method = args.get('payment_method')
+    period = args.get('period', 'all')
+    
+    # RBAC: Operators restricted to their station
+    if current_user.role.startswith('Operator-'):
+        assigned_station = current_user.role.split('-')[1]
+        if station_name and station_name != assigned_station:
+            return None, None, (jsonify({'error': 'Access denied'}), 403)
+        station_name = assigned_station
+    
     # Calculate date filter
-    from datetime import datetime, timedelta
-    now = datetime.utcnow()
-    if period == 'day':
-        start_date = now - timedelta(days=1)
-    elif period == 'week':
-        start_date = now - timedelta(weeks=1)
-    elif period == 'month':
-        start_date = now - timedelta(days=30)
-    elif period == 'year':
-        start_date = now - timedelta(days=365)
-    else:
-        start_date = None
+    start_date = period_start(period)
     
-    # Build query
-    query = ChargeSession.query.filter(ChargeSession.status == 'COMPLETED')
+    # Build query; older periods also read the archive
+    sessions = archive.session_source(since=start_date, status='COMPLETED')
+    query = db.session.query(sessions).filter(sessions.status == 'COMPLETED')
     
     if station_name:
-        query = query.filter(ChargeSession.station_name == station_name)
+        query = query.filter(sessions.station_name == station_name)
     if vehicle_no:
-        query = query.filter(ChargeSession.vehicle_no.ilike(f'%{vehicle_no}%'))
+        query = query.filter(sessions.vehicle_no.ilike(f'%{vehicle_no}%'))
     if payment_method and payment_method != 'all':
-        query = query.filter(ChargeSession.payment_method == payment_method)
+        query = query.filter(sessions.payment_method == payment_method)
     if start_date:
-        query = query.filter(ChargeSession.end_time >= start_date)
+        query = query.filter(sessions.end_time >= start_date)
+    return query, sessions, None
+
+@api_bp.route('/sessions/filtered', methods=['GET'])
+@token_required
+def get_filtered_sessions(current_user):
+    query, sessions, error = filtered_sessions_query(current_user, request.args)
+    if error:
+        return error
     
-    sessions = query.order_by(ChargeSession.end_time.desc()).all()
+    # Summary covers every matching row, not just the current page
+    totals = query.with_entities(
+        db.func.count(sessions.session_id),
+        db.func.coalesce(db.func.sum(sessions.price_paid), 0),
+        db.func.coalesce(db.func.sum(sessions.unit_kwh), 0)
+    ).order_by(None).one()
+    summary = {
+        'total_sessions': totals[0],
+        'total_earnings': round(totals[1], 2),
+        'total_energy_kwh': round(totals[2], 2)
+    }
     
-    # Calculate summary stats
-    total_earnings = sum(s.price_paid or 0 for s in sessions)
-    total_energy = sum(s.unit_kwh or 0 for s in sessions)
+    try:
+        fields = serialization.parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        query = keyset_order(query, sessions.end_time, request.args.get('cursor'), sessions)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = serialization.select_fields(query, sessions, fields, extra=('end_time', 'session_id'))
     
-    return jsonify({
-        'sessions': [s.to_dict() for s in sessions],
-        'summary': {
-            'total_sessions': len(sessions),
-            'total_earnings': round(total_earnings, 2),
-            'total_energy_kwh': round(total_energy, 2)
-        }
+    # NDJSON: first line is {"summary": {...}}, then one session per line
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(query, head={'summary': summary}, limit=limit, fields=fields)
+    
+    if limit is None:
+        return serialization.json_response({
+            'sessions': serialization.to_dicts(query.all(), fields),
+            'summary': summary
+        })
+    
+    page, next_cursor = fetch_page(query, sessions.end_time, limit)
+    return serialization.json_response({
+        'sessions': serialization.to_dicts(page, fields),
+        'summary': summary,
+        'next_cursor': next_cursor
     })
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user, job_id):
+    # Report jobs started with ?async=true; visible to the role that asked
+    job = jobs.get(job_id)
+    if not job or job['role'] != current_user.role:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.job_dict(job))
+
+@api_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@token_required
+def get_job_result(current_user, job_id):
+    job = jobs.get(job_id)
+    if not job or job['role'] != current_user.role:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': f"Job failed: {job['error']}"}), 500
+    if job['status'] != 'done':
+        return jsonify(jobs.job_dict(job)), 202
+    return jobs.serve_result(job)
+
+@api_bp.route('/tariffs', methods=['GET'])
+@token_required
+def get_tariffs(current_user):
+    # Every tariff version, newest first; ?station_name= for one station
+    # (its own versions and the defaults)
+    if current_user.role != 'Manager':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    query = Tariff.query
+    station_name = request.args.get('station_name')
+    if station_name:
+        query = query.filter(db.or_(Tariff.station_name == station_name, Tariff.station_name.is_(None)))
+    versions = query.order_by(Tariff.effective_from.desc(), Tariff.id.desc()).all()
+    return jsonify([t.to_dict() for t in versions])
+
+@api_bp.route('/tariffs', methods=['POST'])
+@token_required
+def create_tariff(current_user):
+    # New tariff version: {station_name (omit for the default), effective_from
+    # (local ISO datetime, default now), schedule: {default_rate, periods}}
+    if current_user.role != 'Manager':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.json or {}
+    try:
+        schedule = tariffs.parse_schedule(data.get('schedule'))
+        effective_from = parse_local_time(data.get('effective_from'), tariffs.TZ_OFFSET_MINUTES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if effective_from:
+        effective_from -= timedelta(minutes=tariffs.TZ_OFFSET_MINUTES)
+    
+    tariff = Tariff(
+        station_name=data.get('station_name') or None,
+        effective_from=effective_from or datetime.utcnow(),
+        schedule=json.dumps(schedule),
+        created_by=current_user.username
+    )
+    db.session.add(tariff)
+    db.session.commit()
+    tariffs.invalidate()
+    return jsonify(tariff.to_dict()), 201
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus scrapes with METRICS_TOKEN as bearer token; Managers can
+    # also read it with their normal JWT
+    scrape_token = os.getenv('METRICS_TOKEN')
+    if scrape_token and request.headers.get('Authorization') == f'Bearer {scrape_token}':
+        return metrics_response()
+    return manager_metrics()
+
+@token_required
+def manager_metrics(current_user):
+    if current_user.role != 'Manager':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return metrics_response()
+
+def metrics_response():
+    auth_stats = principal_cache.stats()
+    queue_stats = write_queue.stats()
+    job_stats = jobs.stats()
+    body = metrics.registry.render(extra=[
+        ('auth_cache_hits_total', 'counter', 'Principal cache hits in token_required.', auth_stats['hits']),
+        ('auth_cache_misses_total', 'counter', 'Principal cache misses in token_required.', auth_stats['misses']),
+        ('auth_cache_size', 'gauge', 'Principals currently cached.', auth_stats['size']),
+        ('write_queue_batches_total', 'counter', 'Group commits made by the session writer.', queue_stats['batches']),
+        ('write_queue_operations_total', 'counter', 'Session writes applied by the session writer.', queue_stats['operations']),
+        ('write_queue_depth', 'gauge', 'Session writes waiting for the writer.', queue_stats['queued']),
+        ('jobs_queued', 'gauge', 'Report jobs waiting for a runner, host-wide.',
+         sum(lane.get('queued', 0) for lane in job_stats.values())),
+        ('jobs_running', 'gauge', 'Report jobs running, host-wide.',
+         sum(lane.get('running', 0) for lane in job_stats.values())),
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4')
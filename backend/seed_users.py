@@ -1,11 +1,12 @@
 from app import create_app
+from migrations import upgrade
 from models import db, User
 from werkzeug.security import generate_password_hash
 
 app = create_app()
 
 with app.app_context():
-    db.create_all()
+    upgrade()
     
     # Check if users exist
     if not User.query.first():
@@ -1,6 +1,6 @@
-from app import app
+from app import create_app
 from models import db, VehicleMaster
-import json
+from catalogue_import import import_rows
 
 vehicle_data = [
     {"Brand/Model": "BYD - T3 (Cargo)", "Battery Capacity (kWh)": "50.3"},
@@ -117,52 +117,17 @@ vehicle_data = [
     {"Brand/Model": "Zeekr - OO1", "Battery Capacity (kWh)": "100"}
 ]
 
+app = create_app()
+
 with app.app_context():
     print("Starting vehicle data seeding...")
     
-    # Clear existing vehicle master data (optional - comment out if you want to keep existing data)
-    # VehicleMaster.query.delete()
-    
-    added_count = 0
-    skipped_count = 0
-    
-    for vehicle in vehicle_data:
-        vehicle_name = vehicle["Brand/Model"]
-        battery_capacity_str = vehicle["Battery Capacity (kWh)"]
-        
-        # Skip TBA values
-        if battery_capacity_str == "TBA":
-            battery_capacity = None
-        else:
-            try:
-                battery_capacity = float(battery_capacity_str)
-            except ValueError:
-                battery_capacity = None
-        
-        # Create a dummy vehicle number for reference (you can customize this)
-        # Format: First 3 letters of brand + sequential number
-        brand_prefix = vehicle_name.split(' - ')[0][:3].upper().replace(' ', '')
-        vehicle_no = f"{brand_prefix}-REF-{added_count + 1:03d}"
-        
-        # Check if vehicle already exists
-        existing = VehicleMaster.query.filter_by(vehicle_name=vehicle_name).first()
-        
-        if not existing:
-            new_vehicle = VehicleMaster(
-                vehicle_no=vehicle_no,
-                vehicle_name=vehicle_name,
-                battery_capacity=battery_capacity,
-                phone_no=None
-            )
-            db.session.add(new_vehicle)
-            added_count += 1
-            print(f"Added: {vehicle_name} ({battery_capacity} kWh)")
-        else:
-            skipped_count += 1
-            print(f"Skipped (already exists): {vehicle_name}")
+    # Models are keyed by name, so re-running updates rather than duplicates
+    with db.engine.connect() as conn:
+        counts = import_rows(conn, vehicle_data)
     
-    db.session.commit()
     print(f"\n✅ Seeding complete!")
-    print(f"   Added: {added_count} vehicles")
-    print(f"   Skipped: {skipped_count} vehicles")
+    print(f"   Added: {counts['inserted']} vehicles")
+    print(f"   Updated: {counts['updated']} vehicles")
+    print(f"   Skipped: {counts['unchanged'] + counts['invalid'] + counts['duplicate']} vehicles")
     print(f"   Total in database: {VehicleMaster.query.count()} vehicles")
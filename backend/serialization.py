@@ -0,0 +1,85 @@
+# Fast serialization path for the list endpoints.
+#
+# Instead of loading ORM objects and calling to_dict() on each, list
+# endpoints select plain column tuples for just the requested ?fields=,
+# zip them into dicts and encode those with orjson when it is installed.
+# The response bytes are the same jsonify produces from to_dict(): sorted
+# keys, compact separators, ASCII escapes and ISO 8601 datetimes. orjson
+# writes non-ASCII text and exponent floats (1e-05) differently, so such
+# payloads, which are rare here, are re-encoded with the json module.
+import json
+import re
+from datetime import datetime
+from flask import current_app
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Keys of ChargeSession.to_dict() and VehicleMaster.to_dict(), in order
+SESSION_FIELDS = (
+    'session_id', 'vehicle_no', 'station_name', 'start_time', 'end_time',
+    'soc_start', 'soc_end', 'unit_kwh', 'calculated_cost_rs', 'price_paid',
+    'payment_method', 'status'
+)
+VEHICLE_FIELDS = ('vehicle_no', 'vehicle_name', 'phone_no', 'battery_capacity', 'last_updated')
+
+_EXPONENT = re.compile(rb'\de[-+\d]')
+
+
+def parse_fields(value, allowed=SESSION_FIELDS):
+    """Fields requested with ?fields=a,b in allowed order, every field if
+    none were given. Raises ValueError for unknown names."""
+    if not value:
+        return allowed
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise ValueError(f'Unknown field(s): {", ".join(sorted(unknown))}')
+    return tuple(name for name in allowed if name in requested)
+
+
+def select_fields(query, entity, fields, extra=()):
+    """query re-targeted to plain tuples of entity's fields, followed by the
+    extra columns (keyset sort keys) that are not among them."""
+    names = list(fields) + [name for name in extra if name not in fields]
+    return query.with_entities(*[getattr(entity, name) for name in names])
+
+
+def to_dicts(rows, fields):
+    # zip stops at the requested fields, dropping trailing extra columns
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def project(dicts, fields):
+    """Keep only fields of already built dicts."""
+    return [{name: d[name] for name in fields} for d in dicts]
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """Compact JSON bytes for obj, identical to jsonify's body without the
+    trailing newline."""
+    with metrics.phase('serialize'):
+        if orjson is not None:
+            data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+            if data.isascii() and not _EXPONENT.search(data):
+                return data
+        return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')).encode()
+
+
+def json_response(obj, status=200):
+    """Response for obj, like jsonify(obj) but through dumps()."""
+    if current_app.json.compact is False or (current_app.json.compact is None and current_app.debug):
+        # Debug mode pretty-prints like jsonify does
+        body = json.dumps(obj, default=_default, sort_keys=True, indent=2).encode()
+    else:
+        body = dumps(obj)
+    return current_app.response_class(body + b'\n', status=status, mimetype='application/json')
@@ -0,0 +1,288 @@
+# Time-of-use tariffs and session pricing.
+#
+# A tariff version is a default rate plus periods with their own rate, e.g.
+#   {"default_rate": 15, "periods": [
+#       {"days": ["Mon", "Tue", "Wed", "Thu", "Fri"], "start": "17:00", "end": "21:00", "rate": 20},
+#       {"start": "23:00", "end": "06:00", "rate": 10}]}
+# in local time (TARIFF_TZ_OFFSET_MINUTES). Later periods win where they
+# overlap, and a period whose end is not after its start runs overnight.
+#
+# Each version is compiled once into a per-minute rate table for the week
+# plus its running sum, so the price of any session is two lookups:
+#   cost = unit_kwh * (rate integrated over [start, end]) / duration
+# i.e. energy is assumed to flow evenly over the session, as in
+# timeseries.py. The version in force at a session's start_time applies;
+# a station's own versions take precedence over the default ones, and with
+# no tariff configured at all sessions are charged FIXED_TARIFF_RS_PER_KWH.
+#
+# Compiled tariffs are cached per worker for TARIFF_CACHE_SECONDS, so a new
+# version can take that long to reach other workers; give it an
+# effective_from a little in the future, or rebill afterwards.
+#
+# Usage (recompute calculated_cost_rs after adding a backdated version):
+#   python tariffs.py rebill
+#   python tariffs.py rebill --station Nagdhunga --since 2026-01-01 --dry-run
+import argparse
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, select, update
+from models import db, ChargeSession, ChargeSessionArchive, Tariff
+import response_cache
+
+FIXED_TARIFF_RS_PER_KWH = 15.0
+TZ_OFFSET_MINUTES = int(os.getenv('TARIFF_TZ_OFFSET_MINUTES', 345))
+CACHE_SECONDS = float(os.getenv('TARIFF_CACHE_SECONDS', 60))
+REBILL_BATCH_SIZE = 20000
+
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+EPOCH = datetime(1970, 1, 1)
+# 1970-01-01 was a Thursday; shifting by three days puts Monday 00:00 at
+# minute 0 of the week
+_WEEK_SHIFT = 3 * DAY_MINUTES
+
+
+def _minute_of_day(value):
+    hours, _, minutes = str(value).partition(':')
+    try:
+        minute = int(hours) * 60 + int(minutes or 0)
+    except ValueError:
+        raise ValueError(f'Invalid time {value!r}, expected HH:MM')
+    if not 0 <= minute <= DAY_MINUTES:
+        raise ValueError(f'Invalid time {value!r}, expected HH:MM')
+    return minute
+
+
+def _rate(value, name):
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if rate < 0:
+        raise ValueError(f'{name} must not be negative')
+    return rate
+
+
+def parse_schedule(data):
+    """Validate a schedule dict from the API. Returns it normalized (days
+    as names, times as HH:MM) or raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError('schedule must be an object')
+    periods = data.get('periods') or []
+    if not isinstance(periods, list):
+        raise ValueError('periods must be a list')
+    normalized = []
+    for period in periods:
+        if not isinstance(period, dict):
+            raise ValueError('Each period must be an object')
+        days = period.get('days') or list(DAY_NAMES)
+        if not isinstance(days, list) or any(d not in DAY_NAMES for d in days):
+            raise ValueError(f'days must be a list of {", ".join(DAY_NAMES)}')
+        start = _minute_of_day(period.get('start', '00:00'))
+        end = _minute_of_day(period.get('end', '24:00'))
+        normalized.append({
+            'days': [d for d in DAY_NAMES if d in days],
+            'start': f'{start // 60:02d}:{start % 60:02d}',
+            'end': f'{end // 60:02d}:{end % 60:02d}',
+            'rate': _rate(period.get('rate'), 'rate'),
+        })
+    return {'default_rate': _rate(data.get('default_rate'), 'default_rate'), 'periods': normalized}
+
+
+class Schedule:
+    # One compiled tariff version: the rate for every minute of the week
+    # (Monday 00:00 local first) and its running sum
+    __slots__ = ('flat', 'rates', 'cumulative', 'week_total')
+
+    def __init__(self, schedule):
+        rates = [schedule['default_rate']] * WEEK_MINUTES
+        for period in schedule['periods']:
+            start = _minute_of_day(period['start'])
+            length = (_minute_of_day(period['end']) - start) % DAY_MINUTES or DAY_MINUTES
+            for day in period['days']:
+                first = DAY_NAMES.index(day) * DAY_MINUTES + start
+                for minute in range(first, first + length):
+                    rates[minute % WEEK_MINUTES] = period['rate']
+        self.flat = rates[0] if rates.count(rates[0]) == WEEK_MINUTES else None
+        self.rates = rates
+        cumulative = [0.0]
+        total = 0.0
+        for rate in rates:
+            total += rate
+            cumulative.append(total)
+        self.cumulative = cumulative
+        self.week_total = total
+
+    def integral(self, minute):
+        """Rate integrated from the epoch's week start to local minute."""
+        weeks, offset = divmod(minute + _WEEK_SHIFT, WEEK_MINUTES)
+        index = int(offset)
+        return weeks * self.week_total + self.cumulative[index] + (offset - index) * self.rates[index]
+
+    def cost(self, unit_kwh, start_minute, end_minute):
+        if self.flat is not None:
+            return unit_kwh * self.flat
+        if end_minute is None or end_minute <= start_minute:
+            return unit_kwh * self.rates[int((start_minute + _WEEK_SHIFT) % WEEK_MINUTES)]
+        return unit_kwh * (self.integral(end_minute) - self.integral(start_minute)) / (end_minute - start_minute)
+
+
+FIXED_SCHEDULE = Schedule({'default_rate': FIXED_TARIFF_RS_PER_KWH, 'periods': []})
+
+
+class TariffBook:
+    # Every compiled version, by station (None for the default tariff),
+    # ordered by effective_from
+    def __init__(self, tariffs):
+        self.versions = {}
+        for station_name, effective_from, schedule in sorted(tariffs, key=lambda t: t[1]):
+            starts, schedules = self.versions.setdefault(station_name, ([], []))
+            starts.append(effective_from)
+            schedules.append(Schedule(parse_schedule(json.loads(schedule))))
+
+    def schedule_for(self, station_name, when):
+        for key in (station_name, None):
+            versions = self.versions.get(key)
+            if versions:
+                index = bisect.bisect_right(versions[0], when) - 1
+                if index >= 0:
+                    return versions[1][index]
+        return FIXED_SCHEDULE
+
+    def costs(self, station_names, start_times, end_times, unit_kwhs):
+        """calculated_cost_rs for sessions given as column sequences;
+        None where unit_kwh is None. Costs are not rounded, so a flat
+        tariff stores unit_kwh * rate exactly as before tariffs existed."""
+        offset = TZ_OFFSET_MINUTES
+        result = []
+        for station_name, start_time, end_time, unit_kwh in zip(station_names, start_times, end_times, unit_kwhs):
+            if unit_kwh is None:
+                result.append(None)
+                continue
+            start_time = start_time or end_time
+            start = (start_time - EPOCH).total_seconds() / 60 + offset
+            end = (end_time - EPOCH).total_seconds() / 60 + offset if end_time else None
+            cost = self.schedule_for(station_name, start_time).cost(unit_kwh, start, end)
+            result.append(cost)
+        return result
+
+
+def load(conn=None):
+    """Compile every tariff version, read on conn or the request session."""
+    table = Tariff.__table__
+    stmt = select(table.c.station_name, table.c.effective_from, table.c.schedule)
+    rows = (conn or db.session).execute(stmt).all()
+    return TariffBook(rows)
+
+
+_book = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def book():
+    """The cached TariffBook, reloaded every CACHE_SECONDS."""
+    global _book, _loaded_at
+    if _book is None or time.monotonic() - _loaded_at > CACHE_SECONDS:
+        with _lock:
+            if _book is None or time.monotonic() - _loaded_at > CACHE_SECONDS:
+                _book = load()
+                _loaded_at = time.monotonic()
+    return _book
+
+
+def invalidate():
+    global _book
+    with _lock:
+        _book = None
+
+
+def price(session):
+    """calculated_cost_rs for a completed session (None without unit_kwh)."""
+    return book().costs([session.station_name], [session.start_time], [session.end_time], [session.unit_kwh])[0]
+
+
+def _differs(cost, old):
+    # Costs stored by other code or an earlier rounding build may differ in
+    # float noise only; rewriting them changes nothing anyone can see
+    if cost is None or old is None:
+        return cost is not old
+    return abs(cost - old) >= 0.005
+
+
+def rebill(conn, station_name=None, since=None, until=None, batch_size=REBILL_BATCH_SIZE, dry_run=False):
+    """Recompute calculated_cost_rs for completed sessions (archived ones
+    included) on conn, optionally for one station and end_time in
+    [since, until). Sessions are read as column batches in session_id
+    order, priced together, and only changed costs are written back with
+    one executemany UPDATE per batch. Returns counts."""
+    tariff_book = load(conn)
+    counts = {'read': 0, 'changed': 0}
+    for sessions in (ChargeSession, ChargeSessionArchive):
+        table = sessions.__table__
+        stmt = select(
+            table.c.session_id, table.c.station_name, table.c.start_time,
+            table.c.end_time, table.c.unit_kwh, table.c.calculated_cost_rs
+        ).where(table.c.status == 'COMPLETED').order_by(table.c.session_id).limit(batch_size)
+        if station_name:
+            stmt = stmt.where(table.c.station_name == station_name)
+        if since:
+            stmt = stmt.where(table.c.end_time >= since)
+        if until:
+            stmt = stmt.where(table.c.end_time < until)
+        write = (
+            update(table).where(table.c.session_id == bindparam('key'))
+            .values(calculated_cost_rs=bindparam('cost'))
+        )
+
+        last_id = 0
+        while True:
+            rows = conn.execute(stmt.where(table.c.session_id > last_id)).all()
+            if not rows:
+                break
+            ids, stations, starts, ends, kwhs, old_costs = zip(*rows)
+            costs = tariff_book.costs(stations, starts, ends, kwhs)
+            changed = [
+                {'key': session_id, 'cost': cost, 'station': station}
+                for session_id, station, cost, old in zip(ids, stations, costs, old_costs)
+                if _differs(cost, old)
+            ]
+            if changed and not dry_run:
+                conn.execute(write, changed)
+                conn.commit()
+                response_cache.bump({row['station'] for row in changed})
+            counts['read'] += len(rows)
+            counts['changed'] += len(changed)
+            last_id = ids[-1]
+    return counts
+
+
+def _date(value):
+    return datetime.fromisoformat(value) - timedelta(minutes=TZ_OFFSET_MINUTES)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tariff maintenance.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebill_parser = commands.add_parser('rebill', help='recompute calculated_cost_rs from the tariffs')
+    rebill_parser.add_argument('--station', help='only this station')
+    rebill_parser.add_argument('--since', type=_date, help='sessions ending on or after this local date/time')
+    rebill_parser.add_argument('--until', type=_date, help='sessions ending before this local date/time')
+    rebill_parser.add_argument('--batch-size', type=int, default=REBILL_BATCH_SIZE)
+    rebill_parser.add_argument('--dry-run', action='store_true', help='count what would change without writing')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        with db.engine.connect() as conn:
+            counts = rebill(conn, args.station, args.since, args.until, args.batch_size, args.dry_run)
+        elapsed = time.perf_counter() - started
+    prefix = 'Dry run: ' if args.dry_run else ''
+    print(f"{prefix}read {counts['read']} sessions, {counts['changed']} costs changed in {elapsed:.1f}s")
@@ -0,0 +1,211 @@
+# Time-bucketed utilisation series for /stats/timeseries.
+#
+# Everything is aggregated in one SQL statement. A recursive CTE expands
+# each session into one piece per hourly (or daily) bucket it touches, from
+# the bucket it starts in to the one it ends in, so the work grows with the
+# pieces produced rather than sessions x buckets. Per bucket:
+#   sessions         - sessions that started in the bucket
+#   occupied_minutes - overlap of [start_time, end_time) with the bucket, so
+#                      a session spanning midnight counts in both days
+#   energy_kwh and   - spread over the session's buckets in proportion to
+#   revenue            the time spent in each (constant charging power)
+# Sessions still in progress count as occupied until now. Ranges reaching
+# back past the archive horizon read charge_sessions_archive as well.
+#
+# Bucket arithmetic is done on epoch seconds shifted by the caller's UTC
+# offset, so hour-of-day and day-of-week are in local time (Nepal is +5:45,
+# which no whole-hour shift can express).
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, text
+from models import db
+import archive
+
+# Minutes east of UTC used when a request gives no tz_offset (Nepal)
+DEFAULT_TZ_OFFSET_MINUTES = int(os.getenv('STATS_TZ_OFFSET_MINUTES', 345))
+BUCKETS = ('hour', 'day', 'hour_of_day', 'day_of_week', 'heatmap')
+MAX_BUCKETS = 10000
+# Completed sessions starting this long before the range are still joined,
+# so charges running across the range start are split correctly
+MAX_SESSION_HOURS = 48
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+EPOCH = datetime(1970, 1, 1)
+
+# (seconds per base bucket, SQL grouping keys over bucket number n)
+# :h0 is the local hour number (hours since the epoch) of the range start;
+# 1970-01-01 was a Thursday, so +3 makes Monday 0
+GROUPINGS = {
+    'hour': (3600, ['n']),
+    'day': (86400, ['n']),
+    'hour_of_day': (3600, ['(n + :h0) % 24']),
+    'day_of_week': (3600, ['((n + :h0) / 24 + 3) % 7']),
+    'heatmap': (3600, ['((n + :h0) / 24 + 3) % 7', '(n + :h0) % 24']),
+}
+
+_DIALECT_SQL = {
+    'sqlite': {
+        'epoch': "((julianday({}) - 2440587.5) * 86400.0)",
+        'least': 'MIN', 'greatest': 'MAX',
+        'floor': 'CAST({} AS INTEGER)',
+    },
+    'postgresql': {
+        'epoch': 'EXTRACT(EPOCH FROM {})',
+        'least': 'LEAST', 'greatest': 'GREATEST',
+        'floor': 'CAST(FLOOR({}) AS INTEGER)',
+    },
+}
+
+# Sessions overlapping the range, from one table
+SPANS_SQL = """
+    SELECT {epoch_start} + :offset AS s,
+           COALESCE({epoch_end}, :now) + :offset AS e,
+           COALESCE(unit_kwh, 0) AS kwh,
+           COALESCE(price_paid, 0) AS paid
+    FROM {table}
+    WHERE status IN ('COMPLETED', 'IN PROGRESS')
+      AND start_time < :range_end_utc
+      AND (end_time IS NULL OR end_time > :range_start_utc)
+      AND (start_time >= :lookback_utc OR status = 'IN PROGRESS')
+      {station_filter}"""
+
+SERIES_SQL = """
+WITH RECURSIVE spans AS ({spans}
+),
+clipped AS (
+    SELECT s, e, kwh, paid,
+           {greatest}(s, :r0) AS cs,
+           {least}(e, :r1) AS ce
+    FROM spans
+),
+ranged AS (
+    SELECT s, e, kwh, paid, cs, ce,
+           {first_bucket} AS first_n,
+           {greatest}({first_bucket}, {last_bucket}) AS last_n
+    FROM clipped
+    WHERE ce > cs OR (ce = cs AND s >= :r0 AND s < :r1)
+),
+pieces(n, s, e, kwh, paid, cs, ce, first_n, last_n) AS (
+    SELECT first_n, s, e, kwh, paid, cs, ce, first_n, last_n FROM ranged
+    UNION ALL
+    SELECT n + 1, s, e, kwh, paid, cs, ce, first_n, last_n FROM pieces WHERE n < last_n
+),
+overlaps AS (
+    SELECT n, s, e, kwh, paid, first_n,
+           {least}(ce, :r0 + (n + 1) * :bucket_seconds) - {greatest}(cs, :r0 + n * :bucket_seconds) AS overlap
+    FROM pieces
+)
+SELECT {select_keys},
+       SUM(CASE WHEN n = first_n AND s >= :r0 THEN 1 ELSE 0 END) AS sessions,
+       SUM({greatest}(overlap, 0)) / 60.0 AS occupied_minutes,
+       SUM(CASE WHEN e > s THEN kwh * {greatest}(overlap, 0) / (e - s) ELSE kwh END) AS energy_kwh,
+       SUM(CASE WHEN e > s THEN paid * {greatest}(overlap, 0) / (e - s) ELSE paid END) AS revenue
+FROM overlaps
+GROUP BY {group_keys}
+"""
+
+
+def _epoch(dt):
+    return (dt - EPOCH).total_seconds()
+
+
+def align(dt, bucket_seconds):
+    """Round a naive local datetime down to its bucket boundary."""
+    return EPOCH + timedelta(seconds=_epoch(dt) // bucket_seconds * bucket_seconds)
+
+
+def series(bucket, start, end, station_names=None, tz_offset_minutes=0):
+    """Utilisation series for sessions at station_names (all if None)
+    between local datetimes start and end.
+
+    Raises ValueError for an unknown bucket or an oversized range. Returns a
+    list of bucket dicts, zero-filled, in bucket order."""
+    if bucket not in GROUPINGS:
+        raise ValueError(f'bucket must be one of {", ".join(BUCKETS)}')
+    bucket_seconds, keys = GROUPINGS[bucket]
+    start = align(start, bucket_seconds)
+    bucket_count = -int(-_epoch(end) // bucket_seconds) - int(_epoch(start) // bucket_seconds)
+    if bucket_count <= 0:
+        raise ValueError('end must be after start')
+    if bucket_count > MAX_BUCKETS:
+        raise ValueError(f'Range too large: at most {MAX_BUCKETS} buckets')
+
+    dialect = db.session.get_bind().dialect.name
+    sql = _DIALECT_SQL.get(dialect)
+    if sql is None:
+        raise ValueError(f'Time series are not supported on {dialect}')
+
+    offset = tz_offset_minutes * 60
+    r0 = _epoch(start)
+    r1 = r0 + bucket_count * bucket_seconds
+    floor = sql['floor']
+    params = {
+        'bucket_seconds': bucket_seconds,
+        'offset': offset,
+        'now': _epoch(datetime.utcnow()),
+        'r0': r0,
+        'r1': r1,
+        'h0': int(r0 // 3600),
+        'range_start_utc': start - timedelta(seconds=offset),
+        'range_end_utc': start + timedelta(seconds=bucket_count * bucket_seconds - offset),
+        'lookback_utc': start - timedelta(seconds=offset, hours=MAX_SESSION_HOURS),
+    }
+    station_filter = ''
+    if station_names is not None:
+        station_filter = 'AND station_name IN (' + ', '.join(f':station_{i}' for i in range(len(station_names))) + ')'
+        params.update({f'station_{i}': name for i, name in enumerate(station_names)})
+
+    tables = ['charge_sessions']
+    if archive.needs_archive(since=params['range_start_utc']):
+        tables.append('charge_sessions_archive')
+    spans = '\n    UNION ALL'.join(
+        SPANS_SQL.format(
+            table=table,
+            epoch_start=sql['epoch'].format('start_time'),
+            epoch_end=sql['epoch'].format('end_time'),
+            station_filter=station_filter,
+        )
+        for table in tables
+    )
+
+    statement = SERIES_SQL.format(
+        spans=spans,
+        least=sql['least'],
+        greatest=sql['greatest'],
+        first_bucket=floor.format('(cs - :r0) / :bucket_seconds'),
+        last_bucket=floor.format('(ce - :r0) / :bucket_seconds - 0.000001'),
+        select_keys=', '.join(f'{key} AS k{i}' for i, key in enumerate(keys)),
+        group_keys=', '.join(str(i + 1) for i in range(len(keys))),
+    )
+    statement = text(statement).bindparams(
+        bindparam('range_start_utc', type_=db.DateTime),
+        bindparam('range_end_utc', type_=db.DateTime),
+        bindparam('lookback_utc', type_=db.DateTime),
+    )
+    rows = {tuple(row[:len(keys)]): row[len(keys):] for row in db.session.execute(statement, params)}
+    return _fill(bucket, start, bucket_count, bucket_seconds, rows)
+
+
+def _point(values):
+    sessions, minutes, kwh, revenue = values or (0, 0, 0, 0)
+    return {
+        'sessions': int(sessions or 0),
+        'occupied_minutes': round(minutes or 0, 2),
+        'energy_kwh': round(kwh or 0, 3),
+        'revenue': round(revenue or 0, 2),
+    }
+
+
+def _fill(bucket, start, bucket_count, bucket_seconds, rows):
+    if bucket in ('hour', 'day'):
+        return [
+            dict(bucket_start=(start + timedelta(seconds=n * bucket_seconds)).isoformat(), **_point(rows.get((n,))))
+            for n in range(bucket_count)
+        ]
+    if bucket == 'hour_of_day':
+        return [dict(hour=h, **_point(rows.get((h,)))) for h in range(24)]
+    if bucket == 'day_of_week':
+        return [dict(day_of_week=d, day=DAY_NAMES[d], **_point(rows.get((d,)))) for d in range(7)]
+    return [
+        dict(day_of_week=d, day=DAY_NAMES[d], hour=h, **_point(rows.get((d, h))))
+        for d in range(7) for h in range(24)
+    ]
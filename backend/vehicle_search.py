@@ -0,0 +1,178 @@
+# Ranked typeahead search over vehicle_master.
+#
+# Results are ranked exact plate, plate prefix, name prefix, then substring
+# matches, and every step is an index lookup:
+#   SQLite   - prefixes are range scans on NOCASE indexes, substrings go
+#              through an FTS5 trigram table kept in sync by triggers.
+#   Postgres - prefixes use lower(...) text_pattern_ops indexes, substrings
+#              use pg_trgm GIN indexes.
+# Other databases fall back to plain ILIKE scans.
+#
+# The indexes are installed by migrations.py. SQLite can renumber rowids on
+# VACUUM, so run `python vehicle_search.py rebuild` after vacuuming.
+import logging
+import sys
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from models import db, VehicleMaster
+
+MIN_TRIGRAM_QUERY = 3
+
+log = logging.getLogger('vehicle_search')
+
+SQLITE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_no_nocase ON vehicle_master (vehicle_no COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_name_nocase ON vehicle_master (vehicle_name COLLATE NOCASE)',
+]
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS vehicle_search USING fts5("
+    "vehicle_no, vehicle_name, content='vehicle_master', content_rowid='rowid', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS vehicle_search_ai AFTER INSERT ON vehicle_master BEGIN "
+    "INSERT INTO vehicle_search(rowid, vehicle_no, vehicle_name) "
+    "VALUES (new.rowid, new.vehicle_no, new.vehicle_name); END",
+    "CREATE TRIGGER IF NOT EXISTS vehicle_search_ad AFTER DELETE ON vehicle_master BEGIN "
+    "INSERT INTO vehicle_search(vehicle_search, rowid, vehicle_no, vehicle_name) "
+    "VALUES ('delete', old.rowid, old.vehicle_no, old.vehicle_name); END",
+    "CREATE TRIGGER IF NOT EXISTS vehicle_search_au AFTER UPDATE OF vehicle_no, vehicle_name "
+    "ON vehicle_master BEGIN "
+    "INSERT INTO vehicle_search(vehicle_search, rowid, vehicle_no, vehicle_name) "
+    "VALUES ('delete', old.rowid, old.vehicle_no, old.vehicle_name); "
+    "INSERT INTO vehicle_search(rowid, vehicle_no, vehicle_name) "
+    "VALUES (new.rowid, new.vehicle_no, new.vehicle_name); END",
+]
+
+POSTGRES_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_no_lower ON vehicle_master (lower(vehicle_no) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_name_lower ON vehicle_master (lower(vehicle_name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_no_trgm ON vehicle_master USING gin (vehicle_no gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_vehicle_name_trgm ON vehicle_master USING gin (vehicle_name gin_trgm_ops)',
+]
+
+# Engine URL -> whether the FTS5 table exists, checked once per process
+_fts_available = {}
+
+
+def install(conn):
+    """Create the search indexes for conn's dialect. On SQLite builds without
+    the FTS5 trigram tokenizer only the prefix indexes are created."""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_INDEXES:
+            conn.execute(text(statement))
+        try:
+            with conn.begin_nested():
+                for statement in SQLITE_FTS:
+                    conn.execute(text(statement))
+        except OperationalError:
+            log.warning("FTS5 trigram tokenizer unavailable, substring search will scan vehicle_master")
+            return
+        rebuild(conn)
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_INDEXES:
+            conn.execute(text(statement))
+
+
+def drop(conn):
+    """Remove the search indexes and sync triggers, e.g. before a bulk load.
+    install() puts them back and re-indexes every vehicle."""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        for name in ('vehicle_search_ai', 'vehicle_search_ad', 'vehicle_search_au'):
+            conn.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+        for name in ('ix_vehicle_no_nocase', 'ix_vehicle_name_nocase'):
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    elif dialect == 'postgresql':
+        for name in ('ix_vehicle_no_lower', 'ix_vehicle_name_lower', 'ix_vehicle_no_trgm', 'ix_vehicle_name_trgm'):
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def rebuild(conn):
+    """Re-index every vehicle (SQLite FTS5 only)."""
+    if conn.dialect.name == 'sqlite' and inspect(conn).has_table('vehicle_search'):
+        conn.execute(text("INSERT INTO vehicle_search(vehicle_search) VALUES ('rebuild')"))
+
+
+def _has_fts():
+    engine = db.engine
+    key = str(engine.url)
+    if key not in _fts_available:
+        _fts_available[key] = (
+            engine.dialect.name == 'sqlite' and inspect(engine).has_table('vehicle_search')
+        )
+    return _fts_available[key]
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _prefix_query(column, query):
+    pattern = _escape_like(query) + '%'
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        # SQLite LIKE is case-insensitive already and, unlike ilike's
+        # lower(x) LIKE lower(y), can range-scan a NOCASE index
+        return VehicleMaster.query.filter(column.like(pattern, escape='\\')).order_by(column.collate('NOCASE'))
+    if dialect == 'postgresql':
+        lowered = db.func.lower(column)
+        return VehicleMaster.query.filter(
+            lowered.like(pattern.lower(), escape='\\')
+        ).order_by(lowered.collate('C'))
+    return VehicleMaster.query.filter(column.ilike(pattern, escape='\\')).order_by(column)
+
+
+def _substring_queries(query, limit):
+    """Plate substring matches, then name substring matches."""
+    if _has_fts() and len(query) >= MIN_TRIGRAM_QUERY:
+        # No ORDER BY rank: scoring every trigram hit would defeat the LIMIT
+        phrase = '"' + query.replace('"', '""') + '"'
+        statement = text(
+            'SELECT vehicle_master.* FROM vehicle_search '
+            'JOIN vehicle_master ON vehicle_master.rowid = vehicle_search.rowid '
+            'WHERE vehicle_search MATCH :match LIMIT :limit'
+        )
+        return [
+            VehicleMaster.query.from_statement(statement).params(match=f'{{{column}}} : {phrase}', limit=limit)
+            for column in ('vehicle_no', 'vehicle_name')
+        ]
+    pattern = '%' + _escape_like(query) + '%'
+    return [
+        VehicleMaster.query.filter(column.ilike(pattern, escape='\\')).limit(limit)
+        for column in (VehicleMaster.vehicle_no, VehicleMaster.vehicle_name)
+    ]
+
+
+def search(query, limit=10):
+    """Return up to limit VehicleMaster rows matching query, best first."""
+    results = {}
+
+    def take(rows):
+        for vehicle in rows:
+            if len(results) >= limit:
+                return
+            results.setdefault(vehicle.vehicle_no, vehicle)
+
+    # Exact plate sorts first within the plate-prefix range
+    take(_prefix_query(VehicleMaster.vehicle_no, query).limit(limit))
+    if len(results) < limit:
+        take(_prefix_query(VehicleMaster.vehicle_name, query).limit(limit))
+    for substring_query in _substring_queries(query, 2 * limit):
+        if len(results) >= limit:
+            break
+        # Earlier buckets may overlap, so over-fetch enough to fill up
+        take(substring_query)
+    return list(results.values())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("Usage: python vehicle_search.py rebuild")
+        sys.exit(1)
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rebuild(conn)
+        print("Vehicle search index rebuilt.")
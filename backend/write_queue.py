@@ -0,0 +1,123 @@
+# Optional single-writer path with group commit for session writes.
+#
+# With WRITE_QUEUE=True, start_session/end_session hand their mutation to
+# one writer thread per worker process instead of committing on the request
+# thread. The writer collects whatever arrives within WRITE_QUEUE_WINDOW_MS
+# (up to WRITE_QUEUE_MAX_BATCH operations), applies them in one transaction
+# and commits once, then hands every caller its own (payload, status). On
+# SQLite this turns many small fsyncs and write-lock handoffs into one; a
+# worker's request threads never contend with each other for the lock.
+#
+# Operations that fail validation change nothing, so they are answered
+# without affecting the rest of the batch. If an operation raises or the
+# group commit fails, the batch is rolled back and each operation is
+# retried in its own transaction so only the failing one gets an error.
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from models import db
+
+ENABLED = os.getenv('WRITE_QUEUE', 'False') == 'True'
+WINDOW_SECONDS = float(os.getenv('WRITE_QUEUE_WINDOW_MS', 2)) / 1000
+MAX_BATCH = int(os.getenv('WRITE_QUEUE_MAX_BATCH', 64))
+RESULT_TIMEOUT_SECONDS = 30
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class Writer(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='session-writer', daemon=True)
+        self.app = app
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.operations = 0
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + WINDOW_SECONDS
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                self.apply(batch)
+            self.batches += 1
+            self.operations += len(batch)
+
+    def apply(self, batch):
+        results = []
+        try:
+            for fn, args, _ in batch:
+                results.append(fn(*args))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.apply_one_by_one(batch)
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def apply_one_by_one(self, batch):
+        for fn, args, future in batch:
+            try:
+                result = fn(*args)
+                if result[1] < 300:
+                    db.session.commit()
+                else:
+                    db.session.rollback()
+                future.set_result(result)
+            except Exception:
+                db.session.rollback()
+                future.set_result(({'error': 'Database error'}, 500))
+
+
+def _writer():
+    app = current_app._get_current_object()
+    writer = _writers.get(app)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(app)
+            if writer is None:
+                # Started on first use, so gunicorn workers each get their
+                # own thread after the fork
+                writer = _writers[app] = Writer(app)
+                writer.start()
+    return writer
+
+
+def apply(fn, *args):
+    """Run fn(*args) -> (payload, status) and commit it if status < 300.
+
+    Through the writer thread when the queue is enabled, otherwise on the
+    calling thread's session."""
+    if not ENABLED:
+        payload, status = fn(*args)
+        if status < 300:
+            db.session.commit()
+        return payload, status
+
+    future = Future()
+    _writer().queue.put((fn, args, future))
+    try:
+        return future.result(timeout=RESULT_TIMEOUT_SECONDS)
+    except TimeoutError:
+        return {'error': 'Write queue timed out'}, 503
+
+
+def stats():
+    return {
+        'enabled': ENABLED,
+        'batches': sum(w.batches for w in _writers.values()),
+        'operations': sum(w.operations for w in _writers.values()),
+        'queued': sum(w.queue.qsize() for w in _writers.values()),
+    }
@@ -14,8 +14,10 @@ if project_home not in sys.path:
 from dotenv import load_dotenv
 load_dotenv(os.path.join(project_home, '.env'))
 
-# Import your Flask app
-from app import app as application
+# Build your Flask app
+# Run `python migrations.py` after each deploy, the app does not create
+# or migrate tables itself
+from app import create_app
 
 # PythonAnywhere expects the WSGI application to be called 'application'
-# Our app.py exports 'app', so we alias it here
+application = create_app()
@@ -1,9 +1,11 @@
 'use client';
 import { useState, useEffect } from 'react';
 import { useRouter } from 'next/navigation';
-import { getStationStats, getFilteredSessions, getVehicleHistory } from '@/lib/api';
+import { getStatsOverview, getFilteredSessions, getVehicleHistory } from '@/lib/api';
 import { getUser, logout } from '@/lib/auth';
 
+const HISTORY_PAGE_SIZE = 50;
+
 export default function Dashboard() {
     const router = useRouter();
     const [user, setUserState] = useState<any>(null);
@@ -26,6 +28,8 @@ export default function Dashboard() {
     // Vehicle Search
     const [searchVehicle, setSearchVehicle] = useState('');
     const [vehicleHistory, setVehicleHistory] = useState<any[]>([]);
+    const [vehicleSummary, setVehicleSummary] = useState<any>(null);
+    const [historyCursor, setHistoryCursor] = useState<string | null>(null);
 
     useEffect(() => {
         const currentUser = getUser();
@@ -44,11 +48,11 @@ export default function Dashboard() {
     const loadData = async (timePeriod: string) => {
         try {
             setLoading(true);
-            // Load stats for both stations
-            const nagStats = await getStationStats('Nagdhunga', timePeriod);
-            const jamStats = await getStationStats('Jamune', timePeriod);
-            setNagdhungaStats(nagStats);
-            setJamuneStats(jamStats);
+            // Load stats for all stations in one call
+            const overview = await getStatsOverview(timePeriod);
+            const stations = overview.stations || {};
+            setNagdhungaStats(stations['Nagdhunga']?.[timePeriod] || {});
+            setJamuneStats(stations['Jamune']?.[timePeriod] || {});
 
             // Load filtered sessions
             await loadFilteredSessions(timePeriod);
@@ -87,13 +91,26 @@ export default function Dashboard() {
         e.preventDefault();
         if (!searchVehicle) return;
         try {
-            const data = await getVehicleHistory(searchVehicle);
-            setVehicleHistory(data);
+            const data = await getVehicleHistory(searchVehicle, { limit: HISTORY_PAGE_SIZE });
+            setVehicleHistory(data.sessions || []);
+            setVehicleSummary(data.summary || null);
+            setHistoryCursor(data.next_cursor || null);
         } catch (error) {
             console.error("Error searching vehicle", error);
         }
     };
 
+    const loadMoreHistory = async () => {
+        if (!historyCursor) return;
+        try {
+            const data = await getVehicleHistory(searchVehicle, { limit: HISTORY_PAGE_SIZE, cursor: historyCursor });
+            setVehicleHistory([...vehicleHistory, ...(data.sessions || [])]);
+            setHistoryCursor(data.next_cursor || null);
+        } catch (error) {
+            console.error("Error loading vehicle history", error);
+        }
+    };
+
     if (loading) return (
         <div className="min-h-screen flex items-center justify-center">
             <div className="text-xl text-gray-600">Loading...</div>
@@ -345,6 +362,31 @@ export default function Dashboard() {
                         </button>
                     </form>
 
+                    {vehicleSummary && (
+                        <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-6">
+                            <div>
+                                <p className="text-sm text-gray-600">Lifetime Sessions</p>
+                                <p className="text-xl font-bold text-gray-900">{vehicleSummary.session_count}</p>
+                            </div>
+                            <div>
+                                <p className="text-sm text-gray-600">Lifetime Energy</p>
+                                <p className="text-xl font-bold text-gray-900">{vehicleSummary.total_kwh} kWh</p>
+                            </div>
+                            <div>
+                                <p className="text-sm text-gray-600">Lifetime Paid</p>
+                                <p className="text-xl font-bold text-green-600">Rs. {vehicleSummary.total_paid}</p>
+                            </div>
+                            <div>
+                                <p className="text-sm text-gray-600">Last Charged</p>
+                                <p className="text-xl font-bold text-gray-900">
+                                    {vehicleSummary.last_station
+                                        ? `${vehicleSummary.last_station}, ${new Date(vehicleSummary.last_session_at).toLocaleDateString()}`
+                                        : '-'}
+                                </p>
+                            </div>
+                        </div>
+                    )}
+
                     {vehicleHistory.length > 0 && (
                         <div className="overflow-x-auto">
                             <table className="min-w-full divide-y divide-gray-200">
@@ -376,6 +418,13 @@ export default function Dashboard() {
                                     ))}
                                 </tbody>
                             </table>
+                            {historyCursor && (
+                                <div className="text-center mt-4">
+                                    <button onClick={loadMoreHistory} className="px-4 py-2 text-sm text-indigo-600 hover:bg-indigo-50 rounded-lg transition">
+                                        Load more
+                                    </button>
+                                </div>
+                            )}
                         </div>
                     )}
                 </div>
@@ -1,7 +1,7 @@
 'use client';
 import { useState, useEffect } from 'react';
 import { useRouter } from 'next/navigation';
-import { startSession, endSession, getSessions, searchVehicles, getStationStats, getFilteredSessions } from '@/lib/api';
+import { startSession, endSession, getSessions, searchVehicles, getStationStats, getFilteredSessions, subscribeSessionEvents } from '@/lib/api';
 import { getUser, logout } from '@/lib/auth';
 
 export default function Home() {
@@ -73,9 +73,15 @@ export default function Home() {
     setStartForm(prev => ({ ...prev, station_name: assignedStation }));
     loadData(assignedStation, 'all');
 
-    // Auto-refresh ongoing sessions every 10 seconds
-    const interval = setInterval(() => loadOngoingSessions(assignedStation), 10000);
-    return () => clearInterval(interval);
+    // Live updates for ongoing sessions; reload the list whenever polling (re)connects
+    const unsubscribe = subscribeSessionEvents(assignedStation, (type, session) => {
+      if (type === 'session_started') {
+        setOngoingSessions(prev => [session, ...prev.filter(s => s.session_id !== session.session_id)]);
+      } else if (type === 'session_ended') {
+        setOngoingSessions(prev => prev.filter(s => s.session_id !== session.session_id));
+      }
+    }, () => loadOngoingSessions(assignedStation));
+    return () => unsubscribe();
   }, [router]);
 
   const loadData = async (stationName: string, timePeriod: string) => {
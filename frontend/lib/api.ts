@@ -37,20 +37,40 @@ export async function endSession(data: any) {
     return response.json();
 }
 
-export async function getVehicleHistory(vehicleNo: string) {
-    const response = await fetch(`${API_BASE_URL}/vehicles/${vehicleNo}/history`, {
+// With params.limit the response is { sessions, summary, next_cursor }, where
+// summary holds the vehicle's lifetime totals; pass next_cursor as params.cursor
+// for the following page. Without it, a plain array of every session.
+export async function getVehicleHistory(vehicleNo: string, params: any = {}) {
+    const query = new URLSearchParams(params).toString();
+    const response = await fetch(`${API_BASE_URL}/vehicles/${vehicleNo}/history?${query}`, {
         headers: getHeaders()
     });
     return response.json();
 }
 
-export async function getAggregates() {
-    const response = await fetch(`${API_BASE_URL}/reports/aggregates`, {
-        headers: getHeaders()
-    });
+// Run a heavy report as a background job: the server answers with a job id
+// at once (or the stored result of an identical recent request), and the
+// result is fetched once the job is done. Returns the result's JSON.
+export async function runReport(path: string, params: any = {}) {
+    const query = new URLSearchParams({ ...params, async: 'true' }).toString();
+    let response = await fetch(`${API_BASE_URL}${path}?${query}`, { headers: getHeaders() });
+    let job = await response.json();
+    let delay = 250;
+    while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        delay = Math.min(delay * 2, 1000);
+        response = await fetch(`${API_BASE_URL}/jobs/${job.id}`, { headers: getHeaders() });
+        job = await response.json();
+    }
+    if (job.status !== 'done') throw new Error(job.error || 'Report failed');
+    response = await fetch(`${API_BASE_URL}/jobs/${job.id}/result`, { headers: getHeaders() });
     return response.json();
 }
 
+export async function getAggregates() {
+    return runReport('/reports/aggregates');
+}
+
 export async function getVehicle(vehicleNo: string) {
     const response = await fetch(`${API_BASE_URL}/vehicles/${vehicleNo}`, {
         headers: getHeaders()
@@ -75,10 +95,15 @@ export async function searchVehicles(query: string) {
 }
 
 export async function getStationStats(stationName: string, period: string = 'all') {
-    const response = await fetch(`${API_BASE_URL}/stats/station/${stationName}?period=${period}`, {
-        headers: getHeaders()
-    });
-    return response.json();
+    return runReport(`/stats/station/${stationName}`, { period });
+}
+
+export async function getStatsOverview(period: string = 'all') {
+    return runReport('/stats/overview', { period });
+}
+
+export async function getStatsTimeseries(params: any) {
+    return runReport('/stats/timeseries', params);
 }
 
 export async function getFilteredSessions(filters: any) {
@@ -88,3 +113,56 @@ export async function getFilteredSessions(filters: any) {
     });
     return response.json();
 }
+
+// Subscribe to session_started / session_ended events for a station by
+// long polling /sessions/events. The server repeats recent events until
+// they can no longer be overtaken by a late commit, so ids already
+// delivered are skipped. Returns an unsubscribe function.
+export function subscribeSessionEvents(
+    stationName: string,
+    onEvent: (type: string, session: any) => void,
+    onReconnect?: () => void
+) {
+    const controller = new AbortController();
+    let cursor = '';
+    let seen = '';
+    let delivered = new Set<number>();
+
+    const connect = async () => {
+        let connected = false;
+        while (!controller.signal.aborted) {
+            let wait = 0;
+            try {
+                const query = new URLSearchParams({ station_name: stationName, cursor, seen }).toString();
+                const response = await fetch(`${API_BASE_URL}/sessions/events?${query}`, {
+                    headers: getHeaders(),
+                    signal: controller.signal
+                });
+                if (!response.ok) throw new Error(`Poll failed: ${response.status}`);
+                const body = await response.json();
+                if (!connected) {
+                    connected = true;
+                    if (onReconnect) onReconnect();
+                }
+                for (const event of body.events) {
+                    if (delivered.has(event.id)) continue;
+                    delivered.add(event.id);
+                    onEvent(event.event, event.session);
+                }
+                cursor = String(body.cursor);
+                seen = String(body.seen);
+                delivered = new Set(Array.from(delivered).filter(id => id > body.cursor));
+                wait = body.retry_ms;
+            } catch (error) {
+                if (controller.signal.aborted) return;
+                console.error("Session events error", error);
+                connected = false;
+                wait = 3000;
+            }
+            if (wait) await new Promise(resolve => setTimeout(resolve, wait));
+        }
+    };
+
+    connect();
+    return () => controller.abort();
+}